@@ -4,6 +4,7 @@ import sys
 import argparse
 import pprint
 import dotplot
+import parse_cache
 import copy
 import re
 import plotly.graph_objects as go
@@ -11,6 +12,9 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.io as pio
 import json
+import itertools
+import region_index
+import numpy as np
 
 pp = pprint.PrettyPrinter(indent=2)
 
@@ -20,24 +24,189 @@ y_axis = {
 	"repeat": 3,
 	"chrom": 4
 }
-
-class repeat_data():
-	def __init__(self, chrom, start, end, desc):
-		self.chrom = chrom
-		self.start = start
-		self.end = end
-		self.desc = desc
-	def __str__(self):
-		return f"chromosome: {self.chrom}, start: {self.start}, end: {self.end}, description:{self.desc}"
-
-def bed_parser(bed_file_name):
-	retArray = []
-	with open(bed_file_name, "r") as f:
-		for each_line in f:
-			line = each_line.strip().split("\t")
-			tmpbed = repeat_data(line[0], int(line[1]), int(line[2]), line[3])
-			retArray.append(tmpbed)
-	return retArray
+FIGURE_WIDTH = 2000
+
+BED_CHUNK_LINES = 1 << 16
+REPEAT_CLASS_ROWS = 8
+REPEAT_INTERVAL_LIMIT = 200000
+
+
+def bed_parser(bed_file_name, class_column = None):
+	# Streams a plain or gzip BED into an annotation_table one chunk of lines at a time. The 4th
+	# column (repeat description) becomes the annotation name and the repeat class the annotation
+	# type: column class_column (1-based) if given, else the class of a RepeatMasker style
+	# "name#class/family" name.
+	chrom_index = {}
+	type_index = {}
+	columns = {"chrom": [], "start": [], "end": [], "type": [], "name_length": []}
+	# names go straight into one UTF-8 buffer, chunk by chunk, so no Python str outlives its chunk
+	name_bytes = bytearray()
+	lines = region_index.iter_lines(bed_file_name)
+	while True:
+		chunk = [line.rstrip("\n").split("\t") for line in itertools.islice(lines, BED_CHUNK_LINES)]
+		if not chunk:
+			break
+		chunk = [fields for fields in chunk if len(fields) >= 3 and not fields[0].startswith(("#", "track", "browser"))]
+		chunk_names = [fields[3] if len(fields) > 3 else "" for fields in chunk]
+		if class_column is not None:
+			classes = [fields[class_column - 1] if len(fields) >= class_column else "" for fields in chunk]
+		else:
+			classes = [name.partition("#")[2].split("/")[0] for name in chunk_names]
+		columns["chrom"].append(np.fromiter((chrom_index.setdefault(fields[0], len(chrom_index)) for fields in chunk), dtype = np.int32, count = len(chunk)))
+		columns["start"].append(np.array([fields[1] for fields in chunk]).astype(np.int64))
+		columns["end"].append(np.array([fields[2] for fields in chunk]).astype(np.int64))
+		columns["type"].append(np.fromiter((type_index.setdefault(name, len(type_index)) if name else -1 for name in classes), dtype = np.int32, count = len(chunk)))
+		encoded = [name.encode() for name in chunk_names]
+		columns["name_length"].append(np.fromiter(map(len, encoded), dtype = np.int64, count = len(encoded)))
+		name_bytes += b"".join(encoded)
+	empty = {"chrom": np.int32, "start": np.int64, "end": np.int64, "type": np.int32, "name_length": np.int64}
+	chrom, start, end, annotation_type, name_length = [np.concatenate(columns[key]) if columns[key] else np.zeros(0, dtype = empty[key]) for key in ["chrom", "start", "end", "type", "name_length"]]
+	name_offsets = np.zeros(len(name_length) + 1, dtype = np.int64)
+	np.cumsum(name_length, out = name_offsets[1:])
+	return dotplot.annotation_table(list(chrom_index), list(type_index), chrom, start, end, annotation_type, np.frombuffer(name_bytes, dtype = np.uint8).copy(), name_offsets)
+
+
+def binned_coverage(table, chrom_names, lengths, bin_size):
+	# Repeat bp in every bin_size bin of the chromosomes chrom_names (lengths in bp), per repeat class:
+	# row k is annotation type k and the last row the intervals without a class. The bins fully
+	# inside an interval get bin_size through a +/- pair in a difference array over the bins, the
+	# partial bins at both ends get their overlap directly. Returns the (classes + 1, bins)
+	# coverage and the first bin of every chromosome.
+	bin_counts = [-(-int(length) // bin_size) for length in lengths]
+	bin_offsets = np.concatenate(([0], np.cumsum(bin_counts))).astype(np.int64)
+	total = int(bin_offsets[-1])
+	chrom_slot = np.full(len(table.chrom_names), -1, dtype = np.int64)
+	chrom_length = np.zeros(len(table.chrom_names), dtype = np.int64)
+	for slot, (name, length) in enumerate(zip(chrom_names, lengths)):
+		code = table.chrom_code(name)
+		if code >= 0:
+			chrom_slot[code] = slot
+			chrom_length[code] = length
+	slot = chrom_slot[table.chrom]
+	keep = slot >= 0
+	start = np.clip(table.start[keep], 0, chrom_length[table.chrom[keep]])
+	end = np.clip(table.end[keep], 0, chrom_length[table.chrom[keep]])
+	nonempty = end > start
+	start, end = start[nonempty], end[nonempty]
+	row_count = len(table.type_names) + 1
+	annotation_type = table.annotation_type[keep][nonempty]
+	# flat index of (class row, global bin) with one spare bin per row for the difference array
+	row_base = np.where(annotation_type < 0, row_count - 1, annotation_type).astype(np.int64) * (total + 1) + bin_offsets[slot[keep][nonempty]]
+	first_bin = start // bin_size
+	last_bin = (end - 1) // bin_size
+	size = row_count * (total + 1)
+	same = first_bin == last_bin
+	partial = np.bincount(row_base[same] + first_bin[same], weights = end[same] - start[same], minlength = size)
+	split = ~same
+	partial += np.bincount(row_base[split] + first_bin[split], weights = (first_bin[split] + 1) * bin_size - start[split], minlength = size)
+	partial += np.bincount(row_base[split] + last_bin[split], weights = end[split] - last_bin[split] * bin_size, minlength = size)
+	diff = np.bincount(row_base[split] + first_bin[split] + 1, minlength = size) - np.bincount(row_base[split] + last_bin[split], minlength = size)
+	full = np.cumsum(diff.reshape(row_count, total + 1), axis = 1) * bin_size
+	return (partial.reshape(row_count, total + 1) + full)[:, :total], bin_offsets
+
+
+def chromosome_offsets(chrom_names, chr_list, start_coordinate):
+	# code -> genome-wide offset of the chromosomes of chr_list ("chrN" names), NaN for the others
+	return np.array([start_coordinate[name[3:]] if name.startswith("chr") and name[3:] in chr_list else np.nan for name in chrom_names], dtype = np.float64)
+
+
+def chain_ribbons(table, ref_offsets, ref_y, query_offsets, query_y):
+	# Ribbon polygons and covered segments of every block of a columnar chain (alignment_table),
+	# with the chromosome offsets looked up by code. Blocks between different chromosomes or on
+	# chromosomes without an offset are skipped. Each ribbon is
+	#	ref_start (ref_y) -> query_start (query_y) -> query_end (query_y) -> ref_end (ref_y) -> ref_start
+	# and every polygon and segment is followed by NaN. Returns ribbon x, ribbon y and the x of the
+	# reference and query segments.
+	ref_offset = ref_offsets[table.ref_chrom]
+	query_offset = query_offsets[table.query_chrom]
+	keep = ~np.isnan(ref_offset) & ~np.isnan(query_offset) & (table.ref_chrom == table.query_chrom)
+	ref_start = ref_offset[keep] + table.ref_start[keep]
+	ref_end = ref_offset[keep] + table.ref_end[keep]
+	query_start = query_offset[keep] + table.query_start[keep]
+	query_end = query_offset[keep] + table.query_end[keep]
+	separator = np.full(len(ref_start), np.nan)
+	ribbon_x = np.column_stack([ref_start, query_start, query_end, ref_end, ref_start, separator]).ravel()
+	ribbon_y = np.tile(np.array([ref_y, query_y, query_y, ref_y, ref_y, np.nan], dtype = np.float64), len(ref_start))
+	ref_x = np.column_stack([ref_start, ref_end, separator]).ravel()
+	query_x = np.column_stack([query_start, query_end, separator]).ravel()
+	return ribbon_x, ribbon_y, ref_x, query_x
+
+
+def chain_traces(table, chr_list, ref_coordinate, ref_y, query_coordinate, query_y, color, name):
+	# ribbons between the two genomes and the covered segments on both chromosome lines
+	ribbon_x, ribbon_y, ref_x, query_x = chain_ribbons(table, chromosome_offsets(table.chrom_names, chr_list, ref_coordinate), ref_y, chromosome_offsets(table.chrom_names, chr_list, query_coordinate), query_y)
+	traces = [go.Scattergl(x=ribbon_x, y=ribbon_y, mode='lines', line = dict(width=1,color=color), opacity = 0.7)]
+	# GRCh37 (lower) segments first
+	for side, segment_x in sorted([(query_y, query_x), (ref_y, ref_x)], key = lambda side_x: side_x[0]):
+		segment_y = np.tile(np.array([side * y_axis["chain"], side * y_axis["chain"], np.nan]), len(segment_x) // 3)
+		traces.append(go.Scattergl(x=segment_x, y=segment_y, line = dict(width=2,color=color), opacity = 0.7, name = name, marker_line_width = 2, marker_size = 4, marker_symbol = "line-ns", mode = "markers+lines"))
+	return traces
+
+
+def repeat_traces(repeat_data, chr_list, start_coordinate, length_dict, y, name, bin_size, interval_limit = REPEAT_INTERVAL_LIMIT):
+	# Repeats of the listed chromosomes on the genome-wide axis. Up to interval_limit intervals are
+	# drawn one by one; more become a heatmap of the repeat fraction of every bin_size bin, with a
+	# row per repeat class (the REPEAT_CLASS_ROWS - 1 largest ones, the rest as "other").
+	chrom_names = [f"chr{key}" for key in chr_list]
+	repeat_index = dotplot.annotation_index(repeat_data)
+	rows = [repeat_index.rows(chrom) for chrom in chrom_names]
+	if sum(map(len, rows)) <= interval_limit:
+		repeat_x = []
+		name_list = []
+		for key, chrom_rows in zip(chr_list, rows):
+			chrom_data = repeat_data.take(chrom_rows)
+			repeat_x.extend((start_coordinate[key] + np.column_stack([chrom_data.start, chrom_data.end, np.full(len(chrom_data), np.nan)]).ravel()).tolist())
+			name_list.extend(label for each_name in chrom_data.names() for label in (each_name, each_name, None))
+		return [go.Scattergl(
+				x = repeat_x,
+				y = [y, y, None] * (len(repeat_x) // 3),
+				line = dict(width = 5, color = "midnightblue"),
+				name = name,
+				text = name_list,
+				opacity = 0.7,
+				mode = "lines",
+				textposition = "bottom center",
+				showlegend = False
+				)]
+	lengths = [length_dict[key] for key in chr_list]
+	coverage, bin_offsets = binned_coverage(repeat_data, chrom_names, lengths, bin_size)
+	class_names = repeat_data.type_names + ["repeat" if not repeat_data.type_names else "unclassified"]
+	order = np.argsort(-coverage.sum(axis = 1), kind = "stable")
+	order = order[coverage[order].sum(axis = 1) > 0]
+	if len(order) > REPEAT_CLASS_ROWS:
+		shown = list(order[:REPEAT_CLASS_ROWS - 1])
+		coverage = np.vstack([coverage[shown], coverage[order[REPEAT_CLASS_ROWS - 1:]].sum(axis = 0)])
+		class_names = [class_names[k] for k in shown] + ["other"]
+	else:
+		coverage = coverage[order]
+		class_names = [class_names[k] for k in order]
+	# bin centres on the genome-wide axis, and an empty column in every gap between chromosomes
+	x = []
+	z = []
+	for key, length, first, last in zip(chr_list, lengths, bin_offsets[:-1], bin_offsets[1:]):
+		bin_start = np.arange(last - first) * bin_size
+		width = np.minimum(bin_start + bin_size, length) - bin_start
+		x.append(start_coordinate[key] + bin_start + width / 2)
+		x.append([start_coordinate[key] + length + bin_size])
+		z.append(np.minimum(coverage[:, first:last] / width, 1.0))
+		z.append(np.full((len(coverage), 1), np.nan))
+	step = 0.8 / max(len(class_names), 1)
+	row_y = [y + np.sign(y) * step * k for k in range(len(class_names))]
+	z = np.hstack(z) if z else np.zeros((len(class_names), 0))
+	if y < 0:
+		row_y, z, class_names = row_y[::-1], z[::-1], class_names[::-1]
+	return [go.Heatmap(
+			x = np.concatenate(x),
+			y = row_y,
+			z = z,
+			text = [[class_name] * z.shape[1] for class_name in class_names],
+			hovertemplate = "%{text}: %{z:.0%}<extra></extra>",
+			zmin = 0,
+			zmax = 1,
+			colorscale = "Blues",
+			showscale = False,
+			name = name
+			)]
 
 
 
@@ -47,6 +216,7 @@ def main():
 	#parser.add_argument("grch37gene", metavar='grch37_gene', type=str, help='GRCh37 gene annotation(gff3)')
 	#parser.add_argument("grch38gene", metavar='grch38_gene', type=str, help='GRCh38 gene annotation(gff3)')
 	parser.add_argument("config", metavar='config', type=str, help='config file')
+	parser.add_argument("--no-cache", dest='no_cache', action='store_true', help='do not read or write the parse cache')
 
 	args = parser.parse_args()
 	config = None
@@ -60,12 +230,21 @@ def main():
 	grch37_repeat_filename = config.get("hg19 repeat")
 	grch38_repeat_filename = config.get("hg38 repeat")
 
-	chain_from_19 = dotplot.chain_parser(chain_from_19_file_name) if chain_from_19_file_name is not None else None
-	chain_from_38 = dotplot.chain_parser(chain_from_38_file_name) if chain_from_38_file_name is not None else None
-	grch37_gene_data = dotplot.gff3_parser(grch37_gene_filename, None) if grch37_gene_filename is not None else None
-	grch38_gene_data = dotplot.gff3_parser(grch38_gene_filename, None) if grch38_gene_filename is not None else None
-	grch37_repeat_data = bed_parser(grch37_repeat_filename) if grch37_repeat_filename is not None else None
-	grch38_repeat_data = bed_parser(grch38_repeat_filename) if grch38_repeat_filename is not None else None
+	use_cache = not args.no_cache
+	def cached_gff3(filename):
+		return parse_cache.cached(dotplot.annotation_table, filename, "gff3_parser", {"ref_or_query": None, "chrom": None}, lambda: dotplot.gff3_parser(filename, None), enabled = use_cache)
+	repeat_class_column = config.get("repeat class column")
+	def cached_bed(filename):
+		return parse_cache.cached(dotplot.annotation_table, filename, "bed_parser", {"class_column": repeat_class_column}, lambda: bed_parser(filename, repeat_class_column), enabled = use_cache)
+
+	# one ribbon per block is far more than the genome-wide view can show; merge blocks across small gaps
+	chain_merge_gap = config.get("chain merge gap")
+	chain_from_19 = dotplot.load_chain(chain_from_19_file_name, use_cache = use_cache, merge_gap = chain_merge_gap) if chain_from_19_file_name is not None else None
+	chain_from_38 = dotplot.load_chain(chain_from_38_file_name, use_cache = use_cache, merge_gap = chain_merge_gap) if chain_from_38_file_name is not None else None
+	grch37_gene_data = cached_gff3(grch37_gene_filename) if grch37_gene_filename is not None else None
+	grch38_gene_data = cached_gff3(grch38_gene_filename) if grch38_gene_filename is not None else None
+	grch37_repeat_data = cached_bed(grch37_repeat_filename) if grch37_repeat_filename is not None else None
+	grch38_repeat_data = cached_bed(grch38_repeat_filename) if grch38_repeat_filename is not None else None
 
 	chr_list = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "X", "Y"]
 	if config.get("chromosome list") is not None:
@@ -105,118 +284,18 @@ def main():
 		current_coordinate_38 += length_38 + length_dict_38["1"] * 0.1
 
 
+	pixel_bp = max(current_coordinate_37, current_coordinate_38) / FIGURE_WIDTH
+
+
 ###Add chain(from 19 to 38) line
+	# the chain target is the query of the table, so the hg38 side of hg19ToHg38 is the reference
 	if chain_from_19 is not None:
-		chain_line_scatter = []
-		chr_list_for_chain = [f"chr{x}" for x in chr_list]
-		x = []
-		y = []
-		covered_by_chain_37_x = []
-		covered_by_chain_38_x = []
-		covered_by_chain_37_y = []
-		covered_by_chain_38_y = []
-		for each_chain in chain_from_19:
-			if each_chain.ref_chrom not in chr_list_for_chain or each_chain.query_chrom not in chr_list_for_chain:
-				continue
-			if each_chain.ref_chrom != each_chain.query_chrom:
-				continue
-			"""
-			       38 start      1          4
-			GRCh38 |-------------*----------*-----------------| y = 1 ref
-			                                                           ^
-			                                                           |
-			GRCh37 |--------------*----------*----------------| y = 0 query
-			       37 start       2          3
-			"""
-			q_key = each_chain.query_chrom.replace("chr", "")
-			r_key = each_chain.ref_chrom.replace("chr", "")
-			x.append(start_coordinate_38[r_key] + each_chain.ref_start)
-			x.append(start_coordinate_37[q_key] + each_chain.query_start)
-			x.append(start_coordinate_37[q_key] + each_chain.query_end)
-			x.append(start_coordinate_38[r_key] + each_chain.ref_end)
-			x.append(start_coordinate_38[r_key] + each_chain.ref_start)
-			x.append(None)
-			y.append(1)
-			y.append(-1)
-			y.append(-1)
-			y.append(1)
-			y.append(1)
-			y.append(None)
-			covered_by_chain_37_x.append(start_coordinate_37[q_key] + each_chain.query_start)
-			covered_by_chain_37_x.append(start_coordinate_37[q_key] + each_chain.query_end)
-			covered_by_chain_37_x.append(None)
-			covered_by_chain_38_x.append(start_coordinate_38[r_key] + each_chain.ref_start)
-			covered_by_chain_38_x.append(start_coordinate_38[r_key] + each_chain.ref_end)
-			covered_by_chain_38_x.append(None)
-			covered_by_chain_37_y.append(-1*y_axis["chain"])
-			covered_by_chain_37_y.append(-1*y_axis["chain"])
-			covered_by_chain_37_y.append(None)
-			covered_by_chain_38_y.append(y_axis["chain"])
-			covered_by_chain_38_y.append(y_axis["chain"])
-			covered_by_chain_38_y.append(None)
-
-		chain_line_scatter.append(go.Scattergl(x=x, y=y, mode='lines', line = dict(width=1,color="#66FFCC"), opacity = 0.7))
-		chain_line_scatter.append(go.Scattergl(x=covered_by_chain_37_x, y=covered_by_chain_37_y, line = dict(width=2,color="#66FFCC"), opacity = 0.7, name = "chain from 19 to 38", marker_line_width = 2, marker_size = 4, marker_symbol = "line-ns", mode = "markers+lines"))
-		chain_line_scatter.append(go.Scattergl(x=covered_by_chain_38_x, y=covered_by_chain_38_y, line = dict(width=2,color="#66FFCC"), opacity = 0.7, name = "chain from 19 to 38", marker_line_width = 2, marker_size = 4, marker_symbol = "line-ns", mode = "markers+lines"))
-
-	chromosome_line_scatter.extend(chain_line_scatter)
+		chromosome_line_scatter.extend(chain_traces(chain_from_19, chr_list, start_coordinate_38, 1, start_coordinate_37, -1, "#66FFCC", "chain from 19 to 38"))
 
 
 ###Add chain(from 38 to 19) line
 	if chain_from_38 is not None:
-		chain_line_scatter = []
-		chr_list_for_chain = [f"chr{x}" for x in chr_list]
-		x = []
-		y = []
-		covered_by_chain_37_x = []
-		covered_by_chain_38_x = []
-		covered_by_chain_37_y = []
-		covered_by_chain_38_y = []
-		for each_chain in chain_from_19:
-			if each_chain.ref_chrom not in chr_list_for_chain or each_chain.query_chrom not in chr_list_for_chain:
-				continue
-			if each_chain.ref_chrom != each_chain.query_chrom:
-				continue
-			"""
-			       38 start      2          3
-			GRCh38 |-------------*----------*-----------------| y = 1 query
-			                                                          |
-			                                                          v
-			GRCh37 |--------------*----------*----------------| y = 0 ref
-			       37 start       1          4
-			"""
-			q_key = each_chain.query_chrom.replace("chr", "")
-			r_key = each_chain.ref_chrom.replace("chr", "")
-			x.append(start_coordinate_37[r_key] + each_chain.query_start)
-			x.append(start_coordinate_38[q_key] + each_chain.ref_start)
-			x.append(start_coordinate_38[q_key] + each_chain.ref_end)
-			x.append(start_coordinate_37[r_key] + each_chain.query_end)
-			x.append(start_coordinate_37[r_key] + each_chain.query_start)
-			x.append(None)
-			y.append(-1)
-			y.append(1)
-			y.append(1)
-			y.append(-1)
-			y.append(-1)
-			y.append(None)
-			covered_by_chain_37_x.append(start_coordinate_37[r_key] + each_chain.query_start)
-			covered_by_chain_37_x.append(start_coordinate_37[r_key] + each_chain.query_end)
-			covered_by_chain_37_x.append(None)
-			covered_by_chain_38_x.append(start_coordinate_38[q_key] + each_chain.ref_start)
-			covered_by_chain_38_x.append(start_coordinate_38[q_key] + each_chain.ref_end)
-			covered_by_chain_38_x.append(None)
-			covered_by_chain_37_y.append(-1*y_axis["chain"])
-			covered_by_chain_37_y.append(-1*y_axis["chain"])
-			covered_by_chain_37_y.append(None)
-			covered_by_chain_38_y.append(y_axis["chain"])
-			covered_by_chain_38_y.append(y_axis["chain"])
-			covered_by_chain_38_y.append(None)
-
-		chain_line_scatter.append(go.Scattergl(x=x, y=y, mode='lines', line = dict(width=1,color="#FF6699"), opacity = 0.7))
-		chain_line_scatter.append(go.Scattergl(x=covered_by_chain_37_x, y=covered_by_chain_37_y, line = dict(width=2,color="#FF6699"), opacity = 0.7, name = "chain from 38 to 19", marker_line_width = 2, marker_size = 4, marker_symbol = "line-ns", mode = "markers+lines"))
-		chain_line_scatter.append(go.Scattergl(x=covered_by_chain_38_x, y=covered_by_chain_38_y, line = dict(width=2,color="#FF6699"), opacity = 0.7, name = "chain from 38 to 19", marker_line_width = 2, marker_size = 4, marker_symbol = "line-ns", mode = "markers+lines"))
-
-	chromosome_line_scatter.extend(chain_line_scatter)
+		chromosome_line_scatter.extend(chain_traces(chain_from_38, chr_list, start_coordinate_37, -1, start_coordinate_38, 1, "#FF6699", "chain from 38 to 19"))
 
 
 ### Add gene(19)
@@ -225,25 +304,14 @@ def main():
 		grch37_x = []
 		grch37_y = []
 		name_list = []
-		count = 0
-		for each_anno in grch37_gene_data:
-			chrm = each_anno.chrom
-			if not chrm in chr_list:
-				continue
-			offset = start_coordinate_37[chrm]
-			length = each_anno.end - each_anno.start
-			grch37_x.append(offset + each_anno.start)
-			grch37_x.append(offset + each_anno.end)
-			grch37_x.append(None)
-			grch37_y.append(-1*y_axis["gene"] - (count % 10) / 10.0)
-			grch37_y.append(-1*y_axis["gene"] - (count % 10) / 10.0)
-			#grch37_y.append(0)
-			#grch37_y.append(0)
-			grch37_y.append(None)
-			name_list.append(each_anno.name)
-			name_list.append(each_anno.name)
-			name_list.append("")
-			count += 1
+		# only the rows of the listed chromosomes are read from the sorted index, and each
+		# chromosome is packed into lanes at the resolution of the genome-wide figure
+		gene_index = dotplot.annotation_index(grch37_gene_data)
+		for chrm in chr_list:
+			positions, lanes, names = dotplot.annotation_track_points(grch37_gene_data.take(gene_index.rows(chrm)), pixel_bp, lane_count = 10)
+			grch37_x.extend((start_coordinate_37[chrm] + positions).tolist())
+			grch37_y.extend((-1*y_axis["gene"] - lanes / 10.0).tolist())
+			name_list.extend(names)
 		tmp = go.Scattergl(
 				x = grch37_x,
 				y = grch37_y,
@@ -266,23 +334,14 @@ def main():
 		grch38_x = []
 		grch38_y = []
 		name_list = []
-		count = 0
-		for each_anno in grch38_gene_data:
-			chrm = each_anno.chrom
-			if not chrm in chr_list:
-				continue
-			offset = start_coordinate_38[chrm]
-			length = each_anno.end - each_anno.start
-			grch38_x.append(offset + each_anno.start)
-			grch38_x.append(offset + each_anno.end)
-			grch38_x.append(None)
-			grch38_y.append(y_axis["gene"] + (count % 10) / 10.0)
-			grch38_y.append(y_axis["gene"] + (count % 10) / 10.0)
-			grch38_y.append(None)
-			name_list.append(each_anno.name)
-			name_list.append(each_anno.name)
-			name_list.append("")
-			count += 1
+		# only the rows of the listed chromosomes are read from the sorted index, and each
+		# chromosome is packed into lanes at the resolution of the genome-wide figure
+		gene_index = dotplot.annotation_index(grch38_gene_data)
+		for chrm in chr_list:
+			positions, lanes, names = dotplot.annotation_track_points(grch38_gene_data.take(gene_index.rows(chrm)), pixel_bp, lane_count = 10)
+			grch38_x.extend((start_coordinate_38[chrm] + positions).tolist())
+			grch38_y.extend((y_axis["gene"] + lanes / 10.0).tolist())
+			name_list.extend(names)
 		tmp = go.Scattergl(
 				x = grch38_x,
 				y = grch38_y,
@@ -300,89 +359,23 @@ def main():
 
 
 ### Add repeat(19)
+	# genome-wide RepeatMasker tracks hold millions of intervals, so they are binned unless few
+	repeat_bin_size = config.get("repeat bin size") or max(int(pixel_bp), 1)
+	repeat_interval_limit = config.get("repeat interval limit", REPEAT_INTERVAL_LIMIT)
 	if grch37_repeat_data is not None:
-		repeat_x = []
-		repeat_y = []
-		name_list = []
-		for each_bed in grch37_repeat_data:
-			if each_bed.chrom not in chr_list_for_chain:
-				continue
-			chrm = each_bed.chrom.replace("chr", "")
-			if chrm == "X":
-				chrom = 23
-			if chrm == "Y":
-				chrom = 24
-			offset = start_coordinate_37[chrm]
-			repeat_x.append(offset + each_bed.start)
-			repeat_x.append(offset + each_bed.end)
-			repeat_x.append(None)
-			repeat_y.append(-1 * y_axis["repeat"])
-			repeat_y.append(-1 * y_axis["repeat"])
-			repeat_y.append(None)
-			name_list.append(each_bed.desc)
-			name_list.append(each_bed.desc)
-			name_list.append(None)
-		tmp = go.Scattergl(
-				x = repeat_x,
-				y = repeat_y,
-				line = dict(width = 5, color = "midnightblue"),
-				#marker_line_color = "midnightblue", marker_color = "midnightblue", marker_line_width = 2, marker_size = 4,
-				#marker_symbol = "line-ns",
-				name = "grch37 repeat",
-				text = name_list,
-				opacity = 0.7,
-				mode = "lines",
-				textposition = "bottom center",
-				showlegend = False
-				)
-		chromosome_line_scatter.extend([tmp])
-
+		chromosome_line_scatter.extend(repeat_traces(grch37_repeat_data, chr_list, start_coordinate_37, length_dict_37, -1 * y_axis["repeat"], "grch37 repeat", repeat_bin_size, repeat_interval_limit))
 
 
 ### Add repeat(38)
 	if grch38_repeat_data is not None:
-		repeat_x = []
-		repeat_y = []
-		name_list = []
-		for each_bed in grch38_repeat_data:
-			if each_bed.chrom not in chr_list_for_chain:
-				continue
-			chrm = each_bed.chrom.replace("chr", "")
-			if chrm == "X":
-				chrom = 23
-			if chrm == "Y":
-				chrom = 24
-			offset = start_coordinate_38[chrm]
-			repeat_x.append(offset + each_bed.start)
-			repeat_x.append(offset + each_bed.end)
-			repeat_x.append(None)
-			repeat_y.append(y_axis["repeat"])
-			repeat_y.append(y_axis["repeat"])
-			repeat_y.append(None)
-			name_list.append(each_bed.desc)
-			name_list.append(each_bed.desc)
-			name_list.append(None)
-		tmp = go.Scattergl(
-				x = repeat_x,
-				y = repeat_y,
-				line = dict(width = 5, color = "midnightblue"),
-				#marker_line_color = "midnightblue", marker_color = "midnightblue", marker_line_width = 2, marker_size = 4,
-				#marker_symbol = "line-ns",
-				name = "grch38 repeat",
-				text = name_list,
-				opacity = 0.7,
-				mode = "lines",
-				textposition = "bottom center",
-				showlegend = False
-				)
-		chromosome_line_scatter.extend([tmp])
+		chromosome_line_scatter.extend(repeat_traces(grch38_repeat_data, chr_list, start_coordinate_38, length_dict_38, y_axis["repeat"], "grch38 repeat", repeat_bin_size, repeat_interval_limit))
 
 
 
 
 	fig = go.Figure(data = chromosome_line_scatter)
 
-	fig.update_layout(height=600, width=2000, title_text="上が38")
+	fig.update_layout(height=600, width=FIGURE_WIDTH, title_text="上が38")
 	fig.update_yaxes(fixedrange=True, visible=False)
 
 	#fig.update_xaxes(visible=False)
@@ -15,6 +15,16 @@ pp = pprint.PrettyPrinter(indent=2)
 import re
 import json
 import gzip
+import os
+import concurrent.futures
+import heapq
+import http.server
+import urllib.parse
+import region_index
+import parse_cache
+import raster
+from array import array
+import numpy as np
 
 
 class paf_data():
@@ -47,151 +57,940 @@ class annotation_data():
 	def __str__(self):
 		return f"{self.ref_or_query}\t{self.chrom}:{self.start}-{self.end}\t{self.annotation_type}\t{self.name}"
 
-def chain_parser(filename, switchflag = False):
-	ret_array = []
-	score = 0
-	tName = ""
-	tSize = 0
-	tStart = 0
-	tEnd = 0
-	qName = ""
-	qSize = 0
-	qStrand = ""
-	qStart = 0
-	qEnd = 0
-	id_ = 0
-	ref_current_pos = 0
-	query_current_pos = 0
-	with open(filename) as f:
+
+class annotation_table():
+	# Columnar store of annotations. Chromosomes and annotation types are interned (type code -1
+	# is None), names are one UTF-8 buffer and row i owns name_bytes[name_offsets[i]:name_offsets[i + 1]].
+	def __init__(self, chrom_names, type_names, chrom, start, end, annotation_type, name_bytes, name_offsets, ref_or_query = None):
+		self.chrom_names = chrom_names
+		self.type_names = type_names
+		self.chrom = chrom
+		self.start = start
+		self.end = end
+		self.annotation_type = annotation_type
+		self.name_bytes = name_bytes
+		self.name_offsets = name_offsets
+		self.ref_or_query = ref_or_query
+		self._chrom_index = None
+
+	def __len__(self):
+		return len(self.start)
+
+	def __str__(self):
+		return f"annotation_table: {len(self)} annotations, {len(self.chrom_names)} chromosomes, {self.ref_or_query}"
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.row(i)
+
+	def __getitem__(self, key):
+		if isinstance(key, (int, np.integer)):
+			if key < 0:
+				key += len(self)
+			if not 0 <= key < len(self):
+				raise IndexError("annotation_table index out of range")
+			return self.row(int(key))
+		return self.take(key)
+
+	def chrom_code(self, name):
+		if self._chrom_index is None:
+			self._chrom_index = {each_name: i for i, each_name in enumerate(self.chrom_names)}
+		return self._chrom_index.get(name, -1)
+
+	def name(self, i):
+		return bytes(self.name_bytes[self.name_offsets[i]:self.name_offsets[i + 1]]).decode()
+
+	def names(self):
+		buffer = bytes(self.name_bytes)
+		offsets = self.name_offsets.tolist()
+		return [buffer[offsets[i]:offsets[i + 1]].decode() for i in range(len(self))]
+
+	def row(self, i):
+		type_code = self.annotation_type[i]
+		return annotation_data(
+			self.chrom_names[self.chrom[i]],
+			int(self.start[i]),
+			int(self.end[i]),
+			self.name(i),
+			None if type_code < 0 else self.type_names[type_code],
+			self.ref_or_query)
+
+	def take(self, key):
+		key = np.arange(len(self))[key] if isinstance(key, slice) else np.asarray(key)
+		if key.dtype == bool:
+			key = np.flatnonzero(key)
+		key = key.astype(np.int64, copy = False)
+		name_lengths = self.name_offsets[key + 1] - self.name_offsets[key]
+		new_offsets = np.zeros(len(key) + 1, dtype = np.int64)
+		np.cumsum(name_lengths, out = new_offsets[1:])
+		byte_index = np.arange(new_offsets[-1], dtype = np.int64) + np.repeat(self.name_offsets[key] - new_offsets[:-1], name_lengths)
+		return annotation_table(
+			self.chrom_names, self.type_names,
+			self.chrom[key], self.start[key], self.end[key], self.annotation_type[key],
+			self.name_bytes[byte_index], new_offsets,
+			ref_or_query = self.ref_or_query)
+
+	def filter_mask(self, chrom_filter = None):
+		if chrom_filter is None:
+			return np.ones(len(self), dtype = bool)
+		return np.array([chrom_filter(name) for name in self.chrom_names], dtype = bool)[self.chrom]
+
+	def to_columns(self):
+		columns = {name: getattr(self, name) for name in ["chrom", "start", "end", "annotation_type", "name_bytes", "name_offsets"]}
+		meta = {"chrom_names": self.chrom_names, "type_names": self.type_names, "ref_or_query": None if self.ref_or_query is None else self.ref_or_query.name}
+		return columns, meta
+
+	@classmethod
+	def from_columns(cls, columns, meta):
+		return cls(meta["chrom_names"], meta["type_names"], columns["chrom"], columns["start"], columns["end"], columns["annotation_type"], columns["name_bytes"], columns["name_offsets"], ref_or_query = None if meta["ref_or_query"] is None else ref_or_query[meta["ref_or_query"]])
+
+
+class annotation_table_builder():
+	def __init__(self, ref_or_query = None):
+		self.ref_or_query = ref_or_query
+		self.chrom_names = []
+		self.chrom_index = {}
+		self.type_names = []
+		self.type_index = {}
+		self.chrom = array("i")
+		self.start = array("q")
+		self.end = array("q")
+		self.annotation_type = array("i")
+		self.name_bytes = bytearray()
+		self.name_offsets = array("q", [0])
+
+	def append(self, chrom, start, end, name, annotation_type = None):
+		code = self.chrom_index.get(chrom)
+		if code is None:
+			code = self.chrom_index[chrom] = len(self.chrom_names)
+			self.chrom_names.append(chrom)
+		type_code = -1
+		if annotation_type is not None:
+			type_code = self.type_index.get(annotation_type)
+			if type_code is None:
+				type_code = self.type_index[annotation_type] = len(self.type_names)
+				self.type_names.append(annotation_type)
+		self.chrom.append(code)
+		self.start.append(start)
+		self.end.append(end)
+		self.annotation_type.append(type_code)
+		self.name_bytes += name.encode()
+		self.name_offsets.append(len(self.name_bytes))
+
+	def build(self):
+		return annotation_table(
+			self.chrom_names,
+			self.type_names,
+			np.frombuffer(self.chrom, dtype = np.int32).copy(),
+			np.frombuffer(self.start, dtype = np.int64).copy(),
+			np.frombuffer(self.end, dtype = np.int64).copy(),
+			np.frombuffer(self.annotation_type, dtype = np.int32).copy(),
+			np.frombuffer(bytes(self.name_bytes), dtype = np.uint8).copy(),
+			np.frombuffer(self.name_offsets, dtype = np.int64).copy(),
+			ref_or_query = self.ref_or_query)
+
+class annotation_index():
+	# Sorted interval index over an annotation_table (gtf_parser, gff3_parser or bed_parser output).
+	# Rows are sorted by chromosome and start, and every chromosome keeps the running maximum of
+	# the ends in that order (max-end envelope). The rows overlapping [start, end) lie between the
+	# first row whose envelope passes start and the first row starting at or after end, so a query
+	# is two binary searches plus the rows in between, not a scan of the whole table.
+	def __init__(self, table):
+		self.table = table
+		self.order = np.lexsort((table.start, table.chrom))
+		chrom = table.chrom[self.order]
+		self.start = table.start[self.order]
+		self.end = table.end[self.order]
+		self.chrom_offsets = np.searchsorted(chrom, np.arange(len(table.chrom_names) + 1))
+		# shift each chromosome above the previous one so one accumulate restarts per chromosome
+		shift = chrom.astype(np.int64) << 40
+		self.max_end = np.maximum.accumulate(self.end + shift) - shift if len(table) else self.end
+		self._names = None
+
+	def rows(self, chrom, start = None, end = None):
+		# row indices of the table on chromosome chrom (exact name) overlapping [start, end), in start order
+		code = self.table.chrom_code(chrom)
+		if code < 0:
+			return np.zeros(0, dtype = np.int64)
+		low, high = self.chrom_offsets[code], self.chrom_offsets[code + 1]
+		if start is not None:
+			low += np.searchsorted(self.max_end[low:high], start, side = "right")
+		if end is not None:
+			high = low + np.searchsorted(self.start[low:high], end, side = "left")
+		if start is None:
+			return self.order[low:high]
+		return self.order[low:high][self.end[low:high] > start]
+
+	def query(self, chrm, start = None, end = None):
+		# annotation_table of the rows overlapping the window on chromosome chrm, given as "N" or
+		# "chrN" like chromosome_filter; chrm None is every chromosome
+		if chrm is None and start is None and end is None:
+			return self.table
+		names = self.table.chrom_names if chrm is None else [name for name in self.table.chrom_names if chromosome_filter(chrm)(name)]
+		return self.table.take(np.concatenate([self.rows(name, start, end) for name in names] + [np.zeros(0, dtype = np.int64)]))
+
+
+ANNOTATION_LANES = 12
+
+
+def pack_lanes(start, end, gap = 0):
+	# Lowest free lane of every interval. A sweep over the intervals in start order keeps a heap of
+	# (end, lane) of the occupied lanes and a heap of the freed lanes, so it is O(n log n). A lane
+	# is free again gap bp after the end of its interval.
+	lanes = np.zeros(len(start), dtype = np.int64)
+	busy = []
+	free = []
+	lane_total = 0
+	order = np.argsort(start, kind = "stable")
+	for i, interval_start, interval_end in zip(order.tolist(), start[order].tolist(), end[order].tolist()):
+		while busy and busy[0][0] <= interval_start:
+			heapq.heappush(free, heapq.heappop(busy)[1])
+		if free:
+			lane = heapq.heappop(free)
+		else:
+			lane = lane_total
+			lane_total += 1
+		lanes[i] = lane
+		heapq.heappush(busy, (interval_end + gap, lane))
+	return lanes
+
+
+def merge_intervals(start, end, weights):
+	# union of the intervals: start, end and summed weight of every run of overlapping intervals
+	order = np.argsort(start, kind = "stable")
+	start, end, weights = start[order], end[order], weights[order]
+	if len(start) == 0:
+		return start, end, weights
+	reach = np.maximum.accumulate(end)
+	group_first = np.flatnonzero(np.concatenate(([True], start[1:] > reach[:-1])))
+	group_last = np.append(group_first[1:], len(start)) - 1
+	return start[group_first], reach[group_last], np.add.reduceat(weights, group_first)
+
+
+def annotation_lanes(table, pixel_bp, lane_count = ANNOTATION_LANES):
+	# Lay out an annotation track for a view of pixel_bp bp per pixel. Features shorter than a
+	# pixel that start in the same pixel are collapsed into one summary bar ("N features"), the rest
+	# get the lowest free lane (pack_lanes, one pixel apart). If more than lane_count lanes are
+	# needed, the overflow is merged into summary bars on the last lane. Returns start, end and
+	# lane arrays and the hover names.
+	pixel_bp = max(float(pixel_bp), 1.0)
+	start, end = table.start, table.end
+	small = np.flatnonzero(end - start < pixel_bp)
+	pixel = (start[small] // pixel_bp).astype(np.int64)
+	order = np.argsort(pixel, kind = "stable")
+	small, pixel = small[order], pixel[order]
+	group_size = np.unique(pixel, return_counts = True)[1]
+	shared = np.repeat(group_size > 1, group_size)
+	keep = np.ones(len(table), dtype = bool)
+	keep[small[shared]] = False
+	summary_size = group_size[group_size > 1]
+	summary_first = np.concatenate(([0], np.cumsum(summary_size)[:-1])).astype(np.int64)
+	collapsed = small[shared]
+	summary_start = np.minimum.reduceat(start[collapsed], summary_first) if len(collapsed) else np.zeros(0, dtype = np.int64)
+	summary_end = np.maximum.reduceat(end[collapsed], summary_first) if len(collapsed) else np.zeros(0, dtype = np.int64)
+	rows = np.flatnonzero(keep)
+	all_start = np.concatenate([start[rows], summary_start])
+	all_end = np.concatenate([end[rows], summary_end])
+	names = [table.name(i) for i in rows.tolist()] + [f"{count} features" for count in summary_size.tolist()]
+	lanes = pack_lanes(all_start, all_end, gap = pixel_bp)
+	if len(lanes) and lanes.max() >= lane_count:
+		overflow = lanes >= lane_count - 1
+		counts = np.concatenate([np.ones(len(rows), dtype = np.int64), summary_size])[overflow]
+		over_start, over_end, over_counts = merge_intervals(all_start[overflow], all_end[overflow], counts)
+		names = [name for name, hidden in zip(names, overflow.tolist()) if not hidden] + [f"{count} features" for count in over_counts.tolist()]
+		all_start = np.concatenate([all_start[~overflow], over_start])
+		all_end = np.concatenate([all_end[~overflow], over_end])
+		lanes = np.concatenate([lanes[~overflow], np.full(len(over_start), lane_count - 1, dtype = np.int64)])
+	return all_start, all_end, lanes, names
+
+
+def annotation_track_points(table, pixel_bp, lane_count = ANNOTATION_LANES):
+	# positions, lanes and hover text of annotation_lanes as NaN separated plotly line points
+	start, end, lanes, names = annotation_lanes(table, pixel_bp, lane_count)
+	separator = np.full(len(lanes), np.nan)
+	positions = np.column_stack([start, end, separator]).ravel()
+	lane_points = np.column_stack([lanes, lanes, separator]).ravel()
+	text = [label for name in names for label in (name, name, "")]
+	return positions, lane_points, text
+
+
+CIGAR_OPS = "MIDNSHP=X"
+cigar_op_code = {op: i for i, op in enumerate(CIGAR_OPS)}
+cigar_byte_code = np.full(256, 255, dtype = np.uint8)
+for op, code in cigar_op_code.items():
+	cigar_byte_code[ord(op)] = code
+# walking an op moves the reference (D) or the query (I) or both (anything else)
+cigar_op_moves_ref = np.array([op != "I" for op in CIGAR_OPS], dtype = bool)
+cigar_op_moves_query = np.array([op != "D" for op in CIGAR_OPS], dtype = bool)
+CIGAR_CHUNK_SIZE = 1 << 16
+
+
+def cigar_tokenize(cigar_strings):
+	# Tokenize many CIGAR strings at once: returns ops (codes into CIGAR_OPS), lengths and
+	# per-string offsets into ops, without a Python loop over operations.
+	record_lengths = np.fromiter(map(len, cigar_strings), dtype = np.int64, count = len(cigar_strings))
+	buffer = np.frombuffer("".join(cigar_strings).encode("ascii"), dtype = np.uint8)
+	is_digit = (buffer >= 48) & (buffer <= 57)
+	op_pos = np.flatnonzero(~is_digit)
+	ops = cigar_byte_code[buffer[op_pos]]
+	if np.any(ops == 255):
+		bad = buffer[op_pos[ops == 255][0]]
+		raise ValueError(f"unknown CIGAR operation: {chr(bad)!r}")
+	digit_pos = np.flatnonzero(is_digit)
+	token = np.searchsorted(op_pos, digit_pos)
+	if len(digit_pos) and token[-1] == len(op_pos):
+		raise ValueError("CIGAR string ends with a length but no operation")
+	values = (buffer[digit_pos] - 48).astype(np.int64) * np.power(10, op_pos[token] - digit_pos - 1, dtype = np.int64)
+	value_sum = np.zeros(len(values) + 1, dtype = np.int64)
+	np.cumsum(values, out = value_sum[1:])
+	# digits before the k-th op = op_pos[k] - k
+	lens = np.diff(value_sum[op_pos - np.arange(len(op_pos))], prepend = 0)
+	offsets = np.zeros(len(cigar_strings) + 1, dtype = np.int64)
+	offsets[1:] = np.searchsorted(op_pos, np.cumsum(record_lengths))
+	return ops, lens, offsets
+
+
+class alignment_table():
+	# Columnar store of alignments. One row per alignment, chromosome names are interned to
+	# integer codes shared by reference and query (ref_lengths/query_lengths are indexed by code),
+	# CIGARs of all rows live in one ops/lengths buffer and row i owns
+	# cigar_ops[cigar_offsets[i]:cigar_offsets[i + 1]].
+	def __init__(self, chrom_names, ref_lengths, query_lengths, ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, cigar_ops, cigar_lens, cigar_offsets, dsc = None):
+		self.chrom_names = chrom_names
+		self.ref_lengths = ref_lengths
+		self.query_lengths = query_lengths
+		self.ref_chrom = ref_chrom
+		self.ref_start = ref_start
+		self.ref_end = ref_end
+		self.query_chrom = query_chrom
+		self.query_start = query_start
+		self.query_end = query_end
+		self.rev = rev
+		self.cigar_ops = cigar_ops
+		self.cigar_lens = cigar_lens
+		self.cigar_offsets = cigar_offsets
+		self.dsc = dsc
+		self._chrom_index = None
+
+	@classmethod
+	def empty(cls, dsc = None):
+		return alignment_table_builder(dsc = dsc).build()
+
+	def __len__(self):
+		return len(self.ref_start)
+
+	def __str__(self):
+		return f"alignment_table: {len(self)} alignments, {len(self.cigar_ops)} cigar operations, {len(self.chrom_names)} chromosomes, dsc: {self.dsc}"
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.row(i)
+
+	def __getitem__(self, key):
+		if isinstance(key, (int, np.integer)):
+			if key < 0:
+				key += len(self)
+			if not 0 <= key < len(self):
+				raise IndexError("alignment_table index out of range")
+			return self.row(int(key))
+		return self.take(key)
+
+	@property
+	def nbytes(self):
+		return sum(getattr(self, name).nbytes for name in ["ref_lengths", "query_lengths", "ref_chrom", "ref_start", "ref_end", "query_chrom", "query_start", "query_end", "rev", "cigar_ops", "cigar_lens", "cigar_offsets"])
+
+	def chrom_code(self, name):
+		if self._chrom_index is None:
+			self._chrom_index = {each_name: i for i, each_name in enumerate(self.chrom_names)}
+		return self._chrom_index.get(name, -1)
+
+	def cigar(self, i):
+		start, end = self.cigar_offsets[i], self.cigar_offsets[i + 1]
+		return "".join(f"{length}{CIGAR_OPS[op]}" for op, length in zip(self.cigar_ops[start:end].tolist(), self.cigar_lens[start:end].tolist()))
+
+	def row(self, i):
+		return paf_data(
+			ref_chrom = self.chrom_names[self.ref_chrom[i]],
+			ref_start = int(self.ref_start[i]),
+			ref_end = int(self.ref_end[i]),
+			query_chrom = self.chrom_names[self.query_chrom[i]],
+			query_start = int(self.query_start[i]),
+			query_end = int(self.query_end[i]),
+			cigar = self.cigar(i),
+			rev = "-" if self.rev[i] else "+",
+			dsc = self.dsc
+		)
+
+	def take(self, key):
+		# key is a slice, a boolean mask or an array of row indices
+		if isinstance(key, slice):
+			start, stop, step = key.indices(len(self))
+			if step == 1:
+				stop = max(start, stop)
+				op_start, op_end = self.cigar_offsets[start], self.cigar_offsets[stop]
+				return alignment_table(
+					self.chrom_names, self.ref_lengths, self.query_lengths,
+					self.ref_chrom[start:stop], self.ref_start[start:stop], self.ref_end[start:stop],
+					self.query_chrom[start:stop], self.query_start[start:stop], self.query_end[start:stop],
+					self.rev[start:stop],
+					self.cigar_ops[op_start:op_end], self.cigar_lens[op_start:op_end],
+					self.cigar_offsets[start:stop + 1] - op_start,
+					dsc = self.dsc)
+			key = np.arange(start, stop, step)
+		key = np.asarray(key)
+		if key.dtype == bool:
+			key = np.flatnonzero(key)
+		key = key.astype(np.int64, copy = False)
+		op_counts = self.cigar_offsets[key + 1] - self.cigar_offsets[key]
+		new_offsets = np.zeros(len(key) + 1, dtype = np.int64)
+		np.cumsum(op_counts, out = new_offsets[1:])
+		op_index = np.arange(new_offsets[-1], dtype = np.int64) + np.repeat(self.cigar_offsets[key] - new_offsets[:-1], op_counts)
+		return alignment_table(
+			self.chrom_names, self.ref_lengths, self.query_lengths,
+			self.ref_chrom[key], self.ref_start[key], self.ref_end[key],
+			self.query_chrom[key], self.query_start[key], self.query_end[key],
+			self.rev[key],
+			self.cigar_ops[op_index], self.cigar_lens[op_index],
+			new_offsets,
+			dsc = self.dsc)
+
+	def to_columns(self):
+		columns = {name: getattr(self, name) for name in ["ref_lengths", "query_lengths", "ref_chrom", "ref_start", "ref_end", "query_chrom", "query_start", "query_end", "rev", "cigar_ops", "cigar_lens", "cigar_offsets"]}
+		meta = {"chrom_names": self.chrom_names, "dsc": self.dsc}
+		return columns, meta
+
+	@classmethod
+	def from_columns(cls, columns, meta):
+		return cls(meta["chrom_names"], *[columns[name] for name in ["ref_lengths", "query_lengths", "ref_chrom", "ref_start", "ref_end", "query_chrom", "query_start", "query_end", "rev", "cigar_ops", "cigar_lens", "cigar_offsets"]], dsc = meta["dsc"])
+
+	def chrom_mask(self, ref_chrom = None, query_chrom = None):
+		mask = np.ones(len(self), dtype = bool)
+		if ref_chrom is not None:
+			mask &= self.ref_chrom == self.chrom_code(ref_chrom)
+		if query_chrom is not None:
+			mask &= self.query_chrom == self.chrom_code(query_chrom)
+		return mask
+
+	@classmethod
+	def concatenate(cls, tables, dsc = None):
+		# rows of all tables in order; chromosome codes are re-interned into one name list
+		chrom_names = []
+		chrom_index = {}
+		code_maps = []
+		for table in tables:
+			code_map = np.zeros(len(table.chrom_names), dtype = np.int32)
+			for code, name in enumerate(table.chrom_names):
+				if name not in chrom_index:
+					chrom_index[name] = len(chrom_names)
+					chrom_names.append(name)
+				code_map[code] = chrom_index[name]
+			code_maps.append(code_map)
+		ref_lengths = np.zeros(len(chrom_names), dtype = np.int64)
+		query_lengths = np.zeros(len(chrom_names), dtype = np.int64)
+		for table, code_map in zip(tables, code_maps):
+			np.maximum.at(ref_lengths, code_map, table.ref_lengths)
+			np.maximum.at(query_lengths, code_map, table.query_lengths)
+		op_base = np.cumsum([0] + [len(table.cigar_ops) for table in tables])
+		return cls(
+			chrom_names, ref_lengths, query_lengths,
+			np.concatenate([code_map[table.ref_chrom] for table, code_map in zip(tables, code_maps)] + [np.zeros(0, dtype = np.int32)]),
+			*[np.concatenate([getattr(table, name) for table in tables] + [np.zeros(0, dtype = np.int64)]) for name in ["ref_start", "ref_end"]],
+			np.concatenate([code_map[table.query_chrom] for table, code_map in zip(tables, code_maps)] + [np.zeros(0, dtype = np.int32)]),
+			*[np.concatenate([getattr(table, name) for table in tables] + [np.zeros(0, dtype = np.int64)]) for name in ["query_start", "query_end"]],
+			np.concatenate([table.rev for table in tables] + [np.zeros(0, dtype = bool)]),
+			np.concatenate([table.cigar_ops for table in tables] + [np.zeros(0, dtype = np.uint8)]),
+			np.concatenate([table.cigar_lens for table in tables] + [np.zeros(0, dtype = np.int64)]),
+			np.concatenate([np.zeros(1, dtype = np.int64)] + [table.cigar_offsets[1:] + base for table, base in zip(tables, op_base)]),
+			dsc = dsc)
+
+	def filter_mask(self, ref_filter = None, query_filter = None):
+		# evaluate chromosome predicates once per interned name instead of once per row
+		mask = np.ones(len(self), dtype = bool)
+		if ref_filter is not None:
+			mask &= np.array([ref_filter(name) for name in self.chrom_names], dtype = bool)[self.ref_chrom]
+		if query_filter is not None:
+			mask &= np.array([query_filter(name) for name in self.chrom_names], dtype = bool)[self.query_chrom]
+		return mask
+
+
+class alignment_table_builder():
+	def __init__(self, dsc = None):
+		self.dsc = dsc
+		self.chrom_names = []
+		self.chrom_index = {}
+		self.ref_lengths = array("q")
+		self.query_lengths = array("q")
+		self.ref_chrom = array("i")
+		self.ref_start = array("q")
+		self.ref_end = array("q")
+		self.query_chrom = array("i")
+		self.query_start = array("q")
+		self.query_end = array("q")
+		self.rev = array("b")
+		self.cigar_ops = []
+		self.cigar_lens = []
+		self.cigar_offsets = [np.zeros(1, dtype = np.int64)]
+		self.cigar_count = 0
+		self.pending_cigars = []
+
+	def intern(self, name):
+		code = self.chrom_index.get(name)
+		if code is None:
+			code = len(self.chrom_names)
+			self.chrom_index[name] = code
+			self.chrom_names.append(name)
+			self.ref_lengths.append(0)
+			self.query_lengths.append(0)
+		return code
+
+	def append(self, ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, cigar = None, ref_length = 0, query_length = 0):
+		# cigar None means one ungapped block of the query length
+		ref_code = self.intern(ref_chrom)
+		query_code = self.intern(query_chrom)
+		if ref_length:
+			self.ref_lengths[ref_code] = ref_length
+		if query_length:
+			self.query_lengths[query_code] = query_length
+		self.ref_chrom.append(ref_code)
+		self.ref_start.append(ref_start)
+		self.ref_end.append(ref_end)
+		self.query_chrom.append(query_code)
+		self.query_start.append(query_start)
+		self.query_end.append(query_end)
+		self.rev.append(rev)
+		self.pending_cigars.append(f"{query_end - query_start}M" if cigar is None else cigar)
+		if len(self.pending_cigars) >= CIGAR_CHUNK_SIZE:
+			self.flush_cigars()
+
+	def flush_cigars(self):
+		if not self.pending_cigars:
+			return
+		ops, lens, offsets = cigar_tokenize(self.pending_cigars)
+		self.cigar_ops.append(ops)
+		self.cigar_lens.append(lens)
+		self.cigar_offsets.append(offsets[1:] + self.cigar_count)
+		self.cigar_count += len(ops)
+		self.pending_cigars = []
+
+	def build(self):
+		self.flush_cigars()
+		return alignment_table(
+			self.chrom_names,
+			np.frombuffer(self.ref_lengths, dtype = np.int64).copy(),
+			np.frombuffer(self.query_lengths, dtype = np.int64).copy(),
+			np.frombuffer(self.ref_chrom, dtype = np.int32).copy(),
+			np.frombuffer(self.ref_start, dtype = np.int64).copy(),
+			np.frombuffer(self.ref_end, dtype = np.int64).copy(),
+			np.frombuffer(self.query_chrom, dtype = np.int32).copy(),
+			np.frombuffer(self.query_start, dtype = np.int64).copy(),
+			np.frombuffer(self.query_end, dtype = np.int64).copy(),
+			np.frombuffer(self.rev, dtype = np.int8).astype(bool),
+			np.concatenate(self.cigar_ops) if self.cigar_ops else np.zeros(0, dtype = np.uint8),
+			np.concatenate(self.cigar_lens) if self.cigar_lens else np.zeros(0, dtype = np.int64),
+			np.concatenate(self.cigar_offsets),
+			dsc = self.dsc)
+
+
+def chromosome_filter(chrm):
+	# predicate for the parsers' ref_filter/query_filter/chrom_filter arguments
+	if chrm is None:
+		return None
+	names = {str(chrm), f"chr{chrm}"}
+	return names.__contains__
+
+
+def region_overlaps(region, start, end):
+	return region is None or (start < region[1] and end > region[0])
+
+
+def chromosome_sort_key(name):
+	# natural order: chr2 before chr10, chrX/chrY after the numbered ones
+	return [int(token) if token.isdigit() else token for token in re.split(r'([0-9]+)', name)]
+
+
+def fai_lengths(filename):
+	# {name: length} in the order of a samtools faidx .fai index
+	lengths = {}
+	with open(filename, "r") as f:
 		for line in f:
-			if line.startswith("chain"):
-				chain, score, tName, tSize, tStrand, tStart, tEnd, qName, qSize, qStrand, qStart, qEnd, id_ = line.strip().split()
-				ref_current_pos = int(tStart)
-				query_current_pos = int(qStart)
-			elif line != "\n":
-				block = line.strip().split()
-				ref_start = ref_current_pos
-				query_start = query_current_pos
-				ref_end = ref_start + int(block[0])
-				query_end = query_start + int(block[0])
-				paf_alignment_data = None
-				if switchflag == False:
-					paf_alignment_data = paf_data(
-						query_chrom = tName,
-						query_start = ref_start,
-						query_end = ref_end,
-						ref_chrom = qName,
-						ref_start = query_start,
-						ref_end = query_end,
-						cigar = f"{query_end - query_start}M",
-						rev = qStrand,
-						dsc = filename
-					)
-				else:
-					paf_alignment_data = paf_data(
-						query_chrom = qName,
-						query_start = query_start,
-						query_end = query_end,
-						ref_chrom = tName,
-						ref_start = ref_start,
-						ref_end = ref_end,
-						cigar = f"{query_end - query_start}M",
-						rev = tStrand,
-						dsc = filename
-					)
-				
-				assert(query_end - query_start == ref_end - ref_start), "chain file reports different length between reference and query"
-				ret_array.append(paf_alignment_data)
-				if len(block) == 3:
-					ref_current_pos = ref_end + int(block[1])
-					query_current_pos = query_end + int(block[2])
-	return ret_array
+			cols = line.split("\t")
+			if len(cols) >= 2:
+				lengths[cols[0]] = int(cols[1])
+	return lengths
 
 
+def genome_layout(tables, side, lengths = None):
+	# [(name, offset, length), ...] of the chromosomes of one genome laid end to end: side is "ref"
+	# or "query". With lengths (e.g. from fai_lengths) every sequence in it is laid out in its
+	# order. Otherwise the chromosomes used by the tables are laid out in natural order, with the
+	# lengths of PAF columns 2/7 or the chain headers, raised to the largest aligned coordinate.
+	if lengths is None:
+		lengths = {}
+		for table in tables:
+			chrom = table.ref_chrom if side == "ref" else table.query_chrom
+			table_lengths = np.array(table.ref_lengths if side == "ref" else table.query_lengths, dtype = np.int64)
+			np.maximum.at(table_lengths, chrom, table.ref_end if side == "ref" else table.query_end)
+			for code in np.unique(chrom).tolist():
+				name = table.chrom_names[code]
+				lengths[name] = max(lengths.get(name, 0), int(table_lengths[code]))
+		lengths = {name: lengths[name] for name in sorted(lengths, key = chromosome_sort_key)}
+	layout = []
+	offset = 0
+	for name, length in lengths.items():
+		layout.append((name, offset, length))
+		offset += length
+	return layout
 
-def minimap2_paf_parser(filename:str, dsc = None):
-	paf = []
-	try:
-		with open(filename) as f:
-			reader = csv.reader(f, delimiter = "\t")
-			l = [row for row in reader]
-			for each_paf in l:
-				cigar = str(int(each_paf[3]) - int(each_paf[2])) + "M"
-				if each_paf[-1].split(":")[0].strip() == "cg":
-					cigar = each_paf[-1].split(":")[-1]
-
-				tmp_paf = paf_data(
-						ref_chrom = each_paf[5],
-						ref_start = int(each_paf[7]),
-						ref_end = int(each_paf[8]),
-						query_chrom = each_paf[0],
-						query_start = int(each_paf[2]),
-						query_end = int(each_paf[3]),
-						cigar = cigar,
-						rev = each_paf[4],
-						dsc = dsc)
-				paf.append(tmp_paf)
-	except:
-		pass
-	return paf
 
+def layout_offsets(layout, chrom_names):
+	# offset of every interned name in the layout, -1 when it is not laid out
+	offsets = {name: offset for name, offset, _ in layout}
+	return np.array([offsets.get(name, -1) for name in chrom_names] + [-1], dtype = np.int64)
 
-def gtf_parser(gtf_file_name, ref_or_query):
-	ret_array = []
-	with open(gtf_file_name, "r") as f:
-		for cols in csv.reader(f, delimiter='\t'):
-			if cols[0].startswith("#"):
-				continue
-			else:
-				chrom = cols[0]
-				start = int(cols[3])
-				end = int(cols[4])
-				annotation_type = cols[2]
-				name = cols[8].split(";")[0].split()[1].replace("\"", "")
-				one_gtf = annotation_data(chrom, int(start), int(end), name, annotation_type, ref_or_query)
-				ret_array.append(one_gtf)
-	return ret_array
 
+def genome_table(table, ref_layout, query_layout):
+	# alignments moved to concatenated coordinates in one vectorized step; rows on chromosomes
+	# missing from a layout are dropped
+	ref_shift = layout_offsets(ref_layout, table.chrom_names)[table.ref_chrom]
+	query_shift = layout_offsets(query_layout, table.chrom_names)[table.query_chrom]
+	keep = (ref_shift >= 0) & (query_shift >= 0)
+	if not keep.all():
+		table = table.take(keep)
+		ref_shift, query_shift = ref_shift[keep], query_shift[keep]
+	return alignment_table(
+		table.chrom_names, table.ref_lengths, table.query_lengths,
+		table.ref_chrom, table.ref_start + ref_shift, table.ref_end + ref_shift,
+		table.query_chrom, table.query_start + query_shift, table.query_end + query_shift,
+		table.rev, table.cigar_ops, table.cigar_lens, table.cigar_offsets, dsc = table.dsc)
 
 
+def genome_annotation_table(table, layout):
+	# annotations moved to concatenated coordinates, see genome_table
+	shift = layout_offsets(layout, table.chrom_names)[table.chrom]
+	keep = shift >= 0
+	table = table.take(keep)
+	shift = shift[keep]
+	return annotation_table(table.chrom_names, table.type_names, table.chrom, table.start + shift, table.end + shift, table.annotation_type, table.name_bytes, table.name_offsets, ref_or_query = table.ref_or_query)
 
-def gff3_attribute_split(attribute):
-	ret_dict = {}
-	for each_item in attribute.split(";"):
-		key, val = each_item.split("=")
-		ret_dict[key] = val
-	return ret_dict
 
+class chain_table():
+	# Columnar chain file. Chain headers (one row per chain) are kept apart from the ungapped
+	# blocks; chain i owns blocks block_offsets[i]:block_offsets[i + 1]. Merged blocks
+	# (see chain_reader's merge_gap) may span different lengths on target and query.
+	def __init__(self, chrom_names, score, chain_id, t_chrom, t_size, t_rev, t_start, t_end, q_chrom, q_size, q_rev, q_start, q_end, block_offsets, block_t_start, block_t_end, block_q_start, block_q_end, dsc = None):
+		self.chrom_names = chrom_names
+		self.score = score
+		self.chain_id = chain_id
+		self.t_chrom = t_chrom
+		self.t_size = t_size
+		self.t_rev = t_rev
+		self.t_start = t_start
+		self.t_end = t_end
+		self.q_chrom = q_chrom
+		self.q_size = q_size
+		self.q_rev = q_rev
+		self.q_start = q_start
+		self.q_end = q_end
+		self.block_offsets = block_offsets
+		self.block_t_start = block_t_start
+		self.block_t_end = block_t_end
+		self.block_q_start = block_q_start
+		self.block_q_end = block_q_end
+		self.dsc = dsc
+
+	def __len__(self):
+		return len(self.chain_id)
+
+	def __str__(self):
+		return f"chain_table: {len(self)} chains, {self.block_count} blocks, {len(self.chrom_names)} chromosomes, dsc: {self.dsc}"
+
+	@property
+	def block_count(self):
+		return len(self.block_t_start)
+
+	def block_chain(self):
+		return np.repeat(np.arange(len(self)), np.diff(self.block_offsets))
+
+	def to_alignment_table(self, switchflag = False):
+		# One alignment per block. Without switchflag the query side of the chain is the reference,
+		# like chain_parser always did. A merged block whose two sides differ in length ends with
+		# a D or I op for the difference.
+		chain = self.block_chain()
+		if switchflag:
+			ref_start, ref_end, query_start, query_end = self.block_t_start, self.block_t_end, self.block_q_start, self.block_q_end
+			ref_chrom, query_chrom, rev = self.t_chrom[chain], self.q_chrom[chain], self.t_rev[chain]
+			ref_size, ref_code, query_size, query_code = self.t_size, self.t_chrom, self.q_size, self.q_chrom
+		else:
+			ref_start, ref_end, query_start, query_end = self.block_q_start, self.block_q_end, self.block_t_start, self.block_t_end
+			ref_chrom, query_chrom, rev = self.q_chrom[chain], self.t_chrom[chain], self.q_rev[chain]
+			ref_size, ref_code, query_size, query_code = self.q_size, self.q_chrom, self.t_size, self.t_chrom
+		ref_lengths = np.zeros(len(self.chrom_names), dtype = np.int64)
+		query_lengths = np.zeros(len(self.chrom_names), dtype = np.int64)
+		ref_lengths[ref_code] = ref_size
+		query_lengths[query_code] = query_size
+		ref_length = ref_end - ref_start
+		query_length = query_end - query_start
+		match = np.minimum(ref_length, query_length)
+		extra = ref_length - query_length
+		op_counts = 1 + (extra != 0)
+		cigar_offsets = np.zeros(len(ref_start) + 1, dtype = np.int64)
+		np.cumsum(op_counts, out = cigar_offsets[1:])
+		cigar_ops = np.zeros(cigar_offsets[-1], dtype = np.uint8)
+		cigar_lens = np.zeros(cigar_offsets[-1], dtype = np.int64)
+		cigar_lens[cigar_offsets[:-1]] = match
+		has_extra = extra != 0
+		extra_index = cigar_offsets[:-1][has_extra] + 1
+		cigar_ops[extra_index] = np.where(extra[has_extra] > 0, cigar_op_code["D"], cigar_op_code["I"])
+		cigar_lens[extra_index] = np.abs(extra[has_extra])
+		return alignment_table(self.chrom_names, ref_lengths, query_lengths, ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, cigar_ops, cigar_lens, cigar_offsets, dsc = self.dsc)
+
+
+class chain_table_builder():
+	def __init__(self, merge_gap = None, dsc = None):
+		self.merge_gap = merge_gap
+		self.dsc = dsc
+		self.chrom_names = []
+		self.chrom_index = {}
+		self.headers = {name: array("q") for name in ["score", "chain_id", "t_chrom", "t_size", "t_rev", "t_start", "t_end", "q_chrom", "q_size", "q_rev", "q_start", "q_end"]}
+		self.block_counts = []
+		self.blocks = {name: [] for name in ["t_start", "t_end", "q_start", "q_end"]}
+		# block lines of the chains not flushed yet, as (size, dt, dq) triples
+		self.pending_values = array("q")
+		self.pending_counts = array("q")
+		self.pending_starts = array("q")
+
+	def intern(self, name):
+		code = self.chrom_index.get(name)
+		if code is None:
+			code = self.chrom_index[name] = len(self.chrom_names)
+			self.chrom_names.append(name)
+		return code
+
+	def add_header(self, fields):
+		chain, score, tName, tSize, tStrand, tStart, tEnd, qName, qSize, qStrand, qStart, qEnd, id_ = fields
+		for name, value in zip(self.headers, [int(float(score)), int(id_), self.intern(tName), int(tSize), tStrand == "-", int(tStart), int(tEnd), self.intern(qName), int(qSize), qStrand == "-", int(qStart), int(qEnd)]):
+			self.headers[name].append(value)
+		self.pending_counts.append(0)
+		self.pending_starts.append(int(tStart))
+		self.pending_starts.append(int(qStart))
+
+	def add_block(self, fields):
+		self.pending_values.append(int(fields[0]))
+		if len(fields) == 3:
+			self.pending_values.append(int(fields[1]))
+			self.pending_values.append(int(fields[2]))
+		else:
+			self.pending_values.append(0)
+			self.pending_values.append(0)
+		self.pending_counts[-1] += 1
+
+	def flush(self):
+		# lay out the pending blocks of whole chains with cumulative sums, optionally merge them
+		if not self.pending_counts:
+			return
+		values = np.frombuffer(self.pending_values, dtype = np.int64).reshape(-1, 3)
+		counts = np.frombuffer(self.pending_counts, dtype = np.int64)
+		starts = np.frombuffer(self.pending_starts, dtype = np.int64).reshape(-1, 2)
+		size, dt, dq = values[:, 0], values[:, 1], values[:, 2]
+		chain = np.repeat(np.arange(len(counts)), counts)
+		first = np.zeros(len(counts) + 1, dtype = np.int64)
+		np.cumsum(counts, out = first[1:])
+		first = first[:-1]
+		t_step = np.cumsum(size + dt)
+		q_step = np.cumsum(size + dq)
+		t_base = np.concatenate(([0], t_step))[first]
+		q_base = np.concatenate(([0], q_step))[first]
+		t_start = starts[chain, 0] + (t_step - size - dt) - t_base[chain]
+		q_start = starts[chain, 1] + (q_step - size - dq) - q_base[chain]
+		t_end = t_start + size
+		q_end = q_start + size
+		if self.merge_gap is not None and len(size):
+			group_start = np.ones(len(size), dtype = bool)
+			group_start[1:] = (chain[1:] != chain[:-1]) | (dt[:-1] > self.merge_gap) | (dq[:-1] > self.merge_gap)
+			start_index = np.flatnonzero(group_start)
+			end_index = np.concatenate((start_index[1:], [len(size)])) - 1
+			t_start, q_start = t_start[start_index], q_start[start_index]
+			t_end, q_end = t_end[end_index], q_end[end_index]
+			counts = np.bincount(chain[start_index], minlength = len(counts))
+		self.block_counts.append(counts.copy())
+		for name, column in zip(["t_start", "t_end", "q_start", "q_end"], [t_start, t_end, q_start, q_end]):
+			self.blocks[name].append(column.copy())
+		self.pending_values = array("q")
+		self.pending_counts = array("q")
+		self.pending_starts = array("q")
+
+	def build(self):
+		self.flush()
+		headers = {name: np.frombuffer(column, dtype = np.int64).copy() for name, column in self.headers.items()}
+		counts = np.concatenate(self.block_counts + [np.zeros(0, dtype = np.int64)])
+		block_offsets = np.zeros(len(counts) + 1, dtype = np.int64)
+		np.cumsum(counts, out = block_offsets[1:])
+		blocks = {name: np.concatenate(columns + [np.zeros(0, dtype = np.int64)]) for name, columns in self.blocks.items()}
+		return chain_table(
+			self.chrom_names,
+			headers["score"], headers["chain_id"],
+			headers["t_chrom"].astype(np.int32), headers["t_size"], headers["t_rev"].astype(bool), headers["t_start"], headers["t_end"],
+			headers["q_chrom"].astype(np.int32), headers["q_size"], headers["q_rev"].astype(bool), headers["q_start"], headers["q_end"],
+			block_offsets, blocks["t_start"], blocks["t_end"], blocks["q_start"], blocks["q_end"],
+			dsc = self.dsc)
+
+
+def chain_reader(filename, target_filter = None, query_filter = None, merge_gap = None, ranges = None, flush_blocks = 1 << 20):
+	# Stream a plain or gzip compressed chain file into a chain_table. Blocks are laid out (and
+	# merged when their target and query gaps are both <= merge_gap) in batches of about
+	# flush_blocks, so unmerged blocks never pile up in memory.
+	builder = chain_table_builder(merge_gap = merge_gap, dsc = filename)
+	keep_chain = False
+	for line in region_index.iter_lines(filename, ranges):
+		if line.startswith("chain"):
+			if len(builder.pending_values) >= 3 * flush_blocks:
+				builder.flush()
+			fields = line.split()
+			keep_chain = (target_filter is None or target_filter(fields[2])) and (query_filter is None or query_filter(fields[7]))
+			if keep_chain:
+				builder.add_header(fields)
+		elif keep_chain:
+			fields = line.split()
+			if fields:
+				builder.add_block(fields)
+	return builder.build()
+
+
+def chain_parser(filename, switchflag = False, ref_filter = None, query_filter = None, use_index = False, ref_region = None, merge_gap = None):
+	# the chain target is the query of the dot plot unless switchflag is set
+	ranges = None
+	target_filter, chain_query_filter = (ref_filter, query_filter) if switchflag else (query_filter, ref_filter)
+	if use_index:
+		ranges = region_index.ranges_for(filename, "chain", target_filter, chain_query_filter, **{"target_region" if switchflag else "query_region": ref_region})
+	chains = chain_reader(filename, target_filter, chain_query_filter, merge_gap = merge_gap, ranges = ranges)
+	table = chains.to_alignment_table(switchflag = switchflag)
+	if ref_region is not None:
+		table = table.take((table.ref_start < ref_region[1]) & (table.ref_end > ref_region[0]))
+	return table
 
-def gff3_parser(gff3_file_name, ref_or_query):
-	return_array = []
-	try:
-		with gzip.open(gff3_file_name, "rt") as f:
-			for each_line in f:
-				if each_line.startswith("#"):
-					continue
-				seqid, source, _type, start, end, score, strand, phase, attribute = each_line.split("\t")
-				attr = gff3_attribute_split(attribute)
-				if not _type in ["biological_region", "chromosome", "supercontig", "scaffold"]:
-					name = attr.get("Name")
-					_id = attr["ID"].split(":")[1]
-					text = f"{_id}({str(name)})"
-					return_array.append(annotation_data(seqid, int(start), int(end), text, None, ref_or_query))
-		return return_array
-
-	except gzip.BadGzipFile:
-		with open(gff3_file_name, "r") as f:
-			for each_line in f:
-				if each_line.startswith("#"):
-					continue
-				seqid, source, _type, start, end, score, strand, phase, attribute = each_line.split("\t")
-				attr = gff3_attribute_split(attribute)
-				if not _type in ["biological_region", "chromosome", "supercontig", "scaffold"]:
-					name = attr.get("Name")
-					_id = attr["ID"].split(":")[1]
-					text = f"{_id}({str(name)})"
-					return_array.append(annotation_data(seqid, int(start), int(end), text, None, ref_or_query))
-		return return_array
+
+
+PAF_COLUMNS = 12
+
+
+def paf_chunk_parser(filename, dsc = None, ref_filter = None, query_filter = None, use_index = False, ref_region = None, byte_range = None):
+	# minimap2_paf_parser without the warning: returns the table and the number of lines skipped
+	# for having fewer than PAF_COLUMNS columns or non-numeric coordinates
+	builder = alignment_table_builder(dsc = dsc)
+	skipped = 0
+	ranges = [byte_range] if byte_range is not None else None
+	if use_index:
+		ranges = region_index.ranges_for(filename, "paf", ref_filter, query_filter, target_region = ref_region)
+	for line in region_index.iter_lines(filename, ranges):
+		# split off the first six columns only, so rejected lines cost one split
+		each_paf = line.rstrip("\n").split("\t", 6)
+		if len(each_paf) < 7:
+			# blank lines are not counted
+			if each_paf != [""]:
+				skipped += 1
+			continue
+		if ref_filter is not None and not ref_filter(each_paf[5]):
+			continue
+		if query_filter is not None and not query_filter(each_paf[0]):
+			continue
+		rest = each_paf[6].split("\t")
+		if len(rest) < PAF_COLUMNS - 6:
+			skipped += 1
+			continue
+		try:
+			ref_start, ref_end = int(rest[1]), int(rest[2])
+			query_start, query_end = int(each_paf[2]), int(each_paf[3])
+			ref_length, query_length = int(rest[0]), int(each_paf[1])
+		except ValueError:
+			skipped += 1
+			continue
+		if ref_region is not None and not region_overlaps(ref_region, ref_start, ref_end):
+			continue
+		cigar = None
+		if rest[-1].split(":")[0].strip() == "cg":
+			cigar = rest[-1].split(":")[-1]
+		builder.append(
+				ref_chrom = each_paf[5],
+				ref_start = ref_start,
+				ref_end = ref_end,
+				query_chrom = each_paf[0],
+				query_start = query_start,
+				query_end = query_end,
+				rev = each_paf[4] == "-",
+				cigar = cigar,
+				ref_length = ref_length,
+				query_length = query_length)
+	return builder.build(), skipped
+
+
+def warn_skipped_paf_lines(filename, skipped):
+	if skipped:
+		print(f"{filename}: skipped {skipped} malformed PAF lines", file = sys.stderr)
+
+
+def minimap2_paf_parser(filename:str, dsc = None, ref_filter = None, query_filter = None, use_index = False, ref_region = None, byte_range = None):
+	# byte_range (start, end) parses only the lines starting inside it, see paf_chunks
+	table, skipped = paf_chunk_parser(filename, dsc = dsc, ref_filter = ref_filter, query_filter = query_filter, use_index = use_index, ref_region = ref_region, byte_range = byte_range)
+	warn_skipped_paf_lines(filename, skipped)
+	return table
+
+
+GFF3_SKIP_TYPES = {"biological_region", "chromosome", "supercontig", "scaffold"}
+
+
+def gff3_attribute_value(attribute, key):
+	# value of one key=value pair of a GFF3 attribute column, without splitting the whole column
+	if attribute.startswith(key + "="):
+		start = len(key) + 1
+	else:
+		start = attribute.find(";" + key + "=")
+		if start < 0:
+			return None
+		start += len(key) + 2
+	end = attribute.find(";", start)
+	return attribute[start:] if end < 0 else attribute[start:end]
+
+
+def gtf_first_attribute_value(attribute):
+	# value of the first GTF attribute (gene_id "value";)
+	fields = attribute.split(";", 1)[0].split()
+	return fields[1].replace("\"", "") if len(fields) > 1 else None
+
+
+def annotation_reader(file_name, file_format, ref_or_query, chrom_filter = None, feature_types = None, skip_types = None):
+	# One pass over a plain or gzip GTF/GFF3 file (compression is detected from the magic bytes).
+	# Comment, chromosome and feature type checks run on a prefix split before the attribute
+	# column is looked at, and only the attributes used for the name are extracted.
+	builder = annotation_table_builder(ref_or_query)
+	for line in region_index.iter_lines(file_name):
+		if line.startswith("#"):
+			continue
+		cols = line.rstrip("\n").split("\t", 8)
+		if len(cols) < 9:
+			continue
+		if chrom_filter is not None and not chrom_filter(cols[0]):
+			continue
+		if feature_types is not None and cols[2] not in feature_types:
+			continue
+		if skip_types is not None and cols[2] in skip_types:
+			continue
+		if file_format == "gtf":
+			builder.append(cols[0], int(cols[3]), int(cols[4]), str(gtf_first_attribute_value(cols[8])), cols[2])
+		else:
+			_id = gff3_attribute_value(cols[8], "ID")
+			if _id is not None:
+				_id = _id.split(":")[-1]
+			name = gff3_attribute_value(cols[8], "Name")
+			builder.append(cols[0], int(cols[3]), int(cols[4]), f"{_id}({str(name)})")
+	return builder.build()
+
+
+def gtf_parser(gtf_file_name, ref_or_query, chrom_filter = None, feature_types = None):
+	return annotation_reader(gtf_file_name, "gtf", ref_or_query, chrom_filter = chrom_filter, feature_types = feature_types)
+
+
+def gff3_parser(gff3_file_name, ref_or_query, chrom_filter = None, feature_types = None):
+	return annotation_reader(gff3_file_name, "gff3", ref_or_query, chrom_filter = chrom_filter, feature_types = feature_types, skip_types = GFF3_SKIP_TYPES)
 
 
 
@@ -202,47 +1001,190 @@ def cigar_parser(cigar_string):
 	cigar_element = re.findall(r'([0-9]+[MIDNSHPX=])', cigar_string)
 	return cigar_element
 
-def cut_alignment_at_large_indel(paf, threthold = 50):
-	rev = paf.rev
-	current_ref_pos = paf.ref_start
-	current_query_pos = paf.query_start
+def alignment_polyline(table, tolerance = None):
+	# Per-op CIGAR expansion of a whole alignment_table in one pass. Returns x (query) and y
+	# (reference) float arrays holding, for every alignment, its start point, one vertex per CIGAR
+	# op and a NaN separator. With a tolerance (bp) the result is passed through
+	# decimate_polyline.
+	n = len(table)
+	op_counts = np.diff(table.cigar_offsets)
+	total = len(table.cigar_ops) + 2 * n
+	x = np.full(total, np.nan)
+	y = np.full(total, np.nan)
+	if n == 0:
+		return x, y
+	op_aln = np.repeat(np.arange(n), op_counts)
+	query_step = np.where(cigar_op_moves_query[table.cigar_ops], table.cigar_lens, 0)
+	query_step[table.rev[op_aln]] *= -1
+	ref_step = np.where(cigar_op_moves_ref[table.cigar_ops], table.cigar_lens, 0)
+	x_start = np.where(table.rev, table.query_end, table.query_start)
+	y_start = table.ref_start
+	start_index = table.cigar_offsets[:-1] + 2 * np.arange(n)
+	x[start_index] = x_start
+	y[start_index] = y_start
+	op_index = np.arange(len(table.cigar_ops)) + 2 * op_aln + 1
+	query_sum = np.cumsum(query_step)
+	ref_sum = np.cumsum(ref_step)
+	query_base = np.concatenate(([0], query_sum))[table.cigar_offsets[:-1]]
+	ref_base = np.concatenate(([0], ref_sum))[table.cigar_offsets[:-1]]
+	x[op_index] = query_sum - query_base[op_aln] + x_start[op_aln]
+	y[op_index] = ref_sum - ref_base[op_aln] + y_start[op_aln]
+	if tolerance:
+		return decimate_polyline(x, y, np.repeat(table.rev, op_counts + 2), tolerance)
+	return x, y
 
-	points = []
-	if rev == "+":
-		points.append((paf.query_start, paf.ref_start))
-	else:
-		current_query_pos = paf.query_end
-		points.append((paf.query_end, paf.ref_start))
 
+def decimate_polyline(x, y, rev, tolerance):
+	# Level of detail for alignment polylines. Along an alignment the offset from its diagonal
+	# (y - x, or y + x on the reverse strand) only changes at indels, so the offset is bucketed
+	# by tolerance and only vertices where the bucket changes are kept. Collinear runs of matches
+	# and indels smaller than the tolerance disappear, and every dropped vertex stays within
+	# tolerance of the line drawn between its kept neighbours. Start and end points of every
+	# alignment and the NaN separators are always kept.
+	if len(x) < 3:
+		return x, y
+	bucket = np.floor(np.where(rev, y + x, y - x) / tolerance)
+	keep = np.ones(len(x), dtype = bool)
+	# NaN != NaN, so vertices next to a separator are kept
+	keep[1:-1] = (bucket[1:-1] != bucket[:-2]) | (bucket[1:-1] != bucket[2:])
+	return x[keep], y[keep]
 
-	for each_chain in cigar_parser(paf.cigar):
-		length = int(each_chain[:-1])
-		if rev == "+":
-			if each_chain[-1] == "D":# and length >= threthold:
-				current_ref_pos += length
-			elif each_chain[-1] == "I":# and length >= threthold:
-				current_query_pos += length
-			else:
-				current_query_pos += length
-				current_ref_pos += length
-		else:
-			if each_chain[-1] == "D":# and length >= threthold:
-				current_ref_pos += length
-			elif each_chain[-1] == "I":# and length >= threthold:
-				current_query_pos -= length
-			else:
-				current_query_pos -= length
-				current_ref_pos += length
 
-		points.append((current_query_pos, current_ref_pos))
-	points.append((None, None))
-	#if rev == "+":
-	#	points.append((paf.query_end, paf.ref_end))
-	#else:
-	#	points.append((paf.query_start, paf.ref_end))
-	return points
+
+class alignment_region_index():
+	# Rows of an alignment_table sorted by reference start, with the running maximum of their
+	# reference ends. The rows overlapping a reference interval lie between two binary searches;
+	# the query side is checked on those candidates only.
+	def __init__(self, table):
+		self.table = table
+		self.order = np.argsort(table.ref_start, kind = "stable")
+		self.sorted_start = table.ref_start[self.order]
+		self.max_end = np.maximum.accumulate(table.ref_end[self.order]) if len(table) else np.zeros(0, dtype = np.int64)
+
+	def window(self, x_range, y_range):
+		# sorted row indices of the alignments overlapping query x_range and reference y_range
+		low = np.searchsorted(self.max_end, y_range[0], side = "right")
+		high = np.searchsorted(self.sorted_start, y_range[1], side = "left")
+		rows = self.order[low:high]
+		table = self.table
+		rows = rows[(table.ref_end[rows] > y_range[0]) & (table.query_end[rows] > x_range[0]) & (table.query_start[rows] < x_range[1])]
+		return np.sort(rows)
 
 
+def clip_polyline(x, y, x_range, y_range):
+	# Parts of a NaN separated polyline inside the window. Segments crossing the border are cut
+	# at it, and a NaN separator is put wherever the line leaves the window.
+	if len(x) < 2:
+		return x[:0], y[:0]
+	x0, y0, x1, y1 = x[:-1], y[:-1], x[1:], y[1:]
+	t_enter, t_exit, visible = raster.clip_segments(x0, y0, x1, y1, (x_range[0], y_range[0], x_range[1], y_range[1]))
+	segment = np.flatnonzero(visible & np.isfinite(x0) & np.isfinite(y0) & np.isfinite(x1) & np.isfinite(y1))
+	dx, dy = (x1 - x0)[segment], (y1 - y0)[segment]
+	# a segment continues the previous one when they share a vertex inside the window
+	continues = np.zeros(len(segment), dtype = bool)
+	continues[1:] = (segment[1:] == segment[:-1] + 1) & (t_exit[segment[:-1]] == 1) & (t_enter[segment[1:]] == 0)
+	ends_line = np.ones(len(segment), dtype = bool)
+	ends_line[:-1] = ~continues[1:]
+	counts = (~continues).astype(np.int64) + 1 + ends_line
+	position = np.cumsum(counts) - counts
+	out_x = np.full(int(counts.sum()), np.nan)
+	out_y = np.full(int(counts.sum()), np.nan)
+	starts = ~continues
+	out_x[position[starts]] = (x0[segment] + t_enter[segment] * dx)[starts]
+	out_y[position[starts]] = (y0[segment] + t_enter[segment] * dy)[starts]
+	end_position = position + starts
+	out_x[end_position] = x0[segment] + t_exit[segment] * dx
+	out_y[end_position] = y0[segment] + t_exit[segment] * dy
+	return out_x, out_y
+
+
+def window_polyline(table, index, x_range, y_range, width = 1200):
+	# polyline of the alignments in the window, with the CIGARs expanded to one screen pixel or,
+	# once a pixel is below 1 bp, to every operation
+	tolerance = (x_range[1] - x_range[0]) / width
+	x, y = alignment_polyline(table.take(index.window(x_range, y_range)), tolerance = tolerance if tolerance >= 1 else None)
+	return clip_polyline(x, y, x_range, y_range)
+
+
+DENSITY_BIN_PIXELS = 4
+
+
+def density_grid(tables, x_range, y_range, bins):
+	# Aligned bases per bin of a bins x bins grid (rows: reference, columns: query) over the
+	# window, summed over the tables. The polylines are expanded at bin resolution and every
+	# segment spreads its length over the bins it crosses. A segment's length is the shorter of
+	# its query and reference extents, rescaled per alignment so that the segments add up to the
+	# M/=/X bases of its CIGAR. The grid size does not depend on the input.
+	x_bp = (x_range[1] - x_range[0]) / bins
+	y_bp = (y_range[1] - y_range[0]) / bins
+	tolerance = min(x_bp, y_bp)
+	grid = np.zeros(bins * bins)
+	for table in tables:
+		x, y = alignment_polyline(table, tolerance = tolerance if tolerance >= 1 else None)
+		weights = np.minimum(np.abs(np.diff(x)), np.abs(np.diff(y)))
+		# every alignment ends with a NaN separator
+		segment_alignment = np.cumsum(np.isnan(x))[:-1]
+		drawn = np.bincount(segment_alignment, weights = np.nan_to_num(weights), minlength = len(table) + 1)[:len(table)]
+		scale = np.divide(aligned_bases(table), drawn, out = np.zeros(len(table)), where = drawn > 0)
+		weights = weights * np.append(scale, 0)[segment_alignment]
+		for sample_x, sample_y, weight in raster.sample_segments((x - x_range[0]) / x_bp, (y - y_range[0]) / y_bp, (0, 0, bins, bins), weights = weights):
+			grid += np.bincount(sample_y * bins + sample_x, weights = weight, minlength = bins * bins)
+	return grid.reshape(bins, bins)
+
+
+def aligned_bases(table):
+	# M/=/X bases of every alignment
+	op_alignment = np.repeat(np.arange(len(table)), np.diff(table.cigar_offsets))
+	aligned = np.isin(table.cigar_ops, [cigar_op_code[op] for op in "M=X"])
+	return np.bincount(op_alignment, weights = np.where(aligned, table.cigar_lens, 0), minlength = len(table))
+
+
+def density_heatmap(grid, x_range, y_range):
+	# one heatmap trace on log10 scale; empty bins stay transparent
+	bins_y, bins_x = grid.shape
+	x_bp = (x_range[1] - x_range[0]) / bins_x
+	y_bp = (y_range[1] - y_range[0]) / bins_y
+	z = np.round(np.log10(grid, where = grid > 0, out = np.full(grid.shape, np.nan)), 3)
+	return go.Heatmap(
+		z = z,
+		x0 = x_range[0] + x_bp / 2, dx = x_bp,
+		y0 = y_range[0] + y_bp / 2, dy = y_bp,
+		colorscale = "Viridis",
+		colorbar = dict(title = "log10 aligned bp"),
+		hoverongaps = False,
+		hovertemplate = "query %{x:.0f}<br>reference %{y:.0f}<br>log10 aligned bp %{z}<extra></extra>",
+		name = "aligned bases"
+	)
+
+
+def encode_polylines(polylines):
+	# uint32 count, uint32 length per polyline (padded to 8 bytes), then x and y float64 of each
+	header = [len(polylines)] + [len(x) for x, _ in polylines]
+	if len(header) % 2:
+		header.append(0)
+	return np.array(header, dtype = "<u4").tobytes() + b"".join(np.asarray(x, dtype = "<f8").tobytes() + np.asarray(y, dtype = "<f8").tobytes() for x, y in polylines)
+
+
+def layout_end(layout):
+	return layout[-1][1] + layout[-1][2] if layout else 0
+
+
+def chromosome_grid_scatter(ref_layout, query_layout):
+	# chromosome boundaries of both concatenated axes as one NaN separated trace
+	ref_end = layout_end(ref_layout)
+	query_end = layout_end(query_layout)
+	query_bounds = [offset for _, offset, _ in query_layout] + [query_end]
+	ref_bounds = [offset for _, offset, _ in ref_layout] + [ref_end]
+	x_points = [value for bound in query_bounds for value in (bound, bound, None)] + [value for _ in ref_bounds for value in (0, query_end, None)]
+	y_points = [value for _ in query_bounds for value in (0, ref_end, None)] + [value for bound in ref_bounds for value in (bound, bound, None)]
+	return go.Scattergl(x = x_points, y = y_points, mode = "lines", line = dict(width = 1, color = "gray"), hoverinfo = "skip", name = "chromosomes", showlegend = False)
+
+
+def chromosome_ticks(layout, scale_end, min_fraction = 0.005):
+	# axis ticks at chromosome midpoints, leaving out sequences too short for a readable label
+	shown = [(offset + length / 2, name) for name, offset, length in layout if length >= scale_end * min_fraction]
+	return {"tickvals": [value for value, _ in shown], "ticktext": [name for _, name in shown]}
+
 
 
 def draw_dotplot(
@@ -252,9 +1194,19 @@ def draw_dotplot(
 	query_centromere_breakpoint = None, 
 	reference_centromere_breakpoint = None,  
 	query_annotation = None, 
-	ref_annotation = None, 
-	reference_annotation = None
+	reference_annotation = None,
+	tolerance = None,
+	width = 1200,
+	ref_layout = None,
+	query_layout = None,
+	density = False,
+	alignment_layer = None
 	):
+	# With ref_layout/query_layout (genome_layout) the tables and annotations are expected in
+	# concatenated coordinates (genome_table) and every chromosome is drawn. density replaces the
+	# alignment lines by one heatmap of aligned bases, and alignment_layer (a list of traces, such
+	# as synteny.synteny_traces) replaces them by its traces.
+	genome_mode = ref_layout is not None and query_layout is not None
 	counter = 0
 	# # 63 6E FA -> rgba(99, 110, 250, 0.7)
 	colorList = []
@@ -268,22 +1220,28 @@ def draw_dotplot(
 		colorList.append(f"rgba({r_dec}, {g_dec}, {b_dec}, 0.5)")
 
 	scale_end =10
+	if chrm:
+		scale_end = const["GRCh38_chromosome_length"][str(chrm)]
+	if genome_mode:
+		scale_end = max(layout_end(ref_layout), layout_end(query_layout), 1)
+	data_end = scale_end if chrm or genome_mode else max([scale_end] + [int(max(paf.ref_end.max(), paf.query_end.max())) for paf in PAFs if len(paf) > 0])
+	if tolerance is None:
+		# one screen pixel of the plotted range
+		tolerance = data_end / width
 	main_line_scatter = []
-	for paf in PAFs:
-		x_points = []
-		y_points = []
-		for one_alignment in paf:#ここでcigarのパーザーを呼ぶ。
-			#scale_end = max(scale_end, one_alignment.ref_start, one_alignment.ref_end, one_alignment.query_start, one_alignment.query_end)
-			points = cut_alignment_at_large_indel(one_alignment)
-			for i in range(len(points)):
-				x_points.append(points[i][0])
-				y_points.append(points[i][1])
+	if density:
+		bins = max(int(width // DENSITY_BIN_PIXELS), 1)
+		main_line_scatter.append(density_heatmap(density_grid(PAFs, (0, data_end), (0, data_end), bins), (0, data_end), (0, data_end)))
+	if alignment_layer is not None:
+		main_line_scatter.extend(alignment_layer)
+	for paf in ([] if density or alignment_layer is not None else PAFs):
+		x_points, y_points = alignment_polyline(paf, tolerance = tolerance)
 		tmp = go.Scattergl(
 			x = x_points,
 			y = y_points, 
 			line=dict(width=3,color=colorList[counter % 24]),
 			mode='lines',
-			name = paf[0].dsc.split("/")[-1]
+			name = paf.dsc.split("/")[-1]
 		) #, color=one_alignment.color
 		main_line_scatter.append(tmp)
 		counter += 1
@@ -291,28 +1249,18 @@ def draw_dotplot(
 
 
 
+	# only the annotations of the plotted chromosome and range are drawn; in genome mode they are
+	# already in concatenated coordinates
+	if query_annotation is not None and not genome_mode:
+		query_annotation = annotation_index(query_annotation).query(chrm, 0, data_end)
+	if reference_annotation is not None and not genome_mode:
+		reference_annotation = annotation_index(reference_annotation).query(chrm, 0, data_end)
+
+	# annotations are packed into lanes, and crowded ones collapsed, at the resolution of the figure
+	pixel_bp = data_end / width
 	query_annotation_scatter = []
 	if query_annotation is not None:
-		x_points = []
-		y_points = []
-		name_list = []
-		count = 0
-		for each_query_anno in query_annotation:
-			if str(each_query_anno.chrom) != str(chrm):
-				continue
-			length = each_query_anno.end - each_query_anno.start
-			x_points.append(each_query_anno.start)
-			x_points.append(each_query_anno.end)
-			x_points.append(None)
-			y_points.append(count % 12)
-			y_points.append(count % 12)
-			#y_points.append(0)
-			#y_points.append(0)
-			y_points.append(None)
-			name_list.append(each_query_anno.name)
-			name_list.append(each_query_anno.name)
-			name_list.append("")
-			count += 1
+		x_points, y_points, name_list = annotation_track_points(query_annotation, pixel_bp)
 		tmp = go.Scattergl(
 				x = x_points,
 				y = y_points,
@@ -322,6 +1270,7 @@ def draw_dotplot(
 				marker_line_color = "midnightblue", marker_color = "midnightblue", marker_line_width = 2, marker_size = 4,
 				marker_symbol = 223,
 				name = "query annotation",
+				meta = "query_annotation",
 				text = name_list,
 				opacity = 0.7,
 				mode = "markers+lines",
@@ -334,27 +1283,8 @@ def draw_dotplot(
 
 
 	ref_annotation_scatter = []
-	if ref_annotation is not None:
-		x_points = []
-		y_points = []
-		name_list = []
-		count = 0
-		for each_ref_anno in ref_annotation:
-			if str(each_ref_anno.chrom) != str(chrm):
-				continue
-			length = each_ref_anno.end - each_ref_anno.start
-			y_points.append(each_ref_anno.start)
-			y_points.append(each_ref_anno.end)
-			y_points.append(None)
-			x_points.append(count % 12)
-			x_points.append(count % 12)
-			#x_points.append(0)
-			#x_points.append(0)
-			x_points.append(None)
-			name_list.append(each_ref_anno.name)
-			name_list.append(each_ref_anno.name)
-			name_list.append("")
-			count += 1
+	if reference_annotation is not None:
+		y_points, x_points, name_list = annotation_track_points(reference_annotation, pixel_bp)
 		tmp = go.Scattergl(
 				x = x_points,
 				y = y_points,
@@ -363,7 +1293,8 @@ def draw_dotplot(
 				marker = dict(color = colorList),
 				marker_line_color = "midnightblue", marker_color = "midnightblue", marker_line_width = 2, marker_size = 4,
 				marker_symbol = 224,
-				name = each_ref_anno.name,
+				name = "reference annotation",
+				meta = "reference_annotation",
 				text = name_list,
 				opacity = 0.7,
 				mode = "markers+lines",
@@ -374,83 +1305,442 @@ def draw_dotplot(
 		ref_annotation_scatter.append(tmp)
 	main_line_scatter.extend(ref_annotation_scatter)
 
+	if genome_mode:
+		main_line_scatter.append(chromosome_grid_scatter(ref_layout, query_layout))
 
 	main_line_figure = go.Figure(data = main_line_scatter)
 
 	if query_centromere_breakpoint:
 		main_line_figure.add_vrect(x0 = query_centromere_breakpoint[0], x1 = query_centromere_breakpoint[1], fillcolor = px.colors.qualitative.Pastel[0], opacity = 0.3, layer = "above", line_width=0)
 	if reference_centromere_breakpoint:
-		main_line_figure.add_vrect(y0 = reference_centromere_breakpoint[0], y1 = reference_centromere_breakpoint[1], fillcolor = px.colors.qualitative.Pastel[1], opacity = 0.3, layer = "below", line_width=0)
-
-	if chrm:
-		scale_end = const["GRCh38_chromosome_length"][str(chrm)]
+		main_line_figure.add_hrect(y0 = reference_centromere_breakpoint[0], y1 = reference_centromere_breakpoint[1], fillcolor = px.colors.qualitative.Pastel[1], opacity = 0.3, layer = "above", line_width=0)
 
 	main_line_figure.update_xaxes(title = {'text': "Query", "standoff": 1100}, title_font = dict(size=18), zeroline = True,  range = [0, scale_end], rangemode = "tozero", showgrid = True,  gridwidth = 1, matches = 'x', anchor = "free", position = 1)
 	main_line_figure.update_yaxes(title_text = 'Reference', zeroline = True,  range = [0, scale_end], rangemode = "tozero", showgrid = True,  gridwidth = 1, scaleanchor = "x", scaleratio = 1, autorange="reversed")
 
+	if genome_mode:
+		main_line_figure.update_xaxes(showgrid = False, **chromosome_ticks(query_layout, scale_end))
+		main_line_figure.update_yaxes(showgrid = False, **chromosome_ticks(ref_layout, scale_end))
+
 	main_line_figure.update_layout(
-		title = {'text': f"Chromosome {chrm}", "y": 0.95, "x": 0.5},
+		title = {'text': "All chromosomes" if genome_mode else f"Chromosome {chrm}", "y": 0.95, "x": 0.5},
 		legend = {"yanchor": "top", "y": 0.98, "xanchor": "right" , "x": 1.0},
 		autosize = False,
-		width = 1200,
-		height = 1200,
+		width = width,
+		height = width,
+		# the query annotation lanes sit in a strip below the plot (yaxis2) and the reference ones
+		# in a strip left of it (xaxis2)
+		xaxis  = {"domain": [0.05, 1]},
+		xaxis2 = {"domain": [0, 0.05], "anchor": "y"},
 		yaxis  = {"domain": [0.05, 1]},
 		yaxis2 = {"domain": [0, 0.05]},
 		hovermode = 'x'
-		#xaxis2 = {"title": "Gene", "titlefont": {"color": "#ff7f0e"}, "tickfont": {"color": "#ff7f0e"}, "anchor": "free", "overlaying": "free", "side": "bottom", "position": 0.1}
 		)
 
 
 
 	return main_line_figure
 
+def draw_dotplot_raster(
+	PAFs,
+	chrm,
+	const,
+	out_file_name,
+	query_centromere_breakpoint = None,
+	reference_centromere_breakpoint = None,
+	query_annotation = None,
+	reference_annotation = None,
+	tolerance = None,
+	width = 1200,
+	ref_layout = None,
+	query_layout = None
+	):
+	# PNG counterpart of draw_dotplot. The alignment polylines are rasterized into a NumPy pixel
+	# buffer (raster.py) and written without plotly/kaleido, so the cost grows with the number of
+	# drawn pixels rather than with the size of a Scattergl payload.
+	colorList = px.colors.qualitative.Dark24
+	genome_mode = ref_layout is not None and query_layout is not None
+	if genome_mode:
+		scale_end = max(layout_end(ref_layout), layout_end(query_layout), 1)
+	elif chrm:
+		scale_end = const["GRCh38_chromosome_length"][str(chrm)]
+	else:
+		scale_end = max([10] + [int(max(paf.ref_end.max(), paf.query_end.max())) for paf in PAFs if len(paf) > 0])
+	lane_count = ANNOTATION_LANES
+	track = 3 * lane_count + 8
+	if query_annotation is not None and not genome_mode:
+		query_annotation = annotation_index(query_annotation).query(chrm, 0, scale_end)
+	if reference_annotation is not None and not genome_mode:
+		reference_annotation = annotation_index(reference_annotation).query(chrm, 0, scale_end)
+	query_track = track if query_annotation is not None and len(query_annotation) > 0 else 0
+	ref_track = track if reference_annotation is not None and len(reference_annotation) > 0 else 0
+	left = 110 + ref_track
+	top = 70
+	size = width - left - 30
+	canvas = raster.raster_canvas(width, top + size + query_track + 70, (left, top, left + size, top + size), (0, scale_end), (0, scale_end))
+	canvas.fill_rect(left, top, left + size, top + size, "#e5ecf6")
+	canvas.draw_axes(x_title = "Query", y_title = "Reference", title = "All chromosomes" if genome_mode else f"Chromosome {chrm}", x_label_offset = query_track, y_label_offset = ref_track, ticks = not genome_mode)
+	if genome_mode:
+		# chromosome boundaries, and names at the midpoints of the ones wide enough for a label
+		for name, offset, length in query_layout:
+			x0, x1 = canvas.to_pixel_x([offset, offset + length]).astype(int).tolist()
+			canvas.fill_rect(x0, top, x0 + 1, top + size, "#ffffff")
+			if x1 - x0 >= 8 * len(name):
+				canvas.draw_text(name, (x0 + x1) // 2, top + size + query_track + 8, align = "center")
+		for name, offset, length in ref_layout:
+			y0, y1 = canvas.to_pixel_y([offset, offset + length]).astype(int).tolist()
+			canvas.fill_rect(left, y0, left + size, y0 + 1, "#ffffff")
+			if y1 - y0 >= 12:
+				canvas.draw_text(name, left - ref_track - 8, (y0 + y1) // 2 - raster.GLYPH_HEIGHT, align = "right")
+
+	if tolerance is None:
+		tolerance = scale_end / size
+	legend_x = left
+	for counter, paf in enumerate(PAFs):
+		color = colorList[counter % 24]
+		x_points, y_points = alignment_polyline(paf, tolerance = tolerance)
+		canvas.draw_polyline(x_points, y_points, color, alpha = 0.5, width = 3)
+		name = paf.dsc.split("/")[-1]
+		canvas.fill_rect(legend_x, 48, legend_x + 16, 51, color)
+		canvas.draw_text(name, legend_x + 20, 45, color = "#2a3f5f")
+		legend_x += 36 + 8 * len(name)
+
+	# centromere bands are composited over the alignments, like the "above" layer of draw_dotplot
+	if query_centromere_breakpoint:
+		x0, x1 = canvas.to_pixel_x(query_centromere_breakpoint[:2])
+		canvas.fill_rect(max(x0, left), top, min(x1, left + size), top + size, px.colors.qualitative.Pastel[0], alpha = 0.3)
+	if reference_centromere_breakpoint:
+		y0, y1 = canvas.to_pixel_y(reference_centromere_breakpoint[:2])
+		canvas.fill_rect(left, max(y0, top), left + size, min(y1, top + size), px.colors.qualitative.Pastel[1], alpha = 0.3)
+
+	# annotation tracks: one short line per annotation in its packed lane, like draw_dotplot
+	pixel_bp = scale_end / size
+	if query_track:
+		positions, lanes, _ = annotation_track_points(query_annotation, pixel_bp, lane_count)
+		x_points = canvas.to_pixel_x(positions)
+		y_points = top + size + 4 + 3 * lanes
+		mask = canvas.line_mask(x_points, y_points, width = 2, box = (left, top + size, left + size, top + size + query_track))
+		canvas.blend(mask, "#191970", alpha = 0.7)
+	if ref_track:
+		positions, lanes, _ = annotation_track_points(reference_annotation, pixel_bp, lane_count)
+		x_points = left - ref_track + 4 + 3 * lanes
+		y_points = canvas.to_pixel_y(positions)
+		mask = canvas.line_mask(x_points, y_points, width = 2, box = (left - ref_track, top, left, top + size))
+		canvas.blend(mask, "#191970", alpha = 0.7)
+
+	canvas.save(out_file_name)
+	return out_file_name
+
+def load_annotation(file_name, annotation_ref_or_query, chrm = None, use_cache = True, feature_types = None):
+	if ".gtf" in file_name:
+		annotation_parser = gtf_parser
+	elif ".gff3" in file_name:
+		annotation_parser = gff3_parser
+	else:
+		return None
+	return parse_cache.cached(annotation_table, file_name, annotation_parser.__name__, {"ref_or_query": annotation_ref_or_query.name, "chrom": chrm, "feature_types": None if feature_types is None else sorted(feature_types)},
+		lambda: annotation_parser(file_name, annotation_ref_or_query, chrom_filter = chromosome_filter(chrm), feature_types = feature_types), enabled = use_cache)
+
+
+def paf_chunks(filename, chunk_size = 64 << 20):
+	# split a plain text file into byte ranges of about chunk_size that start at line starts
+	if region_index.compression_type(filename) != "none":
+		return [None]
+	size = os.path.getsize(filename)
+	starts = [0]
+	with open(filename, "rb") as f:
+		while starts[-1] + chunk_size < size:
+			f.seek(starts[-1] + chunk_size)
+			f.readline()
+			if f.tell() >= size:
+				break
+			starts.append(f.tell())
+	return list(zip(starts, starts[1:] + [size]))
+
+
+def load_paf_files(file_names, chrm = None, use_index = False, use_cache = True, threads = None, chunk_size = 64 << 20):
+	# Parse PAF files concurrently in a process pool. Large plain text files are split into line
+	# aligned chunks so one file can use several cores. Returns one table per file in input order.
+	options = [{"dsc": file_name, "ref_chrom": chrm} for file_name in file_names]
+	tables = [parse_cache.lookup(alignment_table, file_name, "minimap2_paf_parser", option) if use_cache else None for file_name, option in zip(file_names, options)]
+	ref_filter = chromosome_filter(chrm)
+	with concurrent.futures.ProcessPoolExecutor(max_workers = threads) as executor:
+		futures = []
+		for file_name, table in zip(file_names, tables):
+			if table is not None:
+				futures.append(None)
+				continue
+			byte_ranges = [None] if use_index else paf_chunks(file_name, chunk_size)
+			futures.append([executor.submit(paf_chunk_parser, file_name, dsc = file_name, ref_filter = ref_filter, use_index = use_index, byte_range = byte_range) for byte_range in byte_ranges])
+		for i, file_futures in enumerate(futures):
+			if file_futures is None:
+				continue
+			chunk_tables, skipped = zip(*[future.result() for future in file_futures])
+			# one warning per file, however many chunks it was split into
+			warn_skipped_paf_lines(file_names[i], sum(skipped))
+			tables[i] = chunk_tables[0] if len(chunk_tables) == 1 else alignment_table.concatenate(chunk_tables, dsc = file_names[i])
+			if use_cache:
+				parse_cache.store(tables[i], file_names[i], "minimap2_paf_parser", options[i])
+	return tables
+
+
+def load_chain(file_name, chrm = None, switchflag = False, use_index = False, use_cache = True, merge_gap = None):
+	chrom_filter = chromosome_filter(chrm)
+	return parse_cache.cached(alignment_table, file_name, "chain_parser", {"switchflag": switchflag, "chrom": chrm, "merge_gap": merge_gap},
+		lambda: chain_parser(file_name, switchflag = switchflag, ref_filter = chrom_filter, query_filter = chrom_filter, use_index = use_index, merge_gap = merge_gap), enabled = use_cache)
+
+
+def render_chromosome(PAFs, chrm, const, out_file_name, query_annotation = None, reference_annotation = None, tolerance = None, use_raster = False):
+	if use_raster and out_file_name.endswith(".png"):
+		return draw_dotplot_raster(PAFs, chrm, const, out_file_name, query_annotation = query_annotation, reference_annotation = reference_annotation, tolerance = tolerance)
+	fig = draw_dotplot(PAFs, chrm, const, reference_centromere_breakpoint = None, query_annotation = query_annotation, reference_annotation = reference_annotation, tolerance = tolerance)
+	if out_file_name.endswith(".html"):
+		fig.write_html(out_file_name)
+	else:
+		fig.write_image(out_file_name)
+	return out_file_name
+
+
+def batch_output_name(out_template, chrm):
+	# "{chrom}" in the template is replaced, otherwise the chromosome goes before the extension
+	if "{chrom}" in out_template:
+		return out_template.replace("{chrom}", str(chrm))
+	root, ext = os.path.splitext(out_template)
+	return f"{root}_chr{chrm}{ext}"
+
+
+def batch_render(PAFs, chain_PAFs, const, chromosomes, out_template, query_annotation = None, reference_annotation = None, tolerance = None, threads = None, use_raster = False):
+	# PAFs/chain_PAFs/annotations are parsed once for the whole genome, split per chromosome here and
+	# every chromosome is drawn and exported by a worker process
+	tasks = []
+	query_index = annotation_index(query_annotation) if query_annotation is not None else None
+	reference_index = annotation_index(reference_annotation) if reference_annotation is not None else None
+	for chrm in chromosomes:
+		chrom_filter = chromosome_filter(chrm)
+		chromosome_PAFs = [paf.take(paf.filter_mask(ref_filter = chrom_filter)) for paf in PAFs]
+		chromosome_PAFs += [paf.take(paf.filter_mask(ref_filter = chrom_filter, query_filter = chrom_filter)) for paf in chain_PAFs]
+		query = query_index.query(chrm) if query_index is not None else None
+		reference = reference_index.query(chrm) if reference_index is not None else None
+		tasks.append((chromosome_PAFs, chrm, const, batch_output_name(out_template, chrm), query, reference, tolerance, use_raster))
+	with concurrent.futures.ProcessPoolExecutor(max_workers = threads) as executor:
+		futures = [executor.submit(render_chromosome, *task) for task in tasks]
+		for future in concurrent.futures.as_completed(futures):
+			print(f"wrote {future.result()}", file = sys.stderr)
+
+
+REFINE_SCRIPT = """
+const plot = document.getElementById("{plot_id}");
+const traces = [...Array(TRACE_COUNT).keys()];
+let latest = 0;
+plot.on("plotly_relayout", () => {
+	// replace the alignment traces by the detail of the new view
+	const layout = plot._fullLayout, x = layout.xaxis.range, y = layout.yaxis.range;
+	const request = ++latest;
+	fetch("detail?x0=" + Math.min(...x) + "&x1=" + Math.max(...x) + "&y0=" + Math.min(...y) + "&y1=" + Math.max(...y) + "&width=" + layout._size.w)
+		.then(response => response.arrayBuffer())
+		.then(buffer => {
+			if (request != latest) return;
+			const count = new Uint32Array(buffer, 0, 1)[0], lengths = new Uint32Array(buffer, 4, count);
+			let offset = 4 * (count + 1 + (count + 1) % 2);
+			const xs = [], ys = [];
+			for (const length of lengths) {
+				xs.push(new Float64Array(buffer, offset, length)); offset += 8 * length;
+				ys.push(new Float64Array(buffer, offset, length)); offset += 8 * length;
+			}
+			Plotly.restyle(plot, { x: xs, y: ys }, traces);
+		});
+});
+"""
+
+
+DENSITY_SCRIPT = """
+const plot = document.getElementById("{plot_id}");
+let latest = 0;
+plot.on("plotly_relayout", () => {
+	// rebin the heatmap over the new view
+	const layout = plot._fullLayout, x = layout.xaxis.range, y = layout.yaxis.range;
+	const request = ++latest;
+	fetch("density?x0=" + Math.min(...x) + "&x1=" + Math.max(...x) + "&y0=" + Math.min(...y) + "&y1=" + Math.max(...y) + "&width=" + layout._size.w)
+		.then(response => response.json())
+		.then(grid => {
+			if (request != latest) return;
+			Plotly.restyle(plot, { z: [grid.z], x0: [grid.x0], dx: [grid.dx], y0: [grid.y0], dy: [grid.dy] }, [0]);
+		});
+});
+"""
+
+
+ANNOTATION_SCRIPT = """
+const annotationPlot = document.getElementById("{plot_id}");
+let latestAnnotation = 0;
+annotationPlot.on("plotly_relayout", () => {
+	// repack the annotation lanes for the new view
+	const layout = annotationPlot._fullLayout, x = layout.xaxis.range, y = layout.yaxis.range;
+	const request = ++latestAnnotation;
+	fetch("annotation?x0=" + Math.min(...x) + "&x1=" + Math.max(...x) + "&y0=" + Math.min(...y) + "&y1=" + Math.max(...y) + "&width=" + layout._size.w + "&height=" + layout._size.h)
+		.then(response => response.json())
+		.then(tracks => {
+			if (request != latestAnnotation) return;
+			// the tracks are found by the meta draw_dotplot gives them, wherever they are in the figure
+			const query = annotationPlot.data.findIndex(trace => trace.meta == "query_annotation");
+			const reference = annotationPlot.data.findIndex(trace => trace.meta == "reference_annotation");
+			if (tracks.query && query >= 0) Plotly.restyle(annotationPlot, { x: [tracks.query.positions], y: [tracks.query.lanes], text: [tracks.query.text] }, [query]);
+			if (tracks.reference && reference >= 0) Plotly.restyle(annotationPlot, { x: [tracks.reference.lanes], y: [tracks.reference.positions], text: [tracks.reference.text] }, [reference]);
+		});
+});
+"""
+
+
+def annotation_track_json(index, chrm, view, pixels):
+	# annotation_track_points of the annotations in view = (start, end), for the JSON endpoint
+	positions, lanes, text = annotation_track_points(index.query(chrm, view[0], view[1]), (view[1] - view[0]) / pixels)
+	return {"positions": np.where(np.isnan(positions), None, positions).tolist(), "lanes": np.where(np.isnan(lanes), None, lanes).tolist(), "text": text}
+
+
+def refinement_handler(PAFs, page, chrm = None, query_annotation = None, reference_annotation = None):
+	# "/" is the overview figure, "/detail?x0=&x1=&y0=&y1=&width=" the alignments of one view,
+	# "/density?..." the heatmap of one view and "/annotation?...&height=" the annotation lanes
+	indexes = [alignment_region_index(paf) for paf in PAFs]
+	query_index = annotation_index(query_annotation) if query_annotation is not None else None
+	reference_index = annotation_index(reference_annotation) if reference_annotation is not None else None
+	class handler(http.server.BaseHTTPRequestHandler):
+		def send(self, status, body = b"", content_type = "application/octet-stream"):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			url = urllib.parse.urlparse(self.path)
+			if url.path == "/":
+				self.send(200, page, "text/html; charset=utf-8")
+			elif url.path in ("/detail", "/density", "/annotation"):
+				query = urllib.parse.parse_qs(url.query)
+				try:
+					x_range = (float(query["x0"][0]), float(query["x1"][0]))
+					y_range = (float(query["y0"][0]), float(query["y1"][0]))
+					width = max(float(query.get("width", ["1200"])[0]), 1)
+					height = max(float(query.get("height", [str(width)])[0]), 1)
+				except (KeyError, ValueError):
+					self.send(400)
+					return
+				if url.path == "/annotation":
+					tracks = {}
+					if query_index is not None:
+						tracks["query"] = annotation_track_json(query_index, chrm, x_range, width)
+					if reference_index is not None:
+						tracks["reference"] = annotation_track_json(reference_index, chrm, y_range, height)
+					self.send(200, json.dumps(tracks).encode(), "application/json")
+					return
+				if url.path == "/detail":
+					self.send(200, encode_polylines([window_polyline(paf, index, x_range, y_range, width) for paf, index in zip(PAFs, indexes)]))
+					return
+				trace = density_heatmap(density_grid([paf.take(index.window(x_range, y_range)) for paf, index in zip(PAFs, indexes)], x_range, y_range, max(int(width // DENSITY_BIN_PIXELS), 1)), x_range, y_range)
+				grid = {"z": np.where(np.isnan(trace.z), None, trace.z).tolist(), "x0": trace.x0, "dx": trace.dx, "y0": trace.y0, "dy": trace.dy}
+				self.send(200, json.dumps(grid).encode(), "application/json")
+			else:
+				self.send(404)
+
+		def log_message(self, format, *args):
+			pass
+	return handler
+
+
+def serve_dotplot(PAFs, fig, port = 8000, host = "127.0.0.1", density = False, chrm = None, query_annotation = None, reference_annotation = None):
+	# Serve fig (drawn at overview resolution) with plotly.js inlined, and refine its alignment
+	# traces, which draw_dotplot puts first, from the parsed tables whenever the view changes.
+	# The annotation traces, found by their meta, are repacked for every view.
+	script = DENSITY_SCRIPT if density else REFINE_SCRIPT.replace("TRACE_COUNT", str(len(PAFs)))
+	if query_annotation is not None or reference_annotation is not None:
+		script += ANNOTATION_SCRIPT
+	page = fig.to_html(include_plotlyjs = True, full_html = True, post_script = script).encode()
+	server = http.server.ThreadingHTTPServer((host, port), refinement_handler(PAFs, page, chrm, query_annotation, reference_annotation))
+	print(f"serving on http://{host}:{server.server_address[1]}/", file = sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
 def main():
+	# liftover and synteny import this module, so they are imported here rather than at the top
+	import liftover
+	import synteny
 	parser = argparse.ArgumentParser(description='Describe dot plot of alignments in PAF files. Alignments are grouped by PAF file name. This script will show dot plot on your browser and save a picture to the file which you specify.')
 	parser.add_argument("PAFfilename", metavar='PAF', type=str, nargs='+', help='PAF file(s)')
 	parser.add_argument("-o", metavar='FileName', type=str, help='image file name.File name must be like fizz.png or fizz.svn. Please refer to https://plotly.com/python/static-image-export/')
 	parser.add_argument("-c", metavar='Chromosome', type=int, help='chromosome')
 	parser.add_argument("--ref_gene", metavar='ref_gene', type=str, help='gene annotation file for reference genome')
 	parser.add_argument("--query_gene", metavar='query_gene', type=str, help='gene annotation file for query genome')
+	parser.add_argument("--feature_types", metavar='types', type=str, help='comma separated feature types (3rd column) to read from --ref_gene/--query_gene, e.g. gene,pseudogene. Every type as default')
+	parser.add_argument("--ref_gene_chain", metavar='chain', type=str, help='lift --ref_gene through this chain file (e.g. hg19ToHg38.over.chain) before drawing it, for annotations of another assembly')
+	parser.add_argument("--query_gene_chain", metavar='chain', type=str, help='lift --query_gene through this chain file before drawing it')
 	parser.add_argument("--ref_repeat", metavar='ref_repeat', type=str, help='repeat annotation file for reference genome')
 	parser.add_argument("--query_repeat", metavar='query_repeat', type=str, help='repeat annotation file for query genome')
 	parser.add_argument("--chain", metavar='chain', type=str, help='hg19ToHg38')
 	parser.add_argument("--sf", action='store_true', help='if you want to switch ref/query in chain file, set this flag')
+	parser.add_argument("--chain_merge_gap", metavar='bp', type=int, help='join neighbouring chain blocks whose target and query gaps are both at most this size (bp) into one alignment. Plain or gzip chain files are read either way')
+	parser.add_argument("--index", action='store_true', help='build (once) and use a region index next to each PAF/chain file to read only the records of the chromosome given with -c. Works on plain text and BGZF (bgzip) files')
+	parser.add_argument("--tolerance", metavar='bp', type=float, help='drop alignment vertices that move the line less than this (bp). Default is one pixel of the plotted range, 0 keeps every CIGAR operation')
+	parser.add_argument("--batch", metavar='Chromosomes', type=str, nargs='?', const='all', help='draw every chromosome (or a comma separated list such as 1,2,X) into its own file. -o is the output template, "{chrom}" in it is replaced by the chromosome (out.png becomes out_chr1.png, ...)')
+	parser.add_argument("--raster", action='store_true', help='write a .png given with -o (or --batch) with the built-in rasterizer instead of plotly/kaleido. Much faster for large alignment sets')
+	parser.add_argument("--serve", metavar='port', type=int, nargs='?', const = 8000, help='instead of showing the figure, serve it on http://127.0.0.1:port/ (8000 as default) and redraw the alignments of the zoomed region in full detail')
+	parser.add_argument("--genome", action='store_true', help='draw every chromosome on concatenated reference/query axes with chromosome gridlines, instead of one chromosome')
+	parser.add_argument("--ref_fai", metavar='fai', type=str, help='with --genome, .fai index of the reference genome; its sequences, order and lengths define the reference axis (chromosomes of the alignments and PAF column 7 as default)')
+	parser.add_argument("--query_fai", metavar='fai', type=str, help='with --genome, .fai index of the query genome (chromosomes of the alignments and PAF column 2 as default)')
+	parser.add_argument("-qc", metavar=('start', 'end'), type=int, nargs=2, help='shade the query centromere between these coordinates (bp)')
+	parser.add_argument("-rc", metavar=('start', 'end'), type=int, nargs=2, help='shade the reference centromere between these coordinates (bp)')
+	parser.add_argument("--density", action='store_true', help='draw one heatmap of aligned bases (log10 per bin) instead of a line per alignment. Useful for centromeres and segmental duplications')
+	parser.add_argument("--synteny", metavar='max_gap', type=int, nargs='?', const = 100000, help='chain co-linear alignments (gaps up to max_gap bp, 100000 as default) into synteny blocks and draw one line per block, colored by inversion/translocation, instead of one per alignment')
+	parser.add_argument("--threads", metavar='N', type=int, default = os.cpu_count(), help='worker processes for reading PAF files and for --batch (number of CPUs as default)')
+	parser.add_argument("--no-cache", dest='no_cache', action='store_true', help=f'do not read or write the parse cache ({parse_cache.DEFAULT_CACHE_DIR}, set $DOTPLOT_CACHE_DIR / $DOTPLOT_CACHE_SIZE to change it)')
 	args = parser.parse_args()
 	paf_file_names = args.PAFfilename
 	out_file_name = args.o
 	chrm = args.c
-	query_centromere_breakpoint = chrm
+	query_centromere_breakpoint = args.qc
+	reference_centromere_breakpoint = args.rc
 	ref_gene_file_name = args.ref_gene
 	query_gene_file_name = args.query_gene
 	switchflag = args.sf
 	ref_gene = None
 	query_gene = None
+	use_cache = not args.no_cache
+	feature_types = set(args.feature_types.split(",")) if args.feature_types is not None else None
 
+	if args.genome and (chrm is not None or args.batch is not None):
+		parser.error("--genome draws every chromosome and cannot be combined with -c or --batch")
+	if (args.qc is not None or args.rc is not None) and (args.genome or args.batch is not None):
+		parser.error("-qc/-rc are coordinates on one chromosome and cannot be combined with --genome or --batch")
+	if args.synteny is not None and (args.batch is not None or args.raster or args.serve is not None or args.density):
+		parser.error("--synteny cannot be combined with --batch, --raster, --serve or --density")
+
+	if args.batch is not None:
+		if out_file_name is None:
+			parser.error("--batch needs an output template given with -o")
+		# parse the whole genome once, batch_render splits it per chromosome
+		chrm = None
+
+	# annotations lifted through a chain may come from another chromosome, so they are read whole
 	if ref_gene_file_name is not None:
-		if ".gtf" in ref_gene_file_name:
-			ref_gene = gtf_parser(ref_gene_file_name, ref_or_query.R)
-		elif ".gff3" in ref_gene_file_name:
-			ref_gene = gff3_parser(ref_gene_file_name, ref_or_query.R)
+		ref_gene = load_annotation(ref_gene_file_name, ref_or_query.R, chrm if args.ref_gene_chain is None else None, use_cache = use_cache, feature_types = feature_types)
+		if args.ref_gene_chain is not None:
+			ref_gene = liftover.lift_annotation_table(liftover.load_liftover_index(args.ref_gene_chain), ref_gene)
 		print(f"# of ref_anno: {len(ref_gene)}", file = sys.stderr)
 
 	if query_gene_file_name is not None:
-		if ".gtf" in query_gene_file_name:
-			query_gene = gtf_parser(query_gene_file_name, ref_or_query.Q)
-		elif ".gff3" in query_gene_file_name:
-			query_gene = gff3_parser(query_gene_file_name, ref_or_query.Q)
+		query_gene = load_annotation(query_gene_file_name, ref_or_query.Q, chrm if args.query_gene_chain is None else None, use_cache = use_cache, feature_types = feature_types)
+		if args.query_gene_chain is not None:
+			query_gene = liftover.lift_annotation_table(liftover.load_liftover_index(args.query_gene_chain), query_gene)
 		print(f"# of query_anno: {len(query_gene)}", file = sys.stderr)
 
-	paf_instance_array = []
-	for each_filename in paf_file_names:
-		tmp_paf_instance = minimap2_paf_parser(each_filename, dsc = each_filename)
-		paf_instance_array.append(tmp_paf_instance)
+	paf_instance_array = load_paf_files(paf_file_names, chrm, use_index = args.index, use_cache = use_cache, threads = args.threads)
 
 	if args.chain is not None:
-		chain_paf_format_data = chain_parser(args.chain, switchflag = switchflag)
-		only_designated_paf = []
-		for each_chain in chain_paf_format_data:
-			if each_chain.ref_chrom == f"chr{chrm}" and each_chain.query_chrom == f"chr{chrm}":
-				only_designated_paf.append(each_chain)
+		only_designated_paf = load_chain(args.chain, chrm, switchflag = switchflag, use_index = args.index, use_cache = use_cache, merge_gap = args.chain_merge_gap)
 		paf_instance_array.extend([only_designated_paf])
 		#print(str(only_designated_paf[0]))
 		#print(str(only_designated_paf[1]))
@@ -460,11 +1750,42 @@ def main():
 	with open("const.json", "r") as f:
 		const = json.load(f)
 
-	#fig = draw_dotplot(paf_instance_array, chrm, const, query_annotation = query_gene, ref_annotation = None)
-	fig = draw_dotplot(paf_instance_array, chrm, const, reference_centromere_breakpoint = None, query_annotation = query_gene, reference_annotation = ref_gene)
+	# synteny blocks are chained in chromosome coordinates, where sequence ends are known
+	blocks = None
+	if args.synteny is not None:
+		blocks = synteny.synteny_chain(alignment_table.concatenate(paf_instance_array), max_gap = args.synteny)
+		print(f"# of synteny blocks: {len(blocks)}", file = sys.stderr)
+
+	ref_layout = None
+	query_layout = None
+	if args.genome:
+		ref_layout = genome_layout(paf_instance_array, "ref", fai_lengths(args.ref_fai) if args.ref_fai is not None else None)
+		query_layout = genome_layout(paf_instance_array, "query", fai_lengths(args.query_fai) if args.query_fai is not None else None)
+		paf_instance_array = [genome_table(paf, ref_layout, query_layout) for paf in paf_instance_array]
+		ref_gene = genome_annotation_table(ref_gene, ref_layout) if ref_gene is not None else None
+		query_gene = genome_annotation_table(query_gene, query_layout) if query_gene is not None else None
+		blocks = synteny.genome_blocks(blocks, ref_layout, query_layout) if blocks is not None else None
+
+	if args.batch is not None:
+		chromosomes = list(const["GRCh38_chromosome_length"].keys()) if args.batch == "all" else args.batch.split(",")
+		chain_instance_array = paf_instance_array[len(paf_file_names):]
+		batch_render(paf_instance_array[:len(paf_file_names)], chain_instance_array, const, chromosomes, out_file_name, query_annotation = query_gene, reference_annotation = ref_gene, tolerance = args.tolerance, threads = args.threads, use_raster = args.raster)
+		return
+
+	if args.raster and out_file_name is not None and out_file_name.endswith(".png"):
+		draw_dotplot_raster(paf_instance_array, chrm, const, out_file_name, query_centromere_breakpoint = query_centromere_breakpoint, reference_centromere_breakpoint = reference_centromere_breakpoint, query_annotation = query_gene, reference_annotation = ref_gene, tolerance = args.tolerance, ref_layout = ref_layout, query_layout = query_layout)
+		return
+
+	#fig = draw_dotplot(paf_instance_array, chrm, const, query_annotation = query_gene, reference_annotation = None)
+	alignment_layer = None
+	if blocks is not None:
+		alignment_layer = synteny.synteny_traces(blocks)
+	fig = draw_dotplot(paf_instance_array, chrm, const, query_centromere_breakpoint = query_centromere_breakpoint, reference_centromere_breakpoint = reference_centromere_breakpoint, query_annotation = query_gene, reference_annotation = ref_gene, tolerance = args.tolerance, ref_layout = ref_layout, query_layout = query_layout, density = args.density, alignment_layer = alignment_layer)
 	#pio.kaleido.scope.default_width = 2400
 	#pio.kaleido.scope.default_height = 2400
-	if out_file_name is not None:
+	if args.serve is not None:
+		serve_dotplot(paf_instance_array, fig, port = args.serve, density = args.density, chrm = chrm, query_annotation = query_gene, reference_annotation = ref_gene)
+	elif out_file_name is not None:
 		fig.write_image(out_file_name)
 	else:
 		fig.show()
@@ -0,0 +1,298 @@
+#! /usr/bin/env python3
+
+import sys
+import argparse
+import itertools
+import numpy as np
+import dotplot
+import region_index
+
+DEFAULT_MIN_MATCH = 0.95
+LIFT_CHUNK_LINES = 1 << 18
+# tags still true once the target is lifted: the transcript strand and the repeat length of the
+# query, which is unchanged; the others describe the alignment to the old target and are dropped
+KEPT_PAF_TAGS = {"ts", "rl"}
+
+
+class liftover_result():
+	# Lifted intervals, one row per piece: source is the input interval a piece comes from, chrom
+	# a code into chrom_names, rev whether the piece lies on the other strand and split whether its
+	# interval was cut into pieces on several chains. Input intervals without a piece are in
+	# unmapped, with reason "no chain" (not on any block), "partial" (fewer than min_match of the
+	# bases on blocks) or "invalid" (end <= start).
+	def __init__(self, chrom_names, source, chrom, start, end, rev, split, unmapped, reason):
+		self.chrom_names = chrom_names
+		self.source = source
+		self.chrom = chrom
+		self.start = start
+		self.end = end
+		self.rev = rev
+		self.split = split
+		self.unmapped = unmapped
+		self.reason = reason
+
+	def __len__(self):
+		return len(self.source)
+
+	def __str__(self):
+		return f"liftover_result: {len(self)} pieces of {len(np.unique(self.source))} intervals, {len(self.unmapped)} unmapped"
+
+
+class liftover_index():
+	# Block index of a chain_table (dotplot.chain_reader, without merge_gap) for lifting target
+	# coordinates to the query. Blocks are sorted by target chromosome and start and put on one
+	# global axis (chromosome base + position), so a whole array of intervals is located with one
+	# searchsorted. Like UCSC liftOver, it expects every target base on at most one block.
+	def __init__(self, chains):
+		self.chains = chains
+		self.chrom_names = chains.chrom_names
+		chain = chains.block_chain()
+		t_size = np.zeros(len(chains.chrom_names), dtype = np.int64)
+		t_size[chains.t_chrom] = chains.t_size
+		self.t_size = t_size
+		self.chrom_base = np.concatenate(([0], np.cumsum(t_size + 1))).astype(np.int64)
+		order = np.lexsort((chains.block_t_start, chains.t_chrom[chain]))
+		self.chain = chain[order]
+		base = self.chrom_base[chains.t_chrom[self.chain]]
+		self.t_start = chains.block_t_start[order]
+		self.global_start = base + self.t_start
+		self.global_end = base + chains.block_t_end[order]
+		self.q_start = chains.block_q_start[order]
+		self.q_chrom = chains.q_chrom[self.chain]
+		self.q_rev = chains.q_rev[self.chain]
+		self.q_size = chains.q_size[self.chain]
+		self.covered = np.concatenate(([0], np.cumsum(self.global_end - self.global_start)))
+		# boundaries[k]: number of chain changes among the first k + 1 sorted blocks
+		self.boundaries = np.concatenate(([0], np.cumsum(self.chain[1:] != self.chain[:-1])))
+		self.boundary_blocks = np.flatnonzero(np.concatenate(([False], self.chain[1:] != self.chain[:-1])))
+
+	def chrom_codes(self, names):
+		# target chromosome codes of names given with or without "chr", -1 when not in the chains
+		lookup = {}
+		for code, name in enumerate(self.chrom_names):
+			lookup.setdefault(name, code)
+			lookup.setdefault(name[3:] if name.startswith("chr") else f"chr{name}", code)
+		return np.array([lookup.get(name, -1) for name in names], dtype = np.int64)
+
+	def lift_positions(self, chrom, position):
+		# Query chromosome code and position of every target position (0-based), and whether the
+		# base is on the other strand; chrom -1 where the position is not on a block.
+		chrom, position = np.asarray(chrom, dtype = np.int64), np.asarray(position, dtype = np.int64)
+		known = (chrom >= 0) & (position >= 0) & (position < self.t_size[np.maximum(chrom, 0)])
+		key = np.where(known, self.chrom_base[np.maximum(chrom, 0)] + position, -1)
+		block = np.searchsorted(self.global_start, key, side = "right") - 1
+		inside = known & (block >= 0) & (key < self.global_end[np.maximum(block, 0)])
+		block = np.maximum(block, 0)
+		offset = self.q_start[block] + (key - self.global_start[block])
+		rev = self.q_rev[block]
+		lifted = np.where(rev, self.q_size[block] - 1 - offset, offset)
+		return np.where(inside, self.q_chrom[block], -1), np.where(inside, lifted, -1), inside & rev
+
+	def lift(self, chrom, start, end, min_match = DEFAULT_MIN_MATCH):
+		# Lift half-open target intervals (chromosome codes from chrom_codes). Every run of blocks of
+		# one chain under an interval becomes a piece from its first to its last lifted base, so
+		# small gaps inside a chain are bridged like liftOver does; an interval over several chains
+		# is split into one piece per chain. Intervals with fewer than min_match of their bases on
+		# blocks are unmapped.
+		chrom, start, end = np.asarray(chrom, dtype = np.int64), np.asarray(start, dtype = np.int64), np.asarray(end, dtype = np.int64)
+		valid = (chrom >= 0) & (end > start)
+		if len(self.global_start) == 0:
+			empty = np.zeros(0, dtype = np.int64)
+			unmapped = np.arange(len(chrom))
+			return liftover_result(self.chrom_names, empty, empty, empty, empty, empty.astype(bool), empty.astype(bool), unmapped, np.where(valid, "no chain", "invalid"))
+		# the part of an interval beyond the chromosome ends is never on a block
+		base = self.chrom_base[np.maximum(chrom, 0)]
+		size = self.t_size[np.maximum(chrom, 0)]
+		global_start = base + np.clip(start, 0, size)
+		global_end = base + np.clip(end, 0, size)
+		# first block ending after the start and last block starting before the end
+		first = np.searchsorted(self.global_end, global_start, side = "right")
+		last = np.searchsorted(self.global_start, global_end, side = "left") - 1
+		hit = valid & (first <= last)
+		first_safe = np.minimum(first, max(len(self.global_start) - 1, 0))
+		last_safe = np.maximum(last, 0)
+		covered = np.where(hit, self.covered[last_safe + 1] - self.covered[first_safe]
+			- np.maximum(global_start - self.global_start[first_safe], 0)
+			- np.maximum(self.global_end[last_safe] - global_end, 0), 0)
+		fraction = covered / np.maximum(end - start, 1)
+		mapped = hit & (fraction >= min_match)
+		reason = np.where(~valid, "invalid", np.where(~hit, "no chain", "partial"))
+
+		# pieces: the runs of one chain between first and last
+		source = np.flatnonzero(mapped)
+		piece_count = self.boundaries[last_safe[source]] - self.boundaries[first_safe[source]] + 1
+		piece_source = np.repeat(source, piece_count)
+		piece_number = np.arange(len(piece_source)) - np.repeat(np.cumsum(piece_count) - piece_count, piece_count)
+		# boundary_blocks[boundaries[first] + n - 1] is the first block of piece n > 0
+		boundary_index = self.boundaries[first_safe[piece_source]] + piece_number
+		piece_first = np.where(piece_number == 0, first_safe[piece_source], self.boundary_blocks[np.maximum(boundary_index - 1, 0)] if len(self.boundary_blocks) else 0)
+		piece_last = np.where(piece_number == piece_count.repeat(piece_count) - 1, last_safe[piece_source], self.boundary_blocks[np.minimum(boundary_index, max(len(self.boundary_blocks) - 1, 0))] - 1 if len(self.boundary_blocks) else 0)
+		piece_start = np.maximum(global_start[piece_source], self.global_start[piece_first])
+		piece_end = np.minimum(global_end[piece_source], self.global_end[piece_last])
+		# strand coordinates of the query, then forward ones for "-" chains
+		q_start = self.q_start[piece_first] + (piece_start - self.global_start[piece_first])
+		q_end = self.q_start[piece_last] + (piece_end - self.global_start[piece_last])
+		rev = self.q_rev[piece_first]
+		q_size = self.q_size[piece_first]
+		lifted_start = np.where(rev, q_size - q_end, q_start)
+		lifted_end = np.where(rev, q_size - q_start, q_end)
+		unmapped = np.flatnonzero(~mapped)
+		return liftover_result(self.chrom_names, piece_source, self.q_chrom[piece_first], lifted_start, lifted_end, rev, np.repeat(piece_count > 1, piece_count), unmapped, reason[unmapped])
+
+
+def load_liftover_index(chain_file_name):
+	return liftover_index(dotplot.chain_reader(chain_file_name))
+
+
+def lift_annotation_table(index, table, min_match = DEFAULT_MIN_MATCH):
+	# annotation_table in the query coordinates of the chain, one row per lifted piece; names and
+	# types are kept and unmapped rows dropped. Like the GFF3/GTF parsers that build these tables,
+	# start and end are 1-based closed, so they are lifted as [start - 1, end) like lift_gff3_lines.
+	result = index.lift(index.chrom_codes(table.chrom_names)[table.chrom], table.start - 1, table.end, min_match)
+	lifted = table.take(result.source)
+	used, chrom = np.unique(result.chrom, return_inverse = True)
+	return dotplot.annotation_table([index.chrom_names[code] for code in used.tolist()], lifted.type_names, chrom.astype(np.int32), result.start + 1, result.end, lifted.annotation_type, lifted.name_bytes, lifted.name_offsets, ref_or_query = table.ref_or_query)
+
+
+def output_chrom_names(index, names):
+	# query chromosome names, without "chr" when the input names have none
+	strip = bool(names) and not any(name.startswith("chr") for name in names)
+	return [name[3:] if strip and name.startswith("chr") else name for name in index.chrom_names]
+
+
+FLIP_STRAND = {"+": "-", "-": "+"}
+
+
+def lift_bed_lines(index, records, min_match):
+	# BED: columns 1-3 are lifted and the strand (6th column) flipped on "-" chains
+	names = sorted({fields[0] for fields in records})
+	codes = dict(zip(names, index.chrom_codes(names).tolist()))
+	out_names = output_chrom_names(index, names)
+	result = index.lift([codes[fields[0]] for fields in records], [int(fields[1]) for fields in records], [int(fields[2]) for fields in records], min_match)
+	lines = []
+	for source, chrom, start, end, rev in zip(result.source.tolist(), result.chrom.tolist(), result.start.tolist(), result.end.tolist(), result.rev.tolist()):
+		fields = list(records[source])
+		fields[0], fields[1], fields[2] = out_names[chrom], str(start), str(end)
+		if rev and len(fields) > 5:
+			fields[5] = FLIP_STRAND.get(fields[5], fields[5])
+		lines.append("\t".join(fields))
+	return lines, result
+
+
+def lift_gff3_lines(index, records, min_match):
+	# GFF3: 1-based closed columns 4-5 are lifted as [start - 1, end) and the strand (7th column) flipped
+	names = sorted({fields[0] for fields in records})
+	codes = dict(zip(names, index.chrom_codes(names).tolist()))
+	out_names = output_chrom_names(index, names)
+	result = index.lift([codes[fields[0]] for fields in records], [int(fields[3]) - 1 for fields in records], [int(fields[4]) for fields in records], min_match)
+	lines = []
+	for source, chrom, start, end, rev in zip(result.source.tolist(), result.chrom.tolist(), result.start.tolist(), result.end.tolist(), result.rev.tolist()):
+		fields = list(records[source])
+		fields[0], fields[3], fields[4] = out_names[chrom], str(start + 1), str(end)
+		if rev:
+			fields[6] = FLIP_STRAND.get(fields[6], fields[6])
+		lines.append("\t".join(fields))
+	return lines, result
+
+
+def lift_paf_lines(index, records, min_match):
+	# PAF: the target (columns 6-9) is lifted and the strand flipped on "-" chains. The cg:Z CIGAR
+	# is kept (reversed on "-" chains) when the target was lifted in one piece of the same length;
+	# otherwise it no longer fits and is dropped like the tags not in KEPT_PAF_TAGS.
+	names = sorted({fields[5] for fields in records})
+	codes = dict(zip(names, index.chrom_codes(names).tolist()))
+	out_names = output_chrom_names(index, names)
+	q_size = np.zeros(len(index.chrom_names), dtype = np.int64)
+	q_size[index.chains.q_chrom] = index.chains.q_size
+	result = index.lift([codes[fields[5]] for fields in records], [int(fields[7]) for fields in records], [int(fields[8]) for fields in records], min_match)
+	lines = []
+	for source, chrom, start, end, rev, split in zip(result.source.tolist(), result.chrom.tolist(), result.start.tolist(), result.end.tolist(), result.rev.tolist(), result.split.tolist()):
+		fields = list(records[source])
+		same_length = not split and end - start == int(fields[8]) - int(fields[7])
+		tags = []
+		for tag in fields[12:]:
+			if tag.startswith("cg:Z:"):
+				if same_length:
+					ops = dotplot.cigar_parser(tag[5:])
+					tags.append("cg:Z:" + "".join(ops[::-1] if rev else ops))
+			elif tag[:2] in KEPT_PAF_TAGS:
+				tags.append(tag)
+		fields[4] = FLIP_STRAND.get(fields[4], fields[4]) if rev else fields[4]
+		fields[5], fields[6], fields[7], fields[8] = out_names[chrom], str(q_size[chrom]), str(start), str(end)
+		lines.append("\t".join(fields[:12] + tags))
+	return lines, result
+
+
+LIFTERS = {"bed": (lift_bed_lines, 3), "gff3": (lift_gff3_lines, 9), "paf": (lift_paf_lines, 12)}
+
+
+def input_format(file_name):
+	root = file_name[:-3] if file_name.endswith(".gz") else file_name
+	for suffix, file_format in [(".gff3", "gff3"), (".gff", "gff3"), (".paf", "paf"), (".bed", "bed")]:
+		if root.endswith(suffix):
+			return file_format
+	return None
+
+
+def liftover_file(index, file_name, file_format, out, unmapped_out = None, min_match = DEFAULT_MIN_MATCH):
+	# Streams a plain or gzip BED/GFF3/PAF file through the index, LIFT_CHUNK_LINES lines at a time.
+	# Headers and comments are copied (GFF3 ##sequence-region lines are dropped, their lengths are
+	# no longer right). Unmapped records go to unmapped_out with a "#reason" line before each.
+	lifter, min_columns = LIFTERS[file_format]
+	lines = region_index.iter_lines(file_name)
+	counts = {"lifted": 0, "split": 0, "unmapped": 0}
+	while True:
+		chunk = list(itertools.islice(lines, LIFT_CHUNK_LINES))
+		if not chunk:
+			break
+		records = []
+		passed = []
+		for line in chunk:
+			if line.startswith(("#", "track", "browser")) or not line.strip():
+				if not line.startswith("##sequence-region"):
+					passed.append(line.rstrip("\n"))
+				continue
+			fields = line.rstrip("\n").split("\t")
+			if len(fields) >= min_columns:
+				records.append(fields)
+		lifted, result = lifter(index, records, min_match) if records else ([], None)
+		if passed or lifted:
+			out.write("\n".join(passed + lifted) + "\n")
+		if result is None:
+			continue
+		counts["lifted"] += len(np.unique(result.source))
+		counts["split"] += len(np.unique(result.source[result.split]))
+		counts["unmapped"] += len(result.unmapped)
+		if unmapped_out is not None and len(result.unmapped):
+			unmapped_out.write("".join(f"#{reason}\n" + "\t".join(records[source]) + "\n" for source, reason in zip(result.unmapped.tolist(), result.reason.tolist())))
+	return counts
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Lift BED, GFF3 or PAF (target side) coordinates through a chain file, e.g. hg19ToHg38.over.chain. Plain or gzip input.')
+	parser.add_argument("chain", metavar='chain', type=str, help='chain file (source genome is the chain target)')
+	parser.add_argument("input", metavar='input', type=str, help='BED, GFF3 or PAF file to lift')
+	parser.add_argument("-o", metavar='FileName', type=str, help='output file name (stdout as default)')
+	parser.add_argument("--unmapped", metavar='FileName', type=str, help='write the records that could not be lifted here, each after a "#reason" line')
+	parser.add_argument("--format", choices = sorted(LIFTERS), help='input format (from the file extension as default)')
+	parser.add_argument("--min_match", metavar='fraction', type=float, default = DEFAULT_MIN_MATCH, help=f'minimum fraction of an interval on chain blocks to lift it ({DEFAULT_MIN_MATCH} as default)')
+	args = parser.parse_args()
+	file_format = args.format or input_format(args.input)
+	if file_format is None:
+		parser.error("cannot tell the input format from its name, give --format")
+
+	index = load_liftover_index(args.chain)
+	out = sys.stdout if args.o is None else open(args.o, "w")
+	unmapped_out = open(args.unmapped, "w") if args.unmapped is not None else None
+	try:
+		counts = liftover_file(index, args.input, file_format, out, unmapped_out, args.min_match)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+		if unmapped_out is not None:
+			unmapped_out.close()
+	print(f"lifted {counts['lifted']} records ({counts['split']} split), {counts['unmapped']} unmapped", file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
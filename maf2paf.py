@@ -1,41 +1,206 @@
 #! /usr/bin/env python3
-import dotplot
+import region_index
 import sys
+import os
+import gzip
+import argparse
+import collections
+import concurrent.futures
+import numpy as np
 
-def last_maf_parser(filename:str, dsc = None, number = 0):
-	tmp_array = []
-	with open(filename) as f:
-		for line in f:
-			if line.startswith("#") or line == "\n":
-				pass
-				#print(line, end="")
-			else:
-				if line.startswith("s"):
-					s = line.split()[1:-1]
-					tmp_array.append(s)
-	for i in range(0, len(tmp_array), 2):
-		ref_idx = i
-		qry_idx = i + 1
-		ref = tmp_array[ref_idx]
-		qry = tmp_array[qry_idx]
-		ref_chrm, ref_start_pos, ref_aligned_bases, ref_strand, ref_seqlen = ref
-		qry_chrm, qry_start_pos, qry_aligned_bases, qry_strand, qry_seqlen = qry
-		ref_end_pos = int(ref_start_pos) + int(ref_aligned_bases)
-		if qry_strand == '+':
-			qry_end_pos = int(qry_start_pos) + int(qry_aligned_bases)
+WRITE_BUFFER_RECORDS = 1 << 14
+DEFAULT_CHUNK_SIZE = 32 << 20
+
+
+def iter_maf_blocks(filename:str):
+	# yields the split "s" lines of one alignment block at a time; plain or gzip input
+	return iter_maf_line_blocks(region_index.iter_lines(filename))
+
+
+def iter_maf_line_blocks(lines):
+	block = []
+	for line in lines:
+		if line.startswith("s"):
+			block.append(line.split())
+		elif line.startswith("a") or line == "\n":
+			if block:
+				yield block
+			block = []
+	if block:
+		yield block
+
+
+GAP = ord("-")
+MAPQ_UNAVAILABLE = "255"
+
+
+def alignment_columns_to_cigar(ref_text, qry_text):
+	# M/I/D runs, number of matching bases and block length of two gapped MAF rows, computed
+	# over the bytes with NumPy. Columns gapped in both rows are dropped, and so are the I/D
+	# columns before the first and after the last M column; the reference and query bases they
+	# hold are returned as (ref_lead, ref_trail, qry_lead, qry_trail) in text order so the
+	# coordinates can be trimmed to match. Rows without any M column give an empty CIGAR.
+	ref = np.frombuffer(ref_text.encode(), dtype = np.uint8)
+	qry = np.frombuffer(qry_text.encode(), dtype = np.uint8)
+	ref_gap = ref == GAP
+	qry_gap = qry == GAP
+	keep = ~(ref_gap & qry_gap)
+	# 0: M, 1: I (base only in the query), 2: D (base only in the reference)
+	ops = (ref_gap.astype(np.int8) + 2 * qry_gap.astype(np.int8))[keep]
+	matches = int(np.count_nonzero(((ref | 32) == (qry | 32)) & ~ref_gap & ~qry_gap))
+	aligned = np.flatnonzero(ops == 0)
+	if len(aligned) == 0:
+		return "", matches, 0, (0, 0, 0, 0)
+	first, last = int(aligned[0]), int(aligned[-1]) + 1
+	trims = (int(np.count_nonzero(ops[:first] == 2)), int(np.count_nonzero(ops[last:] == 2)), int(np.count_nonzero(ops[:first] == 1)), int(np.count_nonzero(ops[last:] == 1)))
+	ops = ops[first:last]
+	run_starts = np.concatenate(([0], np.flatnonzero(ops[1:] != ops[:-1]) + 1))
+	run_lengths = np.diff(np.append(run_starts, len(ops)))
+	cigar = "".join(f"{length}{'MID'[op]}" for length, op in zip(run_lengths.tolist(), ops[run_starts].tolist()))
+	return cigar, matches, len(ops), trims
+
+
+def forward_coordinates(start, size, strand, seqlen):
+	# MAF coordinates of "-" rows count from the end of the reverse complement
+	if strand == "+":
+		return start, start + size
+	return seqlen - start - size, seqlen - start
+
+
+def maf_block_to_paf(block):
+	# the first sequence of a block is the reference, every other one is a query aligned to it
+	ref_chrm, ref_start_pos, ref_aligned_bases, ref_strand, ref_seqlen, ref_text = block[0][1:7]
+	ref_start_pos, ref_aligned_bases, ref_seqlen = int(ref_start_pos), int(ref_aligned_bases), int(ref_seqlen)
+	ref_start, ref_end = forward_coordinates(ref_start_pos, ref_aligned_bases, ref_strand, ref_seqlen)
+	if ref_strand == "-":
+		ref_text = ref_text[::-1]
+	for qry in block[1:]:
+		qry_chrm, qry_start_pos, qry_aligned_bases, qry_strand, qry_seqlen, qry_text = qry[1:7]
+		qry_start_pos, qry_aligned_bases, qry_seqlen = int(qry_start_pos), int(qry_aligned_bases), int(qry_seqlen)
+		qry_start, qry_end = forward_coordinates(qry_start_pos, qry_aligned_bases, qry_strand, qry_seqlen)
+		if ref_strand == "-":
+			# PAF wants the reference forward; flipping the whole block flips the query strand
+			qry_text = qry_text[::-1]
+			qry_strand = "+" if qry_strand == "-" else "-"
+		cigar, matches, block_length, (ref_lead, ref_trail, qry_lead, qry_trail) = alignment_columns_to_cigar(ref_text, qry_text)
+		if block_length == 0:
+			# no column with bases in both rows
+			continue
+		# the reference text runs forward; "-" query text runs from the query end
+		row_ref_start, row_ref_end = ref_start + ref_lead, ref_end - ref_trail
+		if qry_strand == "+":
+			qry_start, qry_end = qry_start + qry_lead, qry_end - qry_trail
+		else:
+			qry_start, qry_end = qry_start + qry_trail, qry_end - qry_lead
+		print_array = [qry_chrm, str(qry_seqlen), str(qry_start), str(qry_end), qry_strand, ref_chrm, str(ref_seqlen), str(row_ref_start), str(row_ref_end), str(matches), str(block_length), MAPQ_UNAVAILABLE, f"cg:Z:{cigar}"]
+		yield "\t".join(print_array)
+
+
+def last_maf_parser(filename:str, out = sys.stdout):
+	# converts block by block and writes in batches, so memory does not grow with the input
+	buffer = []
+	for block in iter_maf_blocks(filename):
+		buffer.extend(maf_block_to_paf(block))
+		if len(buffer) >= WRITE_BUFFER_RECORDS:
+			out.write("\n".join(buffer) + "\n")
+			buffer = []
+	if buffer:
+		out.write("\n".join(buffer) + "\n")
+
+
+def convert_maf_text(text):
+	return "".join(line + "\n" for block in iter_maf_line_blocks(text.splitlines(True)) for line in maf_block_to_paf(block))
+
+
+def convert_maf_range(filename, start, end):
+	with open(filename, "rb") as f:
+		f.seek(start)
+		return convert_maf_text(f.read(end - start).decode())
+
+
+def maf_block_offsets(filename, chunk_size = DEFAULT_CHUNK_SIZE):
+	# byte ranges of about chunk_size of a plain MAF file, each starting at an "a" line
+	size = os.path.getsize(filename)
+	starts = [0]
+	with open(filename, "rb") as f:
+		while starts[-1] + chunk_size < size:
+			f.seek(starts[-1] + chunk_size)
+			f.readline()
+			while True:
+				offset = f.tell()
+				line = f.readline()
+				if not line or line.startswith(b"a"):
+					break
+			if offset >= size:
+				break
+			starts.append(offset)
+	return list(zip(starts, starts[1:] + [size]))
+
+
+def iter_maf_text_chunks(filename, chunk_size = DEFAULT_CHUNK_SIZE):
+	# decompressed text of a gzip MAF in pieces of about chunk_size that end before an "a" line
+	with gzip.open(filename, "rt") as f:
+		rest = ""
+		while True:
+			data = f.read(chunk_size)
+			if not data:
+				break
+			text = rest + data
+			cut = text.rfind("\na")
+			if cut < 0:
+				rest = text
+				continue
+			yield text[:cut + 1]
+			rest = text[cut + 1:]
+		if rest:
+			yield rest
+
+
+def parallel_maf_parser(filename:str, out = sys.stdout, threads = None, ordered = True, chunk_size = DEFAULT_CHUNK_SIZE):
+	# Convert chunks in worker processes. Plain files are split at "a" lines by byte offset and the
+	# workers read their own range, gzip files are decompressed here and the text is handed over.
+	# At most 2 * threads chunks are in flight so memory stays bounded.
+	threads = threads or os.cpu_count()
+	if region_index.compression_type(filename) == "none":
+		tasks = ((convert_maf_range, filename, start, end) for start, end in maf_block_offsets(filename, chunk_size))
+	else:
+		tasks = ((convert_maf_text, text) for text in iter_maf_text_chunks(filename, chunk_size))
+	with concurrent.futures.ProcessPoolExecutor(max_workers = threads) as executor:
+		pending = collections.deque()
+		for task in tasks:
+			pending.append(executor.submit(*task))
+			while len(pending) >= 2 * threads:
+				if ordered:
+					out.write(pending.popleft().result())
+				else:
+					done, _ = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+					for future in done:
+						pending.remove(future)
+						out.write(future.result())
+		if ordered:
+			for future in pending:
+				out.write(future.result())
 		else:
-			qry_end_pos = int(qry_start_pos) - int(qry_aligned_bases)
-		ref_end_pos = str(ref_end_pos)
-		qry_end_pos = str(qry_end_pos)
-		print_array = [qry_chrm, qry_seqlen, qry_start_pos, qry_end_pos, qry_strand, ref_chrm, ref_seqlen, ref_start_pos, ref_end_pos]
-		print_str = "\t".join(print_array)
-		print(print_str)
+			for future in concurrent.futures.as_completed(pending):
+				out.write(future.result())
 
 
 def main():
-	if len(sys.argv) < 2:
-		print(f"Usage: maf2paf.py yourAlignment.maf > yourAlignment.paf\nThis script will output result to stdout.")
-	maf = last_maf_parser(sys.argv[1])
+	parser = argparse.ArgumentParser(description='Convert MAF (e.g. LAST output, plain or gzip) to PAF. This script will output result to stdout unless -o is given.')
+	parser.add_argument("MAFfilename", metavar='MAF', type=str, help='input MAF file')
+	parser.add_argument("-o", metavar='FileName', type=str, help='output PAF file name (stdout as default)')
+	parser.add_argument("--threads", metavar='N', type=int, default = 1, help='convert chunks of the MAF in N worker processes (1 as default)')
+	parser.add_argument("--unordered", action='store_true', help='with --threads, write chunks as soon as they are converted instead of in input order')
+	args = parser.parse_args()
+	out = sys.stdout if args.o is None else open(args.o, "w")
+	try:
+		if args.threads > 1:
+			parallel_maf_parser(args.MAFfilename, out = out, threads = args.threads, ordered = not args.unordered)
+		else:
+			last_maf_parser(args.MAFfilename, out = out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
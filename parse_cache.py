@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+
+import sys
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import argparse
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get("DOTPLOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dotplot"))
+DEFAULT_CACHE_SIZE = int(os.environ.get("DOTPLOT_CACHE_SIZE", 8 << 30))
+CACHE_VERSION = 1
+
+
+def cache_key(filename, parser_name, options):
+	stat = os.stat(filename)
+	source = json.dumps([CACHE_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, parser_name, options], sort_keys = True, default = str)
+	return hashlib.sha1(source.encode()).hexdigest()
+
+
+def entry_size(entry_dir):
+	return sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+
+
+def load_entry(entry_dir, table_class):
+	with open(os.path.join(entry_dir, "meta.json"), "r") as f:
+		meta = json.load(f)
+	columns = {}
+	for name, length in meta["columns"].items():
+		# zero sized arrays cannot be memory mapped
+		columns[name] = np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode = "r" if length else None)
+	# mark as recently used for eviction
+	os.utime(os.path.join(entry_dir, "meta.json"))
+	return table_class.from_columns(columns, meta["table"])
+
+
+def store_entry(cache_dir, key, table):
+	columns, table_meta = table.to_columns()
+	os.makedirs(cache_dir, exist_ok = True)
+	tmp_dir = tempfile.mkdtemp(prefix = f".{key}.", dir = cache_dir)
+	try:
+		for name, column in columns.items():
+			np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(column))
+		with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+			json.dump({"columns": {name: len(column) for name, column in columns.items()}, "table": table_meta}, f)
+		os.rename(tmp_dir, os.path.join(cache_dir, key))
+	except OSError:
+		# another process stored the same entry first, or the cache is not writable
+		shutil.rmtree(tmp_dir, ignore_errors = True)
+
+
+def evict(cache_dir, max_bytes):
+	# drop least recently used entries until the cache fits in max_bytes
+	entries = []
+	for name in os.listdir(cache_dir):
+		entry_dir = os.path.join(cache_dir, name)
+		meta_file = os.path.join(entry_dir, "meta.json")
+		if name.startswith(".") or not os.path.isfile(meta_file):
+			continue
+		entries.append((os.path.getmtime(meta_file), entry_size(entry_dir), entry_dir))
+	entries.sort()
+	total = sum(size for _, size, _ in entries)
+	for _, size, entry_dir in entries:
+		if total <= max_bytes:
+			break
+		shutil.rmtree(entry_dir, ignore_errors = True)
+		total -= size
+
+
+def lookup(table_class, filename, parser_name, options, cache_dir = None):
+	# stored table for filename parsed with these options, or None
+	cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+	entry_dir = os.path.join(cache_dir, cache_key(filename, parser_name, options))
+	if os.path.isdir(entry_dir):
+		try:
+			return load_entry(entry_dir, table_class)
+		except (OSError, ValueError, KeyError):
+			shutil.rmtree(entry_dir, ignore_errors = True)
+	return None
+
+
+def store(table, filename, parser_name, options, cache_dir = None, max_bytes = None):
+	cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+	max_bytes = DEFAULT_CACHE_SIZE if max_bytes is None else max_bytes
+	try:
+		store_entry(cache_dir, cache_key(filename, parser_name, options), table)
+		evict(cache_dir, max_bytes)
+	except OSError as e:
+		print(f"cannot write parse cache {cache_dir}: {e}", file = sys.stderr)
+
+
+def cached(table_class, filename, parser_name, options, parse, enabled = True, cache_dir = None, max_bytes = None):
+	# Return parse() for filename, or its stored result from an earlier run with the same file
+	# (path, size, mtime) and the same parser options. Columns are loaded memory mapped.
+	# table_class needs to_columns()/from_columns(); options must describe everything that
+	# changes what parse() returns.
+	if not enabled:
+		return parse()
+	table = lookup(table_class, filename, parser_name, options, cache_dir = cache_dir)
+	if table is None:
+		table = parse()
+		store(table, filename, parser_name, options, cache_dir = cache_dir, max_bytes = max_bytes)
+	return table
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Inspect or clear the parse cache used by dotplot.py and chainfile_range_vis.py')
+	parser.add_argument("--cache_dir", metavar='dir', type=str, default = DEFAULT_CACHE_DIR, help=f'cache directory ({DEFAULT_CACHE_DIR} as default, or $DOTPLOT_CACHE_DIR)')
+	parser.add_argument("--clear", action='store_true', help='remove every cache entry')
+	args = parser.parse_args()
+	if not os.path.isdir(args.cache_dir):
+		print(f"{args.cache_dir}: no cache", file = sys.stderr)
+		return
+	if args.clear:
+		evict(args.cache_dir, 0)
+	sizes = [entry_size(os.path.join(args.cache_dir, name)) for name in os.listdir(args.cache_dir) if not name.startswith(".")]
+	print(f"{args.cache_dir}: {len(sizes)} entries, {sum(sizes)} bytes", file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,245 @@
+#! /usr/bin/env python3
+
+import struct
+import zlib
+import numpy as np
+
+# 3x5 glyphs, one int per row with bit 2 as the left column
+FONT = {
+	"0": (7, 5, 5, 5, 7), "1": (2, 6, 2, 2, 7), "2": (7, 1, 7, 4, 7), "3": (7, 1, 7, 1, 7), "4": (5, 5, 7, 1, 1),
+	"5": (7, 4, 7, 1, 7), "6": (7, 4, 7, 5, 7), "7": (7, 1, 1, 1, 1), "8": (7, 5, 7, 5, 7), "9": (7, 5, 7, 1, 7),
+	"A": (2, 5, 7, 5, 5), "B": (6, 5, 6, 5, 6), "C": (3, 4, 4, 4, 3), "D": (6, 5, 5, 5, 6), "E": (7, 4, 6, 4, 7),
+	"F": (7, 4, 6, 4, 4), "G": (3, 4, 5, 5, 3), "H": (5, 5, 7, 5, 5), "I": (7, 2, 2, 2, 7), "J": (1, 1, 1, 5, 2),
+	"K": (5, 5, 6, 5, 5), "L": (4, 4, 4, 4, 7), "M": (5, 7, 7, 5, 5), "N": (6, 5, 5, 5, 5), "O": (2, 5, 5, 5, 2),
+	"P": (6, 5, 6, 4, 4), "Q": (2, 5, 5, 6, 3), "R": (6, 5, 6, 5, 5), "S": (3, 4, 2, 1, 6), "T": (7, 2, 2, 2, 2),
+	"U": (5, 5, 5, 5, 7), "V": (5, 5, 5, 5, 2), "W": (5, 5, 7, 7, 5), "X": (5, 5, 2, 5, 5), "Y": (5, 5, 2, 2, 2),
+	"Z": (7, 1, 2, 4, 7), ".": (0, 0, 0, 0, 2), ",": (0, 0, 0, 2, 4), "-": (0, 0, 7, 0, 0), "_": (0, 0, 0, 0, 7),
+	"/": (1, 1, 2, 4, 4), ":": (0, 2, 0, 2, 0), "(": (1, 2, 2, 2, 1), ")": (4, 2, 2, 2, 4), "+": (0, 2, 7, 2, 0),
+	"?": (7, 1, 2, 0, 2), " ": (0, 0, 0, 0, 0)
+}
+GLYPH_WIDTH = 3
+GLYPH_HEIGHT = 5
+# segments are sampled in batches of at most this many pixels
+MAX_SAMPLES = 1 << 22
+
+
+def parse_color(color):
+	# "#rrggbb" or plotly's "rgb(r, g, b)" as a float RGB array
+	if color.startswith("#"):
+		return np.array([int(color[i:i + 2], 16) for i in (1, 3, 5)], dtype = np.float32)
+	return np.array([float(value) for value in color[color.index("(") + 1:color.index(")")].split(",")[:3]], dtype = np.float32)
+
+
+def png_bytes(image):
+	# 8 bit RGB PNG of a (height, width, 3) uint8 array, every row with filter type 0
+	height, width = image.shape[:2]
+	raw = np.zeros((height, width * 3 + 1), dtype = np.uint8)
+	raw[:, 1:] = image.reshape(height, width * 3)
+	def chunk(kind, data):
+		return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+	return b"".join([
+		b"\x89PNG\r\n\x1a\n",
+		chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+		chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+		chunk(b"IEND", b"")])
+
+
+def write_png(filename, image):
+	with open(filename, "wb") as f:
+		f.write(png_bytes(image))
+
+
+def clip_segments(x0, y0, x1, y1, box):
+	# Liang-Barsky clipping of segments to box (left, top, right, bottom). Returns the parameters
+	# t_enter, t_exit of the visible part and a mask of the segments that are visible at all.
+	left, top, right, bottom = box
+	dx = x1 - x0
+	dy = y1 - y0
+	t_enter = np.zeros(len(x0))
+	t_exit = np.ones(len(x0))
+	outside = np.zeros(len(x0), dtype = bool)
+	with np.errstate(divide = "ignore", invalid = "ignore"):
+		for p, q in ((-dx, x0 - left), (dx, right - x0), (-dy, y0 - top), (dy, bottom - y0)):
+			t = q / p
+			t_enter = np.where(p < 0, np.maximum(t_enter, t), t_enter)
+			t_exit = np.where(p > 0, np.minimum(t_exit, t), t_exit)
+			outside |= (p == 0) & (q < 0)
+	return t_enter, t_exit, ~outside & (t_enter <= t_exit)
+
+
+def sample_segments(px, py, box, weights = None):
+	# Integer pixels along a NaN separated polyline given in pixel coordinates. Every segment is
+	# clipped to box (left, top, right, bottom) and sampled once per pixel of its longer side.
+	# Yields (x, y) arrays in batches of at most MAX_SAMPLES, so memory stays bounded however
+	# many segments there are. With weights (one per segment, px[i] -> px[i + 1]) it yields
+	# (x, y, weight), the visible part of each segment's weight spread evenly over its samples.
+	left, top, right, bottom = box
+	if len(px) < 2:
+		return
+	x0, y0, x1, y1 = px[:-1], py[:-1], px[1:], py[1:]
+	valid = np.isfinite(x0) & np.isfinite(y0) & np.isfinite(x1) & np.isfinite(y1)
+	x0, y0, x1, y1 = x0[valid], y0[valid], x1[valid], y1[valid]
+	t_enter, t_exit, visible = clip_segments(x0, y0, x1, y1, (left, top, right - 1e-6, bottom - 1e-6))
+	if weights is not None:
+		weights = np.asarray(weights, dtype = np.float64)[valid][visible] * (t_exit - t_enter)[visible]
+	dx, dy = (x1 - x0)[visible], (y1 - y0)[visible]
+	start_x = x0[visible] + t_enter[visible] * dx
+	start_y = y0[visible] + t_enter[visible] * dy
+	span = t_exit[visible] - t_enter[visible]
+	dx, dy = dx * span, dy * span
+	counts = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+	ends = np.cumsum(counts)
+	batch_start = 0
+	while batch_start < len(counts):
+		done = ends[batch_start - 1] if batch_start else 0
+		batch_end = max(batch_start + 1, int(np.searchsorted(ends, done + MAX_SAMPLES, side = "right")))
+		batch_counts = counts[batch_start:batch_end]
+		segment = np.repeat(np.arange(batch_start, batch_end), batch_counts)
+		step = np.arange(len(segment)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+		t = step / np.maximum(batch_counts - 1, 1)[segment - batch_start]
+		sample_x = np.clip(np.floor(start_x[segment] + t * dx[segment]).astype(np.int64), left, right - 1)
+		sample_y = np.clip(np.floor(start_y[segment] + t * dy[segment]).astype(np.int64), top, bottom - 1)
+		if weights is None:
+			yield sample_x, sample_y
+		else:
+			yield sample_x, sample_y, (weights[batch_start:batch_end] / batch_counts)[segment - batch_start]
+		batch_start = batch_end
+
+
+def thicken(mask, width):
+	# grow every set pixel into a width x width square
+	if width <= 1:
+		return mask
+	out = mask.copy()
+	low = -(width // 2)
+	height, image_width = mask.shape
+	for dy in range(low, low + width):
+		for dx in range(low, low + width):
+			if dy == 0 and dx == 0:
+				continue
+			out[max(dy, 0):height + min(dy, 0), max(dx, 0):image_width + min(dx, 0)] |= mask[max(-dy, 0):height - max(dy, 0), max(-dx, 0):image_width - max(dx, 0)]
+	return out
+
+
+def text_mask(text, scale = 2):
+	glyphs = np.zeros((GLYPH_HEIGHT, max(len(text) * (GLYPH_WIDTH + 1) - 1, 0)), dtype = bool)
+	for i, char in enumerate(text.upper()):
+		for row, bits in enumerate(FONT.get(char, FONT["?"])):
+			for column in range(GLYPH_WIDTH):
+				glyphs[row, i * (GLYPH_WIDTH + 1) + column] = (bits >> (GLYPH_WIDTH - 1 - column)) & 1
+	return np.kron(glyphs, np.ones((scale, scale), dtype = bool)).astype(bool)
+
+
+def nice_step(span, ticks = 8):
+	# 1, 2 or 5 times a power of ten giving about ticks intervals over span
+	raw = span / ticks
+	magnitude = 10 ** np.floor(np.log10(raw)) if raw > 0 else 1
+	for factor in (1, 2, 5, 10):
+		if raw <= factor * magnitude:
+			return factor * magnitude
+	return 10 * magnitude
+
+
+def tick_label(value, step):
+	for unit, suffix in ((1e9, "G"), (1e6, "M"), (1e3, "K")):
+		if step >= unit:
+			return f"{value / unit:g}{suffix}"
+	return f"{value:g}"
+
+
+class raster_canvas():
+	# RGB float image with a plot box (left, top, right, bottom in pixels) that shows x_range
+	# left to right and y_range top to bottom, like the reversed reference axis of draw_dotplot
+	def __init__(self, width, height, plot_box, x_range, y_range, background = "#ffffff"):
+		self.image = np.empty((height, width, 3), dtype = np.float32)
+		self.image[:] = parse_color(background)
+		self.plot_box = plot_box
+		self.x_range = x_range
+		self.y_range = y_range
+
+	def to_pixel_x(self, x):
+		left, _, right, _ = self.plot_box
+		return left + (np.asarray(x, dtype = np.float64) - self.x_range[0]) * ((right - left) / (self.x_range[1] - self.x_range[0]))
+
+	def to_pixel_y(self, y):
+		_, top, _, bottom = self.plot_box
+		return top + (np.asarray(y, dtype = np.float64) - self.y_range[0]) * ((bottom - top) / (self.y_range[1] - self.y_range[0]))
+
+	def blend(self, mask, color, alpha = 1.0):
+		self.image[mask] = self.image[mask] * (1 - alpha) + parse_color(color) * alpha
+
+	def fill_rect(self, x0, y0, x1, y1, color, alpha = 1.0):
+		# pixel coordinates, clamped to the image
+		height, width = self.image.shape[:2]
+		x0, x1 = sorted((int(np.clip(x0, 0, width)), int(np.clip(x1, 0, width))))
+		y0, y1 = sorted((int(np.clip(y0, 0, height)), int(np.clip(y1, 0, height))))
+		region = self.image[y0:y1, x0:x1]
+		region[:] = region * (1 - alpha) + parse_color(color) * alpha
+
+	def line_mask(self, px, py, width = 1, box = None):
+		# pixels covered by a NaN separated polyline in pixel coordinates, clipped to box (the plot
+		# box as default)
+		left, top, right, bottom = self.plot_box if box is None else box
+		mask = np.zeros(self.image.shape[:2], dtype = bool)
+		for sample_x, sample_y in sample_segments(px, py, (left, top, right, bottom)):
+			mask[sample_y, sample_x] = True
+		mask = thicken(mask, width)
+		# thick lines must not spill out of the box
+		inside = np.zeros_like(mask)
+		inside[top:bottom, left:right] = True
+		return mask & inside
+
+	def draw_polyline(self, x, y, color, alpha = 1.0, width = 1, box = None):
+		# x, y in data coordinates
+		self.blend(self.line_mask(self.to_pixel_x(x), self.to_pixel_y(y), width = width, box = box), color, alpha)
+
+	def draw_text(self, text, x, y, color = "#2a3f5f", scale = 2, align = "left", vertical = False):
+		# x, y is the top left corner (align = "left"), top centre or top right of the text;
+		# vertical text reads bottom to top
+		mask = text_mask(text, scale = scale)
+		if vertical:
+			mask = np.rot90(mask)
+			offset = {"left": 0, "center": mask.shape[0] // 2, "right": mask.shape[0]}[align]
+			y0, x0 = int(y) - offset, int(x)
+		else:
+			offset = {"left": 0, "center": mask.shape[1] // 2, "right": mask.shape[1]}[align]
+			y0, x0 = int(y), int(x) - offset
+		height, width = self.image.shape[:2]
+		clip_y0, clip_x0 = max(y0, 0), max(x0, 0)
+		clip_y1, clip_x1 = min(y0 + mask.shape[0], height), min(x0 + mask.shape[1], width)
+		if clip_y0 >= clip_y1 or clip_x0 >= clip_x1:
+			return
+		full = np.zeros(self.image.shape[:2], dtype = bool)
+		full[clip_y0:clip_y1, clip_x0:clip_x1] = mask[clip_y0 - y0:clip_y1 - y0, clip_x0 - x0:clip_x1 - x0]
+		self.blend(full, color)
+
+	def draw_axes(self, x_title = None, y_title = None, title = None, grid_color = "#ffffff", axis_color = "#2a3f5f", x_label_offset = 0, y_label_offset = 0, ticks = True):
+		# Grid lines, ticks and tick labels for both ranges plus the titles around the plot box.
+		# The offsets move the tick labels away from the box to leave room for annotation tracks.
+		left, top, right, bottom = self.plot_box
+		x_step = nice_step(self.x_range[1] - self.x_range[0])
+		y_step = nice_step(self.y_range[1] - self.y_range[0])
+		for value in ([] if not ticks else np.arange(np.ceil(self.x_range[0] / x_step) * x_step, self.x_range[1] + x_step / 2, x_step)):
+			px = int(self.to_pixel_x(value))
+			if left <= px < right:
+				self.fill_rect(px, top, px + 1, bottom, grid_color)
+				self.fill_rect(px, bottom + x_label_offset, px + 1, bottom + x_label_offset + 5, axis_color)
+				self.draw_text(tick_label(value, x_step), px, bottom + x_label_offset + 8, color = axis_color, align = "center")
+		for value in ([] if not ticks else np.arange(np.ceil(self.y_range[0] / y_step) * y_step, self.y_range[1] + y_step / 2, y_step)):
+			py = int(self.to_pixel_y(value))
+			if top <= py < bottom:
+				self.fill_rect(left, py, right, py + 1, grid_color)
+				self.fill_rect(left - y_label_offset - 5, py, left - y_label_offset, py + 1, axis_color)
+				self.draw_text(tick_label(value, y_step), left - y_label_offset - 8, py - GLYPH_HEIGHT, color = axis_color, align = "right")
+		if title:
+			self.draw_text(title, (left + right) // 2, 12, color = axis_color, scale = 3, align = "center")
+		if x_title:
+			self.draw_text(x_title, (left + right) // 2, bottom + x_label_offset + 28, color = axis_color, scale = 3, align = "center")
+		if y_title:
+			self.draw_text(y_title, 8, (top + bottom) // 2, color = axis_color, scale = 3, align = "center", vertical = True)
+
+	def to_image(self):
+		return np.clip(np.rint(self.image), 0, 255).astype(np.uint8)
+
+	def save(self, filename):
+		write_png(filename, self.to_image())
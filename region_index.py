@@ -0,0 +1,305 @@
+#! /usr/bin/env python3
+
+import sys
+import os
+import gzip
+import zlib
+import struct
+import json
+import argparse
+
+INDEX_SUFFIX = ".dpi"
+INDEX_VERSION = 1
+DEFAULT_BIN_SHIFT = 20
+
+
+def compression_type(filename):
+	with open(filename, "rb") as f:
+		header = f.read(18)
+	if header[:2] != b"\x1f\x8b":
+		return "none"
+	# BGZF is gzip with an FEXTRA "BC" subfield holding the block size
+	if len(header) >= 18 and header[3] & 4 and header[12:14] == b"BC":
+		return "bgzf"
+	return "gzip"
+
+
+class bgzf_reader():
+	# Minimal BGZF reader. Offsets are htslib virtual offsets: compressed block start << 16 | offset
+	# inside the uncompressed block.
+	def __init__(self, filename):
+		self.f = open(filename, "rb")
+		self.block = b""
+		self.block_offset = 0
+		self.next_block_offset = 0
+		self.within = 0
+		self._load(0)
+
+	def close(self):
+		self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _load(self, offset):
+		self.f.seek(offset)
+		self.block_offset = offset
+		self.within = 0
+		header = self.f.read(12)
+		if len(header) < 12:
+			self.block = b""
+			self.next_block_offset = offset
+			return
+		if header[:4] != b"\x1f\x8b\x08\x04":
+			raise ValueError(f"not a BGZF block at offset {offset}")
+		xlen = struct.unpack("<H", header[10:12])[0]
+		extra = self.f.read(xlen)
+		bsize = None
+		pos = 0
+		while pos + 4 <= xlen:
+			si1, si2, slen = extra[pos], extra[pos + 1], struct.unpack("<H", extra[pos + 2:pos + 4])[0]
+			if si1 == 66 and si2 == 67:
+				bsize = struct.unpack("<H", extra[pos + 4:pos + 6])[0]
+			pos += 4 + slen
+		if bsize is None:
+			raise ValueError(f"BGZF block at offset {offset} has no BC subfield")
+		cdata = self.f.read(bsize - xlen - 19)
+		self.f.read(8)
+		self.block = zlib.decompress(cdata, -15)
+		self.next_block_offset = offset + bsize + 1
+
+	def seek(self, voffset):
+		block_offset, within = voffset >> 16, voffset & 0xFFFF
+		if block_offset != self.block_offset or not self.block:
+			self._load(block_offset)
+		self.within = within
+
+	def tell(self):
+		if self.within >= len(self.block) and self.block:
+			return self.next_block_offset << 16
+		return (self.block_offset << 16) | self.within
+
+	def readline(self):
+		parts = []
+		while True:
+			if self.within >= len(self.block):
+				if self.next_block_offset == self.block_offset:
+					break
+				self._load(self.next_block_offset)
+				continue
+			newline = self.block.find(b"\n", self.within)
+			if newline == -1:
+				parts.append(self.block[self.within:])
+				self.within = len(self.block)
+			else:
+				parts.append(self.block[self.within:newline + 1])
+				self.within = newline + 1
+				break
+		return b"".join(parts)
+
+
+def iter_offset_lines(filename):
+	# yields (offset, line) with the (virtual) offset of the start of each line
+	compression = compression_type(filename)
+	if compression == "gzip":
+		raise ValueError(f"{filename} is gzip but not BGZF compressed and cannot be indexed (recompress it with bgzip)")
+	if compression == "bgzf":
+		with bgzf_reader(filename) as f:
+			while True:
+				offset = f.tell()
+				line = f.readline()
+				if not line:
+					break
+				yield offset, line.decode()
+	else:
+		with open(filename, "rb") as f:
+			offset = 0
+			for line in f:
+				yield offset, line.decode()
+				offset += len(line)
+
+
+def iter_lines(filename, ranges = None):
+	# yields text lines of a plain, gzip or BGZF file, optionally only those starting inside
+	# the given [start, end) (virtual) offset ranges
+	compression = compression_type(filename)
+	if ranges is None:
+		opener = open if compression == "none" else gzip.open
+		with opener(filename, "rt") as f:
+			yield from f
+	elif compression == "bgzf":
+		with bgzf_reader(filename) as f:
+			for start, end in ranges:
+				f.seek(start)
+				while f.tell() < end:
+					line = f.readline()
+					if not line:
+						break
+					yield line.decode()
+	elif compression == "none":
+		with open(filename, "rb") as f:
+			for start, end in ranges:
+				f.seek(start)
+				offset = start
+				while offset < end:
+					line = f.readline()
+					if not line:
+						break
+					offset += len(line)
+					yield line.decode()
+	else:
+		raise ValueError(f"{filename} is gzip but not BGZF compressed and cannot be read by offset")
+
+
+PAF_COLUMNS = 12
+CHAIN_HEADER_COLUMNS = 12
+
+
+def paf_records(filename):
+	# (offset, target, query, target_start, target_end, query_start, query_end) per PAF line; None
+	# for lines with fewer than PAF_COLUMNS columns or non-numeric coordinates
+	for offset, line in iter_offset_lines(filename):
+		cols = line.rstrip("\n").split("\t", PAF_COLUMNS)
+		if cols == [""]:
+			continue
+		if len(cols) < PAF_COLUMNS:
+			yield None
+			continue
+		try:
+			yield offset, cols[5], cols[0], int(cols[7]), int(cols[8]), int(cols[2]), int(cols[3])
+		except ValueError:
+			yield None
+
+
+def chain_records(filename):
+	# one record per chain: header plus its block lines; None for malformed headers
+	for offset, line in iter_offset_lines(filename):
+		if line.startswith("chain"):
+			cols = line.split()
+			if len(cols) < CHAIN_HEADER_COLUMNS:
+				yield None
+				continue
+			try:
+				yield offset, cols[2], cols[7], int(cols[5]), int(cols[6]), int(cols[10]), int(cols[11])
+			except ValueError:
+				yield None
+
+
+def build_index(filename, file_format, bin_shift = DEFAULT_BIN_SHIFT):
+	records = paf_records(filename) if file_format == "paf" else chain_records(filename)
+	pairs = {}
+	# runs of consecutive records of one chromosome pair become one offset range
+	current_key = None
+	current = None
+	skipped = 0
+	for record in records:
+		# malformed records are left in the ranges for the parser to skip
+		if record is None:
+			skipped += 1
+			continue
+		offset, target, query, target_start, target_end, query_start, query_end = record
+		key = f"{target}\t{query}"
+		if current is not None:
+			current[5] = offset
+		target_bins = (target_start >> bin_shift, max(target_start, target_end - 1) >> bin_shift)
+		query_bins = (query_start >> bin_shift, max(query_start, query_end - 1) >> bin_shift)
+		if key == current_key and target_bins[0] - current[1] <= 1:
+			current[0] = min(current[0], target_bins[0])
+			current[1] = max(current[1], target_bins[1])
+			current[2] = min(current[2], query_bins[0])
+			current[3] = max(current[3], query_bins[1])
+		else:
+			current_key = key
+			current = [target_bins[0], target_bins[1], query_bins[0], query_bins[1], offset, offset]
+			pairs.setdefault(key, []).append(current)
+	if skipped:
+		print(f"{filename}: skipped {skipped} malformed {'PAF' if file_format == 'paf' else 'chain'} lines", file = sys.stderr)
+	stat = os.stat(filename)
+	if current is not None:
+		# past the last record; virtual offsets shift the compressed size
+		current[5] = stat.st_size << 16 if compression_type(filename) == "bgzf" else stat.st_size
+	return {
+		"version": INDEX_VERSION,
+		"format": file_format,
+		"size": stat.st_size,
+		"mtime": stat.st_mtime,
+		"bin_shift": bin_shift,
+		"pairs": pairs
+	}
+
+
+def index_is_valid(index, filename, file_format):
+	stat = os.stat(filename)
+	return index.get("version") == INDEX_VERSION and index.get("format") == file_format and index.get("size") == stat.st_size and index.get("mtime") == stat.st_mtime
+
+
+def load_or_build_index(filename, file_format, bin_shift = DEFAULT_BIN_SHIFT):
+	index_file_name = filename + INDEX_SUFFIX
+	try:
+		with open(index_file_name, "r") as f:
+			index = json.load(f)
+		if index_is_valid(index, filename, file_format):
+			return index
+	except (OSError, ValueError):
+		pass
+	index = build_index(filename, file_format, bin_shift = bin_shift)
+	try:
+		with open(index_file_name, "w") as f:
+			json.dump(index, f)
+	except OSError:
+		print(f"cannot write index {index_file_name}, using it in memory only", file = sys.stderr)
+	return index
+
+
+def ranges_for(filename, file_format, target_filter = None, query_filter = None, target_region = None, query_region = None):
+	# offset ranges to read for the selection, or None when the file cannot be indexed (plain gzip)
+	if compression_type(filename) == "gzip":
+		print(f"{filename} is not BGZF compressed, reading the whole file", file = sys.stderr)
+		return None
+	index = load_or_build_index(filename, file_format)
+	return lookup(index, target_filter, query_filter, target_region, query_region)
+
+
+def lookup(index, target_filter = None, query_filter = None, target_region = None, query_region = None):
+	# (virtual) offset ranges holding every record of the matching chromosome pairs whose coarse
+	# bins overlap the [start, end) regions, sorted and merged
+	bin_shift = index["bin_shift"]
+	ranges = []
+	for key, entries in index["pairs"].items():
+		target, query = key.split("\t")
+		if target_filter is not None and not target_filter(target):
+			continue
+		if query_filter is not None and not query_filter(query):
+			continue
+		for target_bin_start, target_bin_end, query_bin_start, query_bin_end, start, end in entries:
+			if target_region is not None and (target_bin_end < target_region[0] >> bin_shift or target_bin_start > max(target_region[0], target_region[1] - 1) >> bin_shift):
+				continue
+			if query_region is not None and (query_bin_end < query_region[0] >> bin_shift or query_bin_start > max(query_region[0], query_region[1] - 1) >> bin_shift):
+				continue
+			ranges.append((start, end))
+	ranges.sort()
+	merged = []
+	for start, end in ranges:
+		if merged and start <= merged[-1][1]:
+			merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+		else:
+			merged.append((start, end))
+	return merged
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Build the region index (.dpi sidecar) that dotplot.py --index uses to seek into PAF and chain files. Plain text and BGZF (bgzip) inputs are supported.')
+	parser.add_argument("filename", metavar='file', type=str, nargs='+', help='PAF or chain file(s)')
+	parser.add_argument("--chain", action='store_true', help='inputs are chain files (PAF as default)')
+	parser.add_argument("--bin_shift", metavar='bits', type=int, default = DEFAULT_BIN_SHIFT, help=f'coordinate bin size as a power of two ({DEFAULT_BIN_SHIFT} as default)')
+	args = parser.parse_args()
+	for each_filename in args.filename:
+		index = load_or_build_index(each_filename, "chain" if args.chain else "paf", bin_shift = args.bin_shift)
+		print(f"{each_filename}: {len(index['pairs'])} chromosome pairs, {sum(len(x) for x in index['pairs'].values())} ranges", file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()
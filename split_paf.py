@@ -1,24 +1,99 @@
 #! /usr/bin/env python3
 
 import sys
+import os
 import argparse
-import pprint
-import dotplot
-import copy
 import re
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-import plotly.io as pio
+import region_index
 
-pp = pprint.PrettyPrinter(indent=2)
+WRITE_BUFFER_RECORDS = 1 << 14
+# tags still true for every piece (the transcript strand); the others (scores, edit distance,
+# divergence, chaining, type, ...) describe the whole alignment and are dropped, and cg:Z is
+# recomputed per piece
+KEPT_TAGS = {"ts"}
 
-def parse_cigar(cigar):
-	currentPos = 0
-	
 
-def split_paf(paf):
-	altpaf = []
+def parse_cigar(cigar):
+	return [(int(length), op) for length, op in re.findall(r'([0-9]+)([MIDNSHPX=])', cigar)]
+
+
+def split_paf(paf, threshold = 10):
+	# Split one PAF record (list of columns) at insertions/deletions longer than threshold. Returns
+	# the columns of every sub-alignment with its own coordinates, CIGAR and match count; records
+	# without a cg:Z tag or without such an indel are returned unchanged.
+	cigar = None
+	tags = []
+	for tag in paf[12:]:
+		if tag.startswith("cg:Z:"):
+			cigar = tag[5:]
+		elif tag[:2] in KEPT_TAGS:
+			tags.append(tag)
+	if cigar is None:
+		return [paf]
+	ops = parse_cigar(cigar)
+	if not any(op in "ID" and length > threshold for length, op in ops):
+		return [paf]
+	rev = paf[4] == "-"
+	query_start, query_end = int(paf[2]), int(paf[3])
+	ref_pos = int(paf[7])
+	query_done = 0
+	# "=" ops are exact matches; the matches of column 10 left over are spread over the "M" ops
+	eq_total = sum(length for length, op in ops if op == "=")
+	m_total = sum(length for length, op in ops if op == "M")
+	match_ratio = min(max(int(paf[9]) - eq_total, 0) / m_total, 1.0) if m_total else 0.0
+
+	pieces = []
+	piece_ops = []
+	piece_ref_start = ref_pos
+	piece_query_start = query_done
+	def close_piece():
+		if any(op in "M=X" for _, op in piece_ops):
+			matches = sum(length for length, op in piece_ops if op == "=") + round(sum(length for length, op in piece_ops if op == "M") * match_ratio)
+			block_length = sum(length for length, _ in piece_ops)
+			# on the reverse strand the CIGAR walks the query from its end
+			if rev:
+				start, end = query_end - query_done, query_end - piece_query_start
+			else:
+				start, end = query_start + piece_query_start, query_start + query_done
+			cigar_text = "".join(f"{length}{op}" for length, op in piece_ops)
+			pieces.append(paf[:2] + [str(start), str(end), paf[4], paf[5], paf[6], str(piece_ref_start), str(ref_pos), str(matches), str(block_length), paf[11]] + tags + [f"cg:Z:{cigar_text}"])
+
+	for length, op in ops:
+		if op in "ID" and length > threshold:
+			close_piece()
+			if op == "D":
+				ref_pos += length
+			else:
+				query_done += length
+			piece_ops = []
+			piece_ref_start = ref_pos
+			piece_query_start = query_done
+			continue
+		if piece_ops and piece_ops[-1][1] == op:
+			piece_ops[-1] = (piece_ops[-1][0] + length, op)
+		else:
+			piece_ops.append((length, op))
+		if op in "MDN=X":
+			ref_pos += length
+		if op in "MI=X":
+			query_done += length
+	close_piece()
+	return pieces
+
+
+def split_paf_file(paf_file_name, out, threshold = 10):
+	# streams the PAF (plain or gzip) and writes the split records in batches
+	buffer = []
+	for line in region_index.iter_lines(paf_file_name):
+		paf = line.rstrip("\n").split("\t")
+		if len(paf) < 12:
+			continue
+		buffer.extend("\t".join(piece) for piece in split_paf(paf, threshold))
+		if len(buffer) >= WRITE_BUFFER_RECORDS:
+			out.write("\n".join(buffer) + "\n")
+			buffer = []
+	if buffer:
+		out.write("\n".join(buffer) + "\n")
 
 
 
@@ -26,30 +101,22 @@ def main():
 	parser = argparse.ArgumentParser(description='Split input paf file at large indel')
 	parser.add_argument("PAFfilename", metavar='PAF', type=str, help='input PAF file name')
 	parser.add_argument("-t", metavar='t', type=int, default = 10, help='Threshold of indel (10 as default). An alignmet will be split at indels greater than this threshold')
-	parser.add_argument("-o", metavar='o', type=str, help='output file name (xxx_split.paf as default for xxx.paf)')
+	parser.add_argument("-o", metavar='o', type=str, help='output file name (xxx_split.paf as default for xxx.paf, - for stdout)')
 
 	args = parser.parse_args()
 	paf_file_name = args.PAFfilename
 	threshold = args.t
+	out_file_name = args.o
+	if out_file_name is None:
+		root = paf_file_name[:-3] if paf_file_name.endswith(".gz") else paf_file_name
+		root, ext = os.path.splitext(root)
+		out_file_name = f"{root}_split{ext or '.paf'}"
 
-	raw_paf = dotplot.minimap2_paf_parser(paf_file_name)
-	main_line_scatter = []
-	x_points = []
-	y_points = []
-	for alignment in raw_paf:
-		largeindel = [x for x in dotplot.parse_cigar(alignment.cigar) if x[-1] in ["D", "I"] and int(x[:-1]) > 50]
-		print(largeindel) if len(largeindel) > 0 else None
-		points = dotplot.cut_alignment_at_large_indel(alignment)
-		for i in range(len(points)):
-			x_points.append(points[i][0])
-			y_points.append(points[i][1])
-	#print(x_points)
-	#print(y_points)
-	fig = go.Figure()
-	fig.add_trace(go.Scattergl(x = x_points, y = y_points, mode='lines+markers'))
-	fig.update_yaxes(autorange="reversed")
-
-	#fig.show()
+	if out_file_name == "-":
+		split_paf_file(paf_file_name, sys.stdout, threshold)
+	else:
+		with open(out_file_name, "w") as out:
+			split_paf_file(paf_file_name, out, threshold)
 
 
 
@@ -57,4 +124,4 @@ def main():
 
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
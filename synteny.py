@@ -0,0 +1,356 @@
+#! /usr/bin/env python3
+
+import sys
+import os
+import argparse
+import numpy as np
+import plotly.graph_objects as go
+import dotplot
+
+DEFAULT_MAX_GAP = 100000
+DEFAULT_OVERLAP = 1000
+DEFAULT_MIN_TRANSLOCATION = 10000
+# blocks within this many bp of a query sequence end are taken to end at it
+CONTIG_END_DISTANCE = 1000
+INVERSION = 1
+TRANSLOCATION = 2
+FLAG_NAMES = {INVERSION: "inversion", TRANSLOCATION: "translocation"}
+
+
+class max_tree():
+	# Segment tree over a fixed set of leaves (a sorted array) answering the maximum score and its
+	# anchor over a leaf range; leaves can be set and cleared, each in O(log n).
+	def __init__(self, leaf_count):
+		self.size = 1 << max(leaf_count - 1, 0).bit_length()
+		self.score = [-1] * (2 * self.size)
+		self.anchor = [-1] * (2 * self.size)
+
+	def set(self, leaf, score, anchor):
+		node = leaf + self.size
+		self.score[node] = score
+		self.anchor[node] = anchor
+		node >>= 1
+		while node:
+			left, right = 2 * node, 2 * node + 1
+			best = left if self.score[left] >= self.score[right] else right
+			self.score[node] = self.score[best]
+			self.anchor[node] = self.anchor[best]
+			node >>= 1
+
+	def max(self, low, high):
+		# (score, anchor) of the best leaf in [low, high), (-1, -1) when empty
+		best_score, best_anchor = -1, -1
+		low += self.size
+		high += self.size
+		while low < high:
+			if low & 1:
+				if self.score[low] > best_score:
+					best_score, best_anchor = self.score[low], self.anchor[low]
+				low += 1
+			if high & 1:
+				high -= 1
+				if self.score[high] > best_score:
+					best_score, best_anchor = self.score[high], self.anchor[high]
+			low >>= 1
+			high >>= 1
+		return best_score, best_anchor
+
+
+def chain_anchors(ref_start, ref_end, query_start, query_end, max_gap = DEFAULT_MAX_GAP, overlap = DEFAULT_OVERLAP):
+	# Sparse DP over co-linear anchors of one chromosome pair and strand (query coordinates already
+	# increasing with the reference). Anchor j can precede i if it ends before i starts, up to
+	# overlap bp, on both genomes, with gaps of at most max_gap. Anchors are visited in reference
+	# start order; the ones that end early enough are added to a max_tree keyed by query end and
+	# removed again once they are more than max_gap behind, so the best predecessor is one range
+	# maximum over the query ends in [query_start - max_gap, query_start + overlap]. O(n log n).
+	# Returns the chain score and predecessor (-1 for none) of every anchor.
+	n = len(ref_start)
+	weight = np.minimum(ref_end - ref_start, query_end - query_start).tolist()
+	leaf_order = np.lexsort((np.arange(n), query_end))
+	leaf = np.empty(n, dtype = np.int64)
+	leaf[leaf_order] = np.arange(n)
+	sorted_query_end = query_end[leaf_order]
+	low_leaf = np.searchsorted(sorted_query_end, query_start - max_gap, side = "left").tolist()
+	high_leaf = np.searchsorted(sorted_query_end, query_start + overlap, side = "right").tolist()
+	leaf = leaf.tolist()
+	by_start = np.argsort(ref_start, kind = "stable").tolist()
+	by_end = np.argsort(ref_end, kind = "stable").tolist()
+	ref_start_list, ref_end_list = ref_start.tolist(), ref_end.tolist()
+	tree = max_tree(n)
+	score = [0] * n
+	pred = [-1] * n
+	added = [False] * n
+	done = [False] * n
+	# due[j]: j ends early enough to precede the current anchor but has no score yet
+	due = [False] * n
+	add_next = 0
+	remove_next = 0
+	for i in by_start:
+		start = ref_start_list[i]
+		while add_next < n and ref_end_list[by_end[add_next]] <= start + overlap:
+			j = by_end[add_next]
+			if not done[j]:
+				due[j] = True
+			else:
+				tree.set(leaf[j], score[j], j)
+				added[j] = True
+			add_next += 1
+		while remove_next < add_next and ref_end_list[by_end[remove_next]] < start - max_gap:
+			j = by_end[remove_next]
+			if added[j]:
+				tree.set(leaf[j], -1, -1)
+				added[j] = False
+			remove_next += 1
+		best_score, best_anchor = tree.max(low_leaf[i], high_leaf[i])
+		if best_anchor >= 0 and best_score > 0:
+			score[i] = best_score + weight[i]
+			pred[i] = best_anchor
+		else:
+			score[i] = weight[i]
+		done[i] = True
+		if due[i]:
+			tree.set(leaf[i], score[i], i)
+			added[i] = True
+	return np.array(score, dtype = np.int64), np.array(pred, dtype = np.int64)
+
+
+def block_ids(score, pred):
+	# Anchors grouped into blocks: starting from the best chain end, follow predecessors until an
+	# anchor already taken, like the greedy chain extraction of minimap2.
+	block = np.full(len(score), -1, dtype = np.int64)
+	pred = pred.tolist()
+	count = 0
+	for i in np.argsort(-score, kind = "stable").tolist():
+		if block[i] >= 0:
+			continue
+		j = i
+		while j >= 0 and block[j] < 0:
+			block[j] = count
+			j = pred[j]
+		count += 1
+	return block, count
+
+
+class synteny_blocks():
+	# Columnar synteny blocks: one row per chain of co-linear same-strand alignments, with the
+	# number of alignments (anchors), their aligned bases and flags (INVERSION | TRANSLOCATION).
+	def __init__(self, chrom_names, ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, anchors, aligned, flags):
+		self.chrom_names = chrom_names
+		self.ref_chrom = ref_chrom
+		self.ref_start = ref_start
+		self.ref_end = ref_end
+		self.query_chrom = query_chrom
+		self.query_start = query_start
+		self.query_end = query_end
+		self.rev = rev
+		self.anchors = anchors
+		self.aligned = aligned
+		self.flags = flags
+
+	def __len__(self):
+		return len(self.ref_start)
+
+	def __str__(self):
+		return f"synteny_blocks: {len(self)} blocks, {int(np.count_nonzero(self.flags & INVERSION))} inversions, {int(np.count_nonzero(self.flags & TRANSLOCATION))} translocations"
+
+	def take(self, key):
+		return synteny_blocks(self.chrom_names, *[getattr(self, column)[key] for column in ["ref_chrom", "ref_start", "ref_end", "query_chrom", "query_start", "query_end", "rev", "anchors", "aligned", "flags"]])
+
+	def flag_names(self):
+		return [",".join(name for flag, name in FLAG_NAMES.items() if value & flag) or "." for value in self.flags.tolist()]
+
+
+def dominant_by_key(keys, values, weights):
+	# for every key, the value with the largest summed weight
+	pairs, inverse = np.unique(np.column_stack([keys, values]), axis = 0, return_inverse = True)
+	total = np.bincount(inverse.ravel(), weights = weights)
+	order = np.lexsort((-total, pairs[:, 0]))
+	first = np.concatenate(([True], pairs[order[1:], 0] != pairs[order[:-1], 0])) if len(order) else np.zeros(0, dtype = bool)
+	return dict(zip(pairs[order[first], 0].tolist(), pairs[order[first], 1].tolist()))
+
+
+def translocation_flags(blocks, query_lengths, min_translocation = DEFAULT_MIN_TRANSLOCATION):
+	# TRANSLOCATION for the blocks (sorted by reference position) of runs of one query chromosome
+	# that sit inside another query chromosome: the runs before and after it on the reference
+	# chromosome are of one other query chromosome, the run is not of the dominant query
+	# chromosome (by aligned bases) of the reference chromosome, it does not reach within
+	# CONTIG_END_DISTANCE of either end of its query sequence and has at least min_translocation
+	# aligned bases. Contigs of a fragmented assembly tile the reference one after another and end
+	# at their sequence ends, so their junctions are not flagged.
+	if len(blocks) == 0:
+		return np.zeros(0, dtype = np.int64)
+	new_run = np.concatenate(([True], (blocks.ref_chrom[1:] != blocks.ref_chrom[:-1]) | (blocks.query_chrom[1:] != blocks.query_chrom[:-1])))
+	run_first = np.flatnonzero(new_run)
+	run = np.cumsum(new_run) - 1
+	run_ref = blocks.ref_chrom[run_first]
+	run_query = blocks.query_chrom[run_first]
+	run_aligned = np.add.reduceat(blocks.aligned, run_first)
+	run_query_start = np.minimum.reduceat(blocks.query_start, run_first)
+	run_query_end = np.maximum.reduceat(blocks.query_end, run_first)
+	same_ref = run_ref[1:] == run_ref[:-1]
+	flanked = np.zeros(len(run_first), dtype = bool)
+	flanked[1:-1] = same_ref[:-1] & same_ref[1:] & (run_query[:-2] == run_query[2:])
+	length = np.asarray(query_lengths, dtype = np.int64)[run_query]
+	# unknown (0) query lengths only check the start
+	inner = (run_query_start > CONTIG_END_DISTANCE) & ((length == 0) | (run_query_end < length - CONTIG_END_DISTANCE))
+	main_query = dominant_by_key(blocks.ref_chrom.astype(np.int64), blocks.query_chrom.astype(np.int64), blocks.aligned)
+	minor = run_query != np.array([main_query[key] for key in run_ref.tolist()], dtype = np.int64)
+	translocated = flanked & inner & minor & (run_aligned >= min_translocation)
+	return np.where(translocated[run], TRANSLOCATION, 0)
+
+
+def synteny_chain(table, max_gap = DEFAULT_MAX_GAP, overlap = DEFAULT_OVERLAP, min_size = 0, min_translocation = DEFAULT_MIN_TRANSLOCATION):
+	# Chain the alignments of an alignment_table into synteny blocks, per reference chromosome,
+	# query chromosome and strand ("-" alignments are chained on negated query coordinates). Blocks
+	# shorter than min_size bp on the reference are dropped. A block is an inversion when its
+	# strand is not the dominant one (by aligned bases) of its chromosome pair; translocations are
+	# flagged by translocation_flags.
+	rev = table.rev.astype(bool)
+	group_keys = np.column_stack([table.ref_chrom, table.query_chrom, rev]).astype(np.int64)
+	groups, group = np.unique(group_keys, axis = 0, return_inverse = True)
+	group = group.ravel()
+	order = np.argsort(group, kind = "stable")
+	group_first = np.searchsorted(group[order], np.arange(len(groups) + 1))
+	block = np.full(len(table), -1, dtype = np.int64)
+	block_count = 0
+	for g in range(len(groups)):
+		rows = order[group_first[g]:group_first[g + 1]]
+		query_start, query_end = table.query_start[rows], table.query_end[rows]
+		if groups[g, 2]:
+			query_start, query_end = -query_end, -query_start
+		score, pred = chain_anchors(table.ref_start[rows], table.ref_end[rows], query_start, query_end, max_gap, overlap)
+		ids, count = block_ids(score, pred)
+		block[rows] = ids + block_count
+		block_count += count
+	anchor_order = np.argsort(block, kind = "stable")
+	first = np.searchsorted(block[anchor_order], np.arange(block_count))
+	sorted_rows = anchor_order
+	reduce = lambda ufunc, column: ufunc.reduceat(column[sorted_rows], first) if block_count else np.zeros(0, dtype = np.int64)
+	weight = np.minimum(table.ref_end - table.ref_start, table.query_end - table.query_start)
+	head = sorted_rows[first] if block_count else np.zeros(0, dtype = np.int64)
+	blocks = synteny_blocks(
+		table.chrom_names,
+		table.ref_chrom[head], reduce(np.minimum, table.ref_start), reduce(np.maximum, table.ref_end),
+		table.query_chrom[head], reduce(np.minimum, table.query_start), reduce(np.maximum, table.query_end),
+		rev[head], np.bincount(block, minlength = block_count) if block_count else np.zeros(0, dtype = np.int64),
+		reduce(np.add, weight), np.zeros(block_count, dtype = np.int64))
+	blocks = blocks.take(blocks.ref_end - blocks.ref_start >= min_size)
+	blocks = blocks.take(np.lexsort((blocks.ref_start, blocks.ref_chrom)))
+	if len(blocks):
+		pair = blocks.ref_chrom.astype(np.int64) * len(table.chrom_names) + blocks.query_chrom
+		strand = dominant_by_key(pair, blocks.rev.astype(np.int64), blocks.aligned)
+		blocks.flags = np.where(blocks.rev.astype(np.int64) != np.array([strand[key] for key in pair.tolist()], dtype = np.int64), INVERSION, 0)
+		blocks.flags |= translocation_flags(blocks, table.query_lengths, min_translocation)
+	return blocks
+
+
+def breakpoints(blocks):
+	# Breakpoints between neighbouring blocks (in reference order) of a reference chromosome next
+	# to a flagged block: "translocation" where the query chromosome changes and one of the two is
+	# a translocation, "inversion" where only the strand changes and one of the two is an
+	# inversion. Reference chromosome code, the reference interval between the blocks, and the kind.
+	same_chrom = blocks.ref_chrom[1:] == blocks.ref_chrom[:-1]
+	either = blocks.flags[1:] | blocks.flags[:-1]
+	translocation = same_chrom & (blocks.query_chrom[1:] != blocks.query_chrom[:-1]) & (either & TRANSLOCATION > 0)
+	inversion = same_chrom & (blocks.query_chrom[1:] == blocks.query_chrom[:-1]) & (blocks.rev[1:] != blocks.rev[:-1]) & (either & INVERSION > 0)
+	left = np.flatnonzero(translocation | inversion)
+	start = np.minimum(blocks.ref_end[left], blocks.ref_start[left + 1])
+	end = np.maximum(blocks.ref_end[left], blocks.ref_start[left + 1])
+	kind = np.where(translocation[left], "translocation", "inversion")
+	return blocks.ref_chrom[left], start, end, kind
+
+
+def genome_blocks(blocks, ref_layout, query_layout):
+	# blocks moved to the concatenated coordinates of dotplot.genome_table; blocks on chromosomes
+	# missing from a layout are dropped
+	ref_shift = dotplot.layout_offsets(ref_layout, blocks.chrom_names)[blocks.ref_chrom]
+	query_shift = dotplot.layout_offsets(query_layout, blocks.chrom_names)[blocks.query_chrom]
+	keep = (ref_shift >= 0) & (query_shift >= 0)
+	blocks, ref_shift, query_shift = blocks.take(keep), ref_shift[keep], query_shift[keep]
+	blocks.ref_start, blocks.ref_end = blocks.ref_start + ref_shift, blocks.ref_end + ref_shift
+	blocks.query_start, blocks.query_end = blocks.query_start + query_shift, blocks.query_end + query_shift
+	return blocks
+
+
+SYNTENY_COLORS = {0: "#1f77b4", INVERSION: "#d62728", TRANSLOCATION: "#2ca02c", INVERSION | TRANSLOCATION: "#9467bd"}
+
+
+def synteny_traces(blocks):
+	# Plot layer for draw_dotplot: one line per block from its start to its end (falling for "-"
+	# blocks), one trace per flag combination
+	traces = []
+	for flag, color in SYNTENY_COLORS.items():
+		selected = blocks.take(blocks.flags == flag)
+		if len(selected) == 0:
+			continue
+		separator = np.full(len(selected), np.nan)
+		x = np.column_stack([np.where(selected.rev, selected.query_end, selected.query_start), np.where(selected.rev, selected.query_start, selected.query_end), separator]).ravel()
+		y = np.column_stack([selected.ref_start, selected.ref_end, separator]).ravel()
+		text = [label for anchors, aligned in zip(selected.anchors.tolist(), selected.aligned.tolist()) for label in (f"{anchors} alignments, {aligned} bp", f"{anchors} alignments, {aligned} bp", "")]
+		traces.append(go.Scattergl(x = x, y = y, text = text, mode = "lines", line = dict(width = 3, color = color), name = "synteny" if flag == 0 else " + ".join(name for bit, name in FLAG_NAMES.items() if flag & bit)))
+	return traces
+
+
+def write_tsv(blocks, out):
+	out.write("#ref_chrom\tref_start\tref_end\tquery_chrom\tquery_start\tquery_end\tstrand\talignments\taligned_bp\tflags\n")
+	names = blocks.chrom_names
+	out.write("".join(f"{names[ref_chrom]}\t{ref_start}\t{ref_end}\t{names[query_chrom]}\t{query_start}\t{query_end}\t{'-' if rev else '+'}\t{anchors}\t{aligned}\t{flag}\n"
+		for ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, anchors, aligned, flag in zip(
+			blocks.ref_chrom.tolist(), blocks.ref_start.tolist(), blocks.ref_end.tolist(), blocks.query_chrom.tolist(), blocks.query_start.tolist(), blocks.query_end.tolist(),
+			blocks.rev.tolist(), blocks.anchors.tolist(), blocks.aligned.tolist(), blocks.flag_names())))
+
+
+def write_bed(blocks, out):
+	# reference intervals, named query_chrom:start-end(flags)
+	names = blocks.chrom_names
+	out.write("".join(f"{names[ref_chrom]}\t{ref_start}\t{ref_end}\t{names[query_chrom]}:{query_start}-{query_end}({flag})\t{min(anchors, 1000)}\t{'-' if rev else '+'}\n"
+		for ref_chrom, ref_start, ref_end, query_chrom, query_start, query_end, rev, anchors, flag in zip(
+			blocks.ref_chrom.tolist(), blocks.ref_start.tolist(), blocks.ref_end.tolist(), blocks.query_chrom.tolist(), blocks.query_start.tolist(), blocks.query_end.tolist(),
+			blocks.rev.tolist(), blocks.anchors.tolist(), blocks.flag_names())))
+
+
+def write_breakpoints(blocks, out):
+	chrom, start, end, kind = breakpoints(blocks)
+	out.write("".join(f"{blocks.chrom_names[code]}\t{s}\t{e}\t{k}\n" for code, s, e, k in zip(chrom.tolist(), start.tolist(), end.tolist(), kind.tolist())))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Chain co-linear alignments of PAF/chain files into synteny blocks and flag inversions and translocations.')
+	parser.add_argument("PAFfilename", metavar='PAF', type=str, nargs='*', help='PAF file(s)')
+	parser.add_argument("--chain", metavar='chain', type=str, help='chain file')
+	parser.add_argument("--sf", action='store_true', help='switch ref/query in the chain file')
+	parser.add_argument("-o", metavar='FileName', type=str, help='TSV of the blocks (stdout as default)')
+	parser.add_argument("--bed", metavar='FileName', type=str, help='also write the blocks as BED on the reference')
+	parser.add_argument("--breakpoints", metavar='FileName', type=str, help='write the inversion and translocation breakpoints as BED on the reference')
+	parser.add_argument("--max_gap", metavar='bp', type=int, default = DEFAULT_MAX_GAP, help=f'largest gap between chained alignments on either genome ({DEFAULT_MAX_GAP} as default)')
+	parser.add_argument("--overlap", metavar='bp', type=int, default = DEFAULT_OVERLAP, help=f'largest overlap between chained alignments ({DEFAULT_OVERLAP} as default)')
+	parser.add_argument("--min_size", metavar='bp', type=int, default = 0, help='drop blocks shorter than this on the reference (0 as default)')
+	parser.add_argument("--min_translocation", metavar='bp', type=int, default = DEFAULT_MIN_TRANSLOCATION, help=f'fewest aligned bases of a translocation ({DEFAULT_MIN_TRANSLOCATION} as default)')
+	parser.add_argument("--threads", metavar='N', type=int, default = os.cpu_count(), help='worker processes for reading PAF files (number of CPUs as default)')
+	parser.add_argument("--no-cache", dest='no_cache', action='store_true', help='do not read or write the parse cache')
+	args = parser.parse_args()
+	use_cache = not args.no_cache
+	tables = dotplot.load_paf_files(args.PAFfilename, use_cache = use_cache, threads = args.threads) if args.PAFfilename else []
+	if args.chain is not None:
+		tables.append(dotplot.load_chain(args.chain, switchflag = args.sf, use_cache = use_cache))
+	if not tables:
+		parser.error("give PAF file(s) and/or --chain")
+	table = tables[0] if len(tables) == 1 else dotplot.alignment_table.concatenate(tables)
+	blocks = synteny_chain(table, max_gap = args.max_gap, overlap = args.overlap, min_size = args.min_size, min_translocation = args.min_translocation)
+	print(f"{len(table)} alignments -> {blocks}", file = sys.stderr)
+	out = sys.stdout if args.o is None else open(args.o, "w")
+	try:
+		write_tsv(blocks, out)
+	finally:
+		if out is not sys.stdout:
+			out.close()
+	if args.bed is not None:
+		with open(args.bed, "w") as f:
+			write_bed(blocks, f)
+	if args.breakpoints is not None:
+		with open(args.breakpoints, "w") as f:
+			write_breakpoints(blocks, f)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,106 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import dotplot
+
+
+def alignments():
+	builder = dotplot.alignment_table_builder(dsc = "test.paf")
+	builder.append("chr1", 0, 1000, "chr1", 0, 1000, False, "1000M", ref_length = 5000, query_length = 5000)
+	return builder.build()
+
+
+def genes(ref_or_query):
+	builder = dotplot.annotation_table_builder(ref_or_query)
+	builder.append("chr1", 100, 400, "geneA", "gene")
+	builder.append("chr1", 300, 900, "geneB", "gene")
+	builder.append("chr2", 100, 400, "other", "gene")
+	return builder.build()
+
+
+def test_reference_annotation_track_is_drawn():
+	const = {"GRCh38_chromosome_length": {"chr1": 5000}}
+	fig = dotplot.draw_dotplot([alignments()], "chr1", const, reference_annotation = genes(dotplot.ref_or_query.R))
+	tracks = [trace for trace in fig.data if trace.meta == "reference_annotation"]
+	assert len(tracks) == 1
+	assert tracks[0].xaxis == "x2"
+	assert "geneA" in tracks[0].text and "geneB" in tracks[0].text
+	assert "other" not in tracks[0].text
+	assert not any(trace.meta == "query_annotation" for trace in fig.data)
+	# the lanes get their own strip left of the plot instead of x2's default full width
+	assert fig.layout.xaxis2 is not None and tuple(fig.layout.xaxis2.domain) == (0, 0.05)
+	assert tuple(fig.layout.xaxis.domain) == (0.05, 1)
+	assert fig.layout.xaxis2.domain[1] <= fig.layout.xaxis.domain[0]
+
+
+def test_malformed_paf_lines_are_skipped(tmp_path, capsys):
+	good = "q1\t1000\t0\t100\t+\tchr1\t5000\t200\t300\t100\t100\t60\tcg:Z:100M\n"
+	paf = tmp_path / "a.paf"
+	paf.write_text(good + "too\tshort\n" + "q2\t1000\tx\t100\t+\tchr1\t5000\t200\t300\t100\t100\t60\n" + "\n" + good * 3)
+	tables = dotplot.load_paf_files([str(paf)], use_cache = False, threads = 1, chunk_size = 64)
+	assert len(tables[0]) == 4
+	assert capsys.readouterr().err.count("skipped 2 malformed PAF lines") == 1
+
+
+def per_op_points(query_start, query_end, ref_start, rev, cigar):
+	# the per-alignment expansion draw_dotplot used before alignment_polyline: start point, one
+	# vertex per CIGAR op, walking the query backwards on the reverse strand
+	query_pos = query_end if rev else query_start
+	ref_pos = ref_start
+	points = [(query_pos, ref_pos)]
+	for each_chain in dotplot.cigar_parser(cigar):
+		length = int(each_chain[:-1])
+		step = -length if rev else length
+		if each_chain[-1] == "D":
+			ref_pos += length
+		elif each_chain[-1] == "I":
+			query_pos += step
+		else:
+			query_pos += step
+			ref_pos += length
+		points.append((query_pos, ref_pos))
+	return points
+
+
+def test_alignment_polyline_matches_per_op_expansion():
+	records = [
+		("q1", 0, 330, "chr1", 100, 430, False, "100M5I20M3D200M5I"),
+		("q1", 1000, 1330, "chr1", 5000, 5318, True, "100M2000D100M2000I125M"),
+		("q2", 50, 461, "chr2", 0, 406, False, "40=1X59=5I100=2D200X7I"),
+		("q2", 600, 818, "chr1", 900, 1116, True, "10X50=3D100=8I50="),
+		("q3", 0, 1000, "chr1", 0, 1000, True, None)]
+	builder = dotplot.alignment_table_builder(dsc = "test.paf")
+	for query, query_start, query_end, ref, ref_start, ref_end, rev, cigar in records:
+		builder.append(ref, ref_start, ref_end, query, query_start, query_end, rev, cigar)
+	x, y = dotplot.alignment_polyline(builder.build())
+	expected = []
+	for query, query_start, query_end, ref, ref_start, ref_end, rev, cigar in records:
+		expected.extend(per_op_points(query_start, query_end, ref_start, rev, cigar or f"{query_end - query_start}M"))
+		expected.append((None, None))
+	assert len(x) == len(expected)
+	for x_value, y_value, (query_pos, ref_pos) in zip(x.tolist(), y.tolist(), expected):
+		if query_pos is None:
+			assert x_value != x_value and y_value != y_value
+		else:
+			assert (x_value, y_value) == (query_pos, ref_pos)
+
+
+def raster_image(monkeypatch, tmp_path, **kwargs):
+	images = []
+	monkeypatch.setattr(dotplot.raster.raster_canvas, "save", lambda canvas, filename: images.append(canvas.image.copy()))
+	const = {"GRCh38_chromosome_length": {"chr1": 5000}}
+	dotplot.draw_dotplot_raster([alignments()], "chr1", const, str(tmp_path / "a.png"), **kwargs)
+	return images[0]
+
+
+def test_raster_centromere_band_is_drawn_over_the_alignments(monkeypatch, tmp_path):
+	plain = raster_image(monkeypatch, tmp_path)
+	shaded = raster_image(monkeypatch, tmp_path, reference_centromere_breakpoint = (0, 5000))
+	# a pixel of the alignment line in the middle of the band
+	line_color = dotplot.raster.parse_color("#e5ecf6") * 0.5 + dotplot.raster.parse_color(dotplot.px.colors.qualitative.Dark24[0]) * 0.5
+	line = np.flatnonzero(np.abs(plain - line_color).max(axis = 2) < 1)
+	row, column = np.unravel_index(line[len(line) // 2], plain.shape[:2])
+	band = dotplot.raster.parse_color(dotplot.px.colors.qualitative.Pastel[1])
+	assert np.allclose(shaded[row, column], plain[row, column] * 0.7 + band * 0.3, atol = 1)
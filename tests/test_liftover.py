@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dotplot
+import liftover
+
+
+def chain_index(tmp_path, q_strand):
+	chain = tmp_path / "a.chain"
+	chain.write_text(f"chain 1000 chr1 1000 + 0 1000 chrQ 1000 {q_strand} 0 1000 1\n1000\n\n")
+	return liftover.load_liftover_index(str(chain))
+
+
+def gff3_genes(tmp_path):
+	gff3 = tmp_path / "a.gff3"
+	gff3.write_text("chr1\t.\tgene\t11\t20\t.\t+\t.\tID=geneA;Name=geneA\n")
+	return dotplot.gff3_parser(str(gff3), dotplot.ref_or_query.R)
+
+
+def test_lift_annotation_table_forward_chain(tmp_path):
+	lifted = liftover.lift_annotation_table(chain_index(tmp_path, "+"), gff3_genes(tmp_path))
+	assert lifted.chrom_names == ["chrQ"]
+	assert (lifted.start.tolist(), lifted.end.tolist()) == ([11], [20])
+
+
+def test_lift_annotation_table_reverse_chain(tmp_path):
+	# 1-based closed [11, 20] is 0-based [10, 20), which lies at [980, 990) on the other strand
+	lifted = liftover.lift_annotation_table(chain_index(tmp_path, "-"), gff3_genes(tmp_path))
+	assert (lifted.start.tolist(), lifted.end.tolist()) == ([981], [990])
+	lines, _ = liftover.lift_gff3_lines(chain_index(tmp_path, "-"), [(tmp_path / "a.gff3").read_text().rstrip("\n").split("\t")], liftover.DEFAULT_MIN_MATCH)
+	assert lines[0].split("\t")[3:5] == ["981", "990"]
+
+
+def test_lift_paf_keeps_only_target_independent_tags(tmp_path):
+	record = "q\t500\t0\t100\t+\tchr1\t1000\t10\t110\t100\t100\t60\ttp:A:P\ts1:i:90\tNM:i:0\trl:i:5\tts:A:+\tcg:Z:100M".split("\t")
+	lines, _ = liftover.lift_paf_lines(chain_index(tmp_path, "+"), [record], liftover.DEFAULT_MIN_MATCH)
+	assert [tag[:2] for tag in lines[0].split("\t")[12:]] == ["rl", "ts", "cg"]
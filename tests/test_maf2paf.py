@@ -0,0 +1,35 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import maf2paf
+
+
+def convert(qry_strand):
+	# 2 reference bases before and 2 query bases after the aligned columns
+	return maf2paf.convert_maf_text(
+		"a score=10\n"
+		"s ref 10 8 + 100 GGACGTAC--\n"
+		f"s qry 5 8 {qry_strand} 100 --ACGTACTT\n"
+		"\n").rstrip("\n").split("\t")
+
+
+def test_edge_gaps_are_trimmed_from_cigar_and_coordinates():
+	paf = convert("+")
+	assert paf[2:4] == ["5", "11"]
+	assert paf[7:9] == ["12", "18"]
+	assert paf[9:11] == ["6", "6"]
+	assert paf[12] == "cg:Z:6M"
+
+
+def test_edge_gaps_are_trimmed_on_the_reverse_strand():
+	# the "-" row covers [87, 95) forward; its trailing text bases are the first forward ones
+	paf = convert("-")
+	assert paf[2:5] == ["89", "95", "-"]
+	assert paf[7:9] == ["12", "18"]
+	assert paf[12] == "cg:Z:6M"
+
+
+def test_inner_gaps_are_kept():
+	cigar, matches, block_length, trims = maf2paf.alignment_columns_to_cigar("-AC-GTA-", "TACGG-AA")
+	assert (cigar, matches, block_length, trims) == ("2M1I1M1D1M", 4, 6, (0, 0, 1, 1))
@@ -0,0 +1,68 @@
+import os
+import sys
+import struct
+import zlib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import region_index
+
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def write_bgzf(path, data, block_size = 4096):
+	# BGZF blocks of block_size uncompressed bytes, so the index has to seek across blocks
+	with open(path, "wb") as f:
+		for start in range(0, len(data), block_size):
+			block = data[start:start + block_size]
+			compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+			cdata = compressor.compress(block) + compressor.flush()
+			f.write(b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" + struct.pack("<H", len(cdata) + 25))
+			f.write(cdata + struct.pack("<II", zlib.crc32(block), len(block)))
+		f.write(BGZF_EOF)
+
+
+def paf_text():
+	rng = np.random.default_rng(2)
+	lines = []
+	for i in range(3000):
+		target = f"chr{rng.integers(1, 4)}"
+		start = int(rng.integers(0, 50000000))
+		lines.append(f"q{i % 7}\t1000000\t{i}\t{i + 500}\t+\t{target}\t60000000\t{start}\t{start + 500}\t500\t500\t60")
+		if i % 500 == 0:
+			lines.append("truncated\tline")
+			lines.append(f"q\t1000000\tx\t500\t+\t{target}\t60000000\t{start}\t{start + 500}\t500\t500\t60")
+	return "\n".join(lines) + "\n"
+
+
+def selected(lines, target, region):
+	out = []
+	for line in lines:
+		cols = line.rstrip("\n").split("\t")
+		if len(cols) < 12 or cols[5] != target or not cols[7].isdigit():
+			continue
+		if region is None or (int(cols[7]) < region[1] and int(cols[8]) > region[0]):
+			out.append(line.rstrip("\n"))
+	return out
+
+
+def check_ranges(filename, capsys):
+	full = list(region_index.iter_lines(filename))
+	for target, region in [("chr1", None), ("chr2", (10000000, 12000000)), ("chr3", (0, 1000000)), ("chr9", None)]:
+		ranges = region_index.ranges_for(filename, "paf", target_filter = lambda name: name == target, target_region = region)
+		assert ranges == region_index.lookup(region_index.load_or_build_index(filename, "paf"), lambda name: name == target, target_region = region)
+		assert selected(region_index.iter_lines(filename, ranges), target, region) == selected(full, target, region)
+	assert "skipped 12 malformed PAF lines" in capsys.readouterr().err
+
+
+def test_ranges_match_full_scan_plain(tmp_path, capsys):
+	paf = tmp_path / "a.paf"
+	paf.write_text(paf_text())
+	check_ranges(str(paf), capsys)
+
+
+def test_ranges_match_full_scan_bgzf(tmp_path, capsys):
+	paf = tmp_path / "a.paf.gz"
+	write_bgzf(str(paf), paf_text().encode())
+	assert region_index.compression_type(str(paf)) == "bgzf"
+	check_ranges(str(paf), capsys)
@@ -0,0 +1,29 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import split_paf
+
+
+def paf_record(matches, cigar):
+	return ["q", "1000", "0", "300", "+", "chr1", "5000", "100", "450", str(matches), "350", "60", f"cg:Z:{cigar}"]
+
+
+def test_pieces_of_m_ops_in_a_mixed_cigar_keep_matches():
+	# 100 "=" + 100 "M" (90 matches left for it) | 50D | 100 "M"
+	pieces = split_paf.split_paf(paf_record(280, "100=100M50D100M"), threshold = 10)
+	assert len(pieces) == 2
+	assert [int(piece[9]) for piece in pieces] == [190, 90]
+	assert pieces[1][12] == "cg:Z:100M"
+
+
+def test_matches_without_eq_ops_follow_the_m_ratio():
+	pieces = split_paf.split_paf(paf_record(150, "100M50D200M"), threshold = 10)
+	assert [int(piece[9]) for piece in pieces] == [50, 100]
+
+
+def test_only_piece_safe_tags_are_copied():
+	record = paf_record(150, "100M50D200M")
+	record[12:12] = ["tp:A:P", "cm:i:40", "s1:i:200", "s2:i:0", "NM:i:60", "rl:i:12", "ts:A:+"]
+	for piece in split_paf.split_paf(record, threshold = 10):
+		assert [tag[:2] for tag in piece[12:]] == ["ts", "cg"]
@@ -0,0 +1,97 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import dotplot
+import synteny
+
+
+def brute_force_scores(ref_start, ref_end, query_start, query_end, max_gap, overlap):
+	# the O(n^2) DP chain_anchors replaces
+	weight = np.minimum(ref_end - ref_start, query_end - query_start)
+	score = np.zeros(len(ref_start), dtype = np.int64)
+	for i in np.argsort(ref_start, kind = "stable"):
+		best = 0
+		for j in range(len(ref_start)):
+			if j != i and score[j] > 0 and ref_start[i] - max_gap <= ref_end[j] <= ref_start[i] + overlap and query_start[i] - max_gap <= query_end[j] <= query_start[i] + overlap:
+				best = max(best, score[j])
+		score[i] = best + weight[i]
+	return score
+
+
+def test_chain_anchors_matches_brute_force():
+	rng = np.random.default_rng(1)
+	for _ in range(20):
+		n = 60
+		# anchors longer than overlap, so a predecessor always starts earlier on the reference
+		ref_start = rng.choice(200000, n, replace = False).astype(np.int64)
+		ref_end = ref_start + rng.integers(2000, 8000, n)
+		query_start = rng.integers(0, 200000, n).astype(np.int64)
+		query_end = query_start + rng.integers(2000, 8000, n)
+		score, pred = synteny.chain_anchors(ref_start, ref_end, query_start, query_end, max_gap = 20000, overlap = 1000)
+		assert score.tolist() == brute_force_scores(ref_start, ref_end, query_start, query_end, 20000, 1000).tolist()
+		weight = np.minimum(ref_end - ref_start, query_end - query_start)
+		chained = pred >= 0
+		assert (score[chained] == score[pred[chained]] + weight[chained]).all()
+
+
+def anchor_table(pieces, lengths, step = 10000, size = 9000):
+	# pieces: (ref_chrom, ref_start, ref_end, query_chrom, query_start, rev), cut into anchors of
+	# size bp every step bp
+	builder = dotplot.alignment_table_builder(dsc = "test.paf")
+	for ref_chrom, ref_start, ref_end, query_chrom, query_start, rev in pieces:
+		for offset in range(0, ref_end - ref_start, step):
+			anchor = min(size, ref_end - ref_start - offset)
+			if rev:
+				q_end = query_start + (ref_end - ref_start) - offset
+				q_start = q_end - anchor
+			else:
+				q_start = query_start + offset
+				q_end = q_start + anchor
+			builder.append(ref_chrom, ref_start + offset, ref_start + offset + anchor, query_chrom, q_start, q_end, rev, ref_length = lengths[ref_chrom], query_length = lengths[query_chrom])
+	return builder.build()
+
+
+def block_rows(blocks):
+	names = blocks.chrom_names
+	return [(names[q], int(s), int(e), bool(r), flag) for q, s, e, r, flag in zip(blocks.query_chrom.tolist(), blocks.ref_start.tolist(), blocks.ref_end.tolist(), blocks.rev.tolist(), blocks.flag_names())]
+
+
+def test_inversion_and_translocation_in_chromosome_assembly():
+	lengths = {"chr1": 10000000, "q1": 10000000, "q2": 5000000}
+	table = anchor_table([
+		("chr1", 0, 4000000, "q1", 0, False),
+		("chr1", 4000000, 4500000, "q2", 2000000, False),
+		("chr1", 4500000, 6000000, "q1", 4500000, False),
+		("chr1", 6000000, 6500000, "q1", 6000000, True),
+		("chr1", 6500000, 10000000, "q1", 6500000, False)], lengths)
+	blocks = synteny.synteny_chain(table)
+	rows = block_rows(blocks)
+	assert ("q2", 4000000, 4499000, False, "translocation") in rows
+	assert ("q1", 6000000, 6499000, True, "inversion") in rows
+	assert sum(flag != "." for *_, flag in rows) == 2
+	chrom, start, end, kind = synteny.breakpoints(blocks)
+	assert sorted(kind.tolist()) == ["inversion", "inversion", "translocation", "translocation"]
+
+
+def test_contig_junctions_are_not_translocations():
+	# contigs tiling the reference, and a whole contig between two pieces of another one
+	lengths = {"chr1": 10000000, "c1": 6000000, "c2": 1000000, "c3": 3000000}
+	table = anchor_table([
+		("chr1", 0, 3000000, "c1", 0, False),
+		("chr1", 3000000, 4000000, "c2", 0, False),
+		("chr1", 4000000, 7000000, "c1", 3000000, False),
+		("chr1", 7000000, 10000000, "c3", 0, False)], lengths)
+	blocks = synteny.synteny_chain(table)
+	assert all(flag == "." for *_, flag in block_rows(blocks))
+	assert len(synteny.breakpoints(blocks)[0]) == 0
+
+
+def test_small_insertions_are_not_translocations():
+	lengths = {"chr1": 10000000, "q1": 10000000, "q2": 5000000}
+	table = anchor_table([
+		("chr1", 0, 4000000, "q1", 0, False),
+		("chr1", 4000000, 4005000, "q2", 2000000, False),
+		("chr1", 4005000, 10000000, "q1", 4005000, False)], lengths)
+	assert all(flag == "." for *_, flag in block_rows(synteny.synteny_chain(table, min_translocation = 10000)))
@@ -0,0 +1,346 @@
+#! /usr/bin/env python3
+
+import sys
+import os
+import json
+import zlib
+import struct
+import argparse
+import http.server
+import plotly.express as px
+import numpy as np
+import dotplot
+import raster
+
+MAGIC = b"DPTILES1"
+TILE_SIZE = 256
+DEFAULT_MIN_BP = 1000
+MAX_LEVELS = 16
+TILE_ENTRY = np.dtype([("level", "<i4"), ("x", "<i4"), ("y", "<i4"), ("offset", "<i8"), ("length", "<i8")])
+
+
+def sum_by_key(keys, counts):
+	keys = np.concatenate(keys + [np.zeros(0, dtype = np.int64)])
+	counts = np.concatenate(counts + [np.zeros(0, dtype = np.int64)])
+	unique_keys, inverse = np.unique(keys, return_inverse = True)
+	return unique_keys, np.bincount(inverse, weights = counts, minlength = len(unique_keys)).astype(np.int64)
+
+
+def deepest_level_counts(table, pixel_bp, side):
+	# sparse pixel -> number of samples of the alignment polylines at the deepest level
+	x, y = dotplot.alignment_polyline(table, tolerance = pixel_bp)
+	keys = []
+	counts = []
+	for sample_x, sample_y in raster.sample_segments(x / pixel_bp, y / pixel_bp, (0, 0, side, side)):
+		key, count = np.unique(sample_x * side + sample_y, return_counts = True)
+		keys.append(key)
+		counts.append(count)
+	key, count = sum_by_key(keys, counts)
+	return key // side, key % side, count
+
+
+def parent_pixels(x, y, count, parent_side):
+	# sums 2 x 2 blocks of pixels into the level above
+	key, count = sum_by_key([(x >> 1) * parent_side + (y >> 1)], [count])
+	return key // parent_side, key % parent_side, count
+
+
+def build_pyramid(tables, out_file_name, levels = None, min_bp = DEFAULT_MIN_BP, tile_size = TILE_SIZE, ref_lengths = None, query_lengths = None):
+	# Quadtree of density tiles over the concatenated query (x) and reference (y) genomes. Level z
+	# has 2^z x 2^z tiles of tile_size x tile_size pixels, and a pixel holds, per input table, the
+	# number of polyline samples falling in it at the deepest level. The deepest level is
+	# aggregated from the alignments, every other level by summing 2 x 2 pixels of the one below.
+	# File layout: MAGIC, uint64 offset of the index, the tiles, then the index: uint32 header
+	# length, JSON header and a TILE_ENTRY table. A tile is zlib compressed uint32 pairs of
+	# (table * tile_size + row) * tile_size + column and count, one per non-empty pixel.
+	ref_layout = dotplot.genome_layout(tables, "ref", ref_lengths)
+	query_layout = dotplot.genome_layout(tables, "query", query_lengths)
+	extent = max(sum(length for _, _, length in ref_layout), sum(length for _, _, length in query_layout), 1)
+	if levels is None:
+		levels = int(np.clip(np.ceil(np.log2(max(extent / (tile_size * min_bp), 1))), 0, MAX_LEVELS - 1)) + 1
+	side = tile_size << (levels - 1)
+	pixel_bp = extent / side
+	pixels = [deepest_level_counts(dotplot.genome_table(table, ref_layout, query_layout), pixel_bp, side) for table in tables]
+
+	entries = []
+	level_max = [0] * levels
+	with open(out_file_name, "wb") as f:
+		f.write(MAGIC + struct.pack("<Q", 0))
+		for level in range(levels - 1, -1, -1):
+			if level < levels - 1:
+				pixels = [parent_pixels(x, y, count, tile_size << level) for x, y, count in pixels]
+			file_index = np.concatenate([np.full(len(x), i, dtype = np.int64) for i, (x, _, _) in enumerate(pixels)])
+			x = np.concatenate([x for x, _, _ in pixels])
+			y = np.concatenate([y for _, y, _ in pixels])
+			count = np.concatenate([count for _, _, count in pixels])
+			if len(count):
+				level_max[level] = int(count.max())
+			tile_key = (x // tile_size) * (1 << level) + y // tile_size
+			order = np.argsort(tile_key, kind = "stable")
+			tile_key, file_index, x, y, count = tile_key[order], file_index[order], x[order], y[order], count[order]
+			bounds = np.flatnonzero(np.diff(tile_key)) + 1
+			for start, end in zip(np.concatenate(([0], bounds)).tolist(), np.concatenate((bounds, [len(tile_key)])).tolist()):
+				if start == end:
+					continue
+				tile = np.empty((end - start, 2), dtype = "<u4")
+				tile[:, 0] = (file_index[start:end] * tile_size + y[start:end] % tile_size) * tile_size + x[start:end] % tile_size
+				tile[:, 1] = np.minimum(count[start:end], 0xFFFFFFFF)
+				blob = zlib.compress(tile.tobytes(), 6)
+				entries.append((level, int(x[start]) // tile_size, int(y[start]) // tile_size, f.tell(), len(blob)))
+				f.write(blob)
+		index_offset = f.tell()
+		header = json.dumps({
+			"tile_size": tile_size,
+			"levels": levels,
+			"extent": extent,
+			"level_max": level_max,
+			"files": [str(table.dsc).split("/")[-1] for table in tables],
+			"colors": [px.colors.qualitative.Dark24[i % 24] for i in range(len(tables))],
+			"query": query_layout,
+			"ref": ref_layout
+		}).encode()
+		f.write(struct.pack("<I", len(header)) + header)
+		f.write(np.array(entries, dtype = TILE_ENTRY).tobytes())
+		f.seek(len(MAGIC))
+		f.write(struct.pack("<Q", index_offset))
+	return len(entries)
+
+
+class tile_pyramid_reader():
+	def __init__(self, filename):
+		self.fd = os.open(filename, os.O_RDONLY)
+		if os.pread(self.fd, len(MAGIC), 0) != MAGIC:
+			raise ValueError(f"{filename} is not a tile pyramid")
+		index_offset = struct.unpack("<Q", os.pread(self.fd, 8, len(MAGIC)))[0]
+		header_length = struct.unpack("<I", os.pread(self.fd, 4, index_offset))[0]
+		self.header = json.loads(os.pread(self.fd, header_length, index_offset + 4))
+		entry_bytes = os.fstat(self.fd).st_size - index_offset - 4 - header_length
+		entries = np.frombuffer(os.pread(self.fd, entry_bytes, index_offset + 4 + header_length), dtype = TILE_ENTRY)
+		self.tiles = {(int(level), int(x), int(y)): (int(offset), int(length)) for level, x, y, offset, length in entries.tolist()}
+
+	def close(self):
+		os.close(self.fd)
+
+	def tile_blob(self, level, x, y):
+		# zlib compressed tile, or None for an empty one. pread keeps concurrent requests apart.
+		entry = self.tiles.get((level, x, y))
+		if entry is None:
+			return None
+		return os.pread(self.fd, entry[1], entry[0])
+
+	def tile(self, level, x, y):
+		blob = self.tile_blob(level, x, y)
+		# dense (tables, tile_size, tile_size) counts
+		size = self.header["tile_size"]
+		tile = np.zeros(len(self.header["files"]) * size * size, dtype = np.uint32)
+		if blob is not None:
+			pairs = np.frombuffer(zlib.decompress(blob), dtype = "<u4").reshape(-1, 2)
+			tile[pairs[:, 0]] = pairs[:, 1]
+		return tile.reshape(-1, size, size)
+
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>dotplot</title>
+<style>
+body { margin: 0; overflow: hidden; font: 12px sans-serif; color: #2a3f5f; }
+canvas { display: block; cursor: grab; }
+#status { position: fixed; left: 8px; bottom: 6px; background: rgba(255,255,255,0.8); padding: 2px 4px; }
+#legend { position: fixed; right: 8px; top: 6px; background: rgba(255,255,255,0.8); padding: 2px 4px; }
+</style></head>
+<body><canvas id="plot"></canvas><div id="status"></div><div id="legend"></div>
+<script>
+const canvas = document.getElementById("plot");
+const ctx = canvas.getContext("2d");
+const tiles = new Map();
+let meta = null;
+// view: x0/y0 are the query/reference bp at the top left corner, scale is bp per screen pixel
+const view = { x0: 0, y0: 0, scale: 1 };
+
+function rgb(hex) { return [1, 3, 5].map(i => parseInt(hex.substr(i, 2), 16)); }
+
+function locate(layout, position) {
+	let low = 0, high = layout.length - 1;
+	while (low < high) { const mid = (low + high + 1) >> 1; if (layout[mid][1] <= position) low = mid; else high = mid - 1; }
+	const [name, offset] = layout[low] || ["", 0];
+	return name + ":" + Math.round(position - offset).toLocaleString();
+}
+
+function tileCanvas(z, buffer) {
+	// composite the per file counts of one tile, log scaled against the densest pixel of the level
+	const size = meta.tile_size, pairs = new Uint32Array(buffer), image = new ImageData(size, size);
+	const counts = new Uint32Array(meta.files.length * size * size);
+	for (let i = 0; i < pairs.length; i += 2) counts[pairs[i]] = pairs[i + 1];
+	const norm = Math.log1p(meta.level_max[z] || 1), colors = meta.colors.map(rgb);
+	for (let p = 0; p < size * size; p++) {
+		let r = 255, g = 255, b = 255, a = 0;
+		for (let f = 0; f < colors.length; f++) {
+			const c = counts[f * size * size + p];
+			if (!c) continue;
+			const alpha = 0.35 + 0.65 * Math.log1p(c) / norm;
+			r += (colors[f][0] - r) * alpha; g += (colors[f][1] - g) * alpha; b += (colors[f][2] - b) * alpha; a = 255;
+		}
+		image.data.set([r, g, b, a], p * 4);
+	}
+	const tile = document.createElement("canvas");
+	tile.width = tile.height = size;
+	tile.getContext("2d").putImageData(image, 0, 0);
+	return tile;
+}
+
+function request(z, x, y) {
+	const key = z + "/" + x + "/" + y;
+	if (tiles.has(key)) return tiles.get(key);
+	tiles.set(key, "pending");
+	fetch("tile/" + key).then(response => response.status == 200 ? response.arrayBuffer() : null).then(buffer => {
+		tiles.set(key, buffer ? tileCanvas(z, buffer) : "empty");
+		draw();
+	});
+	return "pending";
+}
+
+function drawTile(z, x, y, dx, dy, size, sx = 0, sy = 0, ss = meta.tile_size) {
+	// a tile that is still loading is replaced by the matching part of its parent
+	const tile = request(z, x, y);
+	if (tile instanceof HTMLCanvasElement) ctx.drawImage(tile, sx, sy, ss, ss, dx, dy, size, size);
+	else if (tile == "pending" && z > 0) drawTile(z - 1, x >> 1, y >> 1, dx, dy, size, (sx + (x & 1) * meta.tile_size) / 2, (sy + (y & 1) * meta.tile_size) / 2, ss / 2);
+}
+
+function draw() {
+	const width = canvas.width, height = canvas.height;
+	ctx.fillStyle = "#e5ecf6";
+	ctx.fillRect(0, 0, width, height);
+	ctx.imageSmoothingEnabled = false;
+	const z = Math.max(0, Math.min(meta.levels - 1, Math.round(Math.log2(meta.extent / (meta.tile_size * view.scale)))));
+	const tileBp = meta.extent / (1 << z), size = tileBp / view.scale;
+	for (let x = Math.max(0, Math.floor(view.x0 / tileBp)); x <= Math.min((1 << z) - 1, Math.floor((view.x0 + width * view.scale) / tileBp)); x++)
+		for (let y = Math.max(0, Math.floor(view.y0 / tileBp)); y <= Math.min((1 << z) - 1, Math.floor((view.y0 + height * view.scale) / tileBp)); y++)
+			drawTile(z, x, y, (x * tileBp - view.x0) / view.scale, (y * tileBp - view.y0) / view.scale, size);
+	// chromosome boundaries and names
+	ctx.strokeStyle = "#ffffff"; ctx.fillStyle = "#2a3f5f";
+	let last = -Infinity;
+	for (const [name, offset] of meta.query) {
+		const px = (offset - view.x0) / view.scale;
+		ctx.beginPath(); ctx.moveTo(px, 0); ctx.lineTo(px, height); ctx.stroke();
+		if (px - last > 40) { ctx.fillText(name, px + 2, 12); last = px; }
+	}
+	last = -Infinity;
+	for (const [name, offset] of meta.ref) {
+		const py = (offset - view.y0) / view.scale;
+		ctx.beginPath(); ctx.moveTo(0, py); ctx.lineTo(width, py); ctx.stroke();
+		if (py - last > 16) { ctx.fillText(name, 2, py + 12); last = py; }
+	}
+}
+
+function resize() { canvas.width = window.innerWidth; canvas.height = window.innerHeight; if (meta) draw(); }
+
+let drag = null;
+canvas.addEventListener("mousedown", e => { drag = [e.clientX, e.clientY]; canvas.style.cursor = "grabbing"; });
+window.addEventListener("mouseup", () => { drag = null; canvas.style.cursor = "grab"; });
+canvas.addEventListener("mousemove", e => {
+	if (drag) {
+		view.x0 -= (e.clientX - drag[0]) * view.scale; view.y0 -= (e.clientY - drag[1]) * view.scale;
+		drag = [e.clientX, e.clientY]; draw();
+	}
+	document.getElementById("status").textContent = "query " + locate(meta.query, view.x0 + e.clientX * view.scale) + "  reference " + locate(meta.ref, view.y0 + e.clientY * view.scale);
+});
+canvas.addEventListener("wheel", e => {
+	e.preventDefault();
+	const factor = Math.exp(e.deltaY * 0.002), x = view.x0 + e.clientX * view.scale, y = view.y0 + e.clientY * view.scale;
+	view.scale *= factor; view.x0 = x - e.clientX * view.scale; view.y0 = y - e.clientY * view.scale; draw();
+}, { passive: false });
+
+fetch("meta").then(response => response.json()).then(header => {
+	meta = header;
+	document.getElementById("legend").innerHTML = meta.files.map((name, i) => '<span style="color:' + meta.colors[i] + '">&#9632;</span> ' + name).join("<br>");
+	resize();
+	view.scale = meta.extent / Math.min(canvas.width, canvas.height);
+	draw();
+});
+window.addEventListener("resize", resize);
+</script></body></html>
+"""
+
+
+def tile_handler(pyramid):
+	class handler(http.server.BaseHTTPRequestHandler):
+		def send(self, status, body = b"", content_type = "application/octet-stream", headers = None):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			for key, value in (headers or {}).items():
+				self.send_header(key, value)
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self):
+			path = self.path.split("?")[0].strip("/").split("/")
+			if path == [""]:
+				self.send(200, VIEWER_HTML.encode(), "text/html; charset=utf-8")
+			elif path == ["meta"]:
+				self.send(200, json.dumps(pyramid.header).encode(), "application/json")
+			elif len(path) == 4 and path[0] == "tile" and all(part.isdigit() for part in path[1:]):
+				blob = pyramid.tile_blob(*[int(part) for part in path[1:]])
+				if blob is None:
+					self.send(204)
+				else:
+					# zlib data is what HTTP calls deflate, so the browser inflates it
+					self.send(200, blob, headers = {"Content-Encoding": "deflate", "Cache-Control": "max-age=3600"})
+			else:
+				self.send(404)
+
+		def log_message(self, format, *args):
+			pass
+	return handler
+
+
+def serve(filename, host = "127.0.0.1", port = 8000):
+	pyramid = tile_pyramid_reader(filename)
+	server = http.server.ThreadingHTTPServer((host, port), tile_handler(pyramid))
+	print(f"serving {filename} on http://{host}:{server.server_address[1]}/", file = sys.stderr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		pyramid.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Build a multi-resolution tile pyramid of whole-genome alignments and browse it with a local HTTP server.')
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+	build_parser = subparsers.add_parser("build", help = 'aggregate PAF/chain files into a tile pyramid file')
+	build_parser.add_argument("PAFfilename", metavar='PAF', type=str, nargs='*', help='PAF file(s)')
+	build_parser.add_argument("-o", metavar='FileName', type=str, required = True, help='output tile pyramid file (e.g. genome.dpt)')
+	build_parser.add_argument("--chain", metavar='chain', type=str, help='chain file')
+	build_parser.add_argument("--sf", action='store_true', help='switch ref/query in the chain file')
+	build_parser.add_argument("--chain_merge_gap", metavar='bp', type=int, help='join neighbouring chain blocks whose gaps are at most this size (bp)')
+	build_parser.add_argument("--ref_fai", metavar='fai', type=str, help='.fai index of the reference genome; its sequences and lengths define the reference axis (the chromosomes in the alignments as default)')
+	build_parser.add_argument("--query_fai", metavar='fai', type=str, help='.fai index of the query genome')
+	build_parser.add_argument("--levels", metavar='N', type=int, help='number of zoom levels (default: until a pixel of the deepest level is about --min_bp)')
+	build_parser.add_argument("--min_bp", metavar='bp', type=float, default = DEFAULT_MIN_BP, help=f'bp per pixel of the deepest level when --levels is not given ({DEFAULT_MIN_BP} as default)')
+	build_parser.add_argument("--threads", metavar='N', type=int, default = os.cpu_count(), help='worker processes for reading PAF files (number of CPUs as default)')
+	build_parser.add_argument("--no-cache", dest='no_cache', action='store_true', help='do not read or write the parse cache')
+	serve_parser = subparsers.add_parser("serve", help = 'serve a tile pyramid file and its viewer')
+	serve_parser.add_argument("pyramid", metavar='FileName', type=str, help='tile pyramid file')
+	serve_parser.add_argument("--host", metavar='host', type=str, default = "127.0.0.1", help='address to listen on (127.0.0.1 as default)')
+	serve_parser.add_argument("--port", metavar='port', type=int, default = 8000, help='port to listen on (8000 as default)')
+	args = parser.parse_args()
+
+	if args.command == "serve":
+		serve(args.pyramid, host = args.host, port = args.port)
+		return
+	use_cache = not args.no_cache
+	tables = dotplot.load_paf_files(args.PAFfilename, use_cache = use_cache, threads = args.threads) if args.PAFfilename else []
+	if args.chain is not None:
+		tables.append(dotplot.load_chain(args.chain, switchflag = args.sf, use_cache = use_cache, merge_gap = args.chain_merge_gap))
+	if not tables:
+		parser.error("give PAF file(s) and/or --chain")
+	ref_lengths = dotplot.fai_lengths(args.ref_fai) if args.ref_fai is not None else None
+	query_lengths = dotplot.fai_lengths(args.query_fai) if args.query_fai is not None else None
+	tile_count = build_pyramid(tables, args.o, levels = args.levels, min_bp = args.min_bp, ref_lengths = ref_lengths, query_lengths = query_lengths)
+	print(f"wrote {args.o}: {tile_count} tiles", file = sys.stderr)
+
+
+if __name__ == "__main__":
+	main()